@@ -3,7 +3,7 @@ import pytest
 from django.conf import settings
 from django.contrib.auth.models import User
 
-from core.models import Category, Post, Profile, Tag
+from core.models import Category, Post, Tag
 
 
 def pytest_configure(config):  # noqa: ARG001
@@ -27,6 +27,7 @@ def pytest_configure(config):  # noqa: ARG001
                 "core",
             ],
             MIDDLEWARE=[
+                "core.server_timing.ServerTimingMiddleware",
                 "django.middleware.security.SecurityMiddleware",
                 "django.contrib.sessions.middleware.SessionMiddleware",
                 "django.middleware.common.CommonMiddleware",
@@ -34,6 +35,7 @@ def pytest_configure(config):  # noqa: ARG001
                 "django.contrib.auth.middleware.AuthenticationMiddleware",
                 "django.contrib.messages.middleware.MessageMiddleware",
                 "django.middleware.clickjacking.XFrameOptionsMiddleware",
+                "core.query_budget.QueryBudgetMiddleware",
             ],
             SECRET_KEY="test-key",
             USE_TZ=True,
@@ -41,6 +43,31 @@ def pytest_configure(config):  # noqa: ARG001
     django.setup()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Start every test with an empty cache and view count buffer"""
+    from django.core.cache import cache
+
+    from core.counters import view_counter
+
+    cache.clear()
+    if view_counter.buffer is not None:
+        view_counter.buffer.drain()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def enforce_query_budgets(settings):
+    """Fail any request that exceeds the query budget of its URL"""
+    settings.QUERY_BUDGET_MODE = "raise"
+
+
+@pytest.fixture(autouse=True)
+def publish_comments_inline(settings):
+    """Publish comments before add_comment responds, unless a test opts out"""
+    settings.COMMENT_WORKERS = 0
+
+
 @pytest.fixture
 def user():
     """Create a test user"""
@@ -80,4 +107,7 @@ def post(user, category):
 @pytest.fixture
 def profile(user):
     """Create a test profile"""
-    return Profile.objects.create(user=user, bio="Test bio", location="Test City")
+    profile = user.profile
+    profile.bio, profile.location = "Test bio", "Test City"
+    profile.save()
+    return profile
@@ -1,12 +1,27 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.forms.models import BaseInlineFormSet
 
+from .counters import rebuild_comment_stats
 from .models import Category, Comment, Post, Profile, Tag
+from .page_cache import invalidate_tags
+
+
+class ProfileInlineFormSet(BaseInlineFormSet):
+    def save_new(self, form, commit=True):
+        # Saving the new user already created its profile; update that one
+        existing = Profile.objects.filter(user=self.instance).first()
+        if existing is not None:
+            form.instance.pk = existing.pk
+            form.instance.created_at = existing.created_at
+            form.instance._state.adding = False
+        return super().save_new(form, commit)
 
 
 class ProfileInline(admin.StackedInline):
     model = Profile
+    formset = ProfileInlineFormSet
     can_delete = False
     verbose_name_plural = "Profile"
 
@@ -21,12 +36,13 @@ class CategoryAdmin(admin.ModelAdmin):
     list_filter = ["is_active", "created_at"]
     search_fields = ["name", "description"]
     prepopulated_fields = {"slug": ("name",)}
-    readonly_fields = ["created_at", "updated_at"]
+    readonly_fields = ["post_count", "created_at", "updated_at"]
 
     def post_count(self, obj):
-        return obj.posts.count()
+        return obj.post_count
 
     post_count.short_description = "Posts"  # type: ignore
+    post_count.admin_order_field = "post_count"  # type: ignore
 
 
 @admin.register(Tag)
@@ -34,12 +50,13 @@ class TagAdmin(admin.ModelAdmin):
     list_display = ["name", "slug", "post_count", "created_at"]
     search_fields = ["name"]
     prepopulated_fields = {"slug": ("name",)}
-    readonly_fields = ["created_at", "updated_at"]
+    readonly_fields = ["post_count", "created_at", "updated_at"]
 
     def post_count(self, obj):
-        return obj.posts.count()
+        return obj.post_count
 
     post_count.short_description = "Posts"  # type: ignore
+    post_count.admin_order_field = "post_count"  # type: ignore
 
 
 @admin.register(Post)
@@ -51,19 +68,33 @@ class PostAdmin(admin.ModelAdmin):
         "is_published",
         "published_at",
         "views_count",
+        "comment_count",
         "created_at",
     ]
     list_filter = ["is_published", "category", "created_at", "published_at", "tags"]
     search_fields = ["title", "content", "excerpt"]
     prepopulated_fields = {"slug": ("title",)}
-    readonly_fields = ["created_at", "updated_at", "views_count", "published_at"]
+    readonly_fields = [
+        "created_at",
+        "updated_at",
+        "views_count",
+        "comment_count",
+        "last_comment_at",
+        "published_at",
+    ]
     filter_horizontal = ["tags"]
 
     fieldsets = (
         ("Basic Information", {"fields": ("title", "slug", "author", "category")}),
         ("Content", {"fields": ("excerpt", "content", "featured_image")}),
         ("Publishing", {"fields": ("is_published", "published_at", "tags")}),
-        ("Statistics", {"fields": ("views_count",), "classes": ("collapse",)}),
+        (
+            "Statistics",
+            {
+                "fields": ("views_count", "comment_count", "last_comment_at"),
+                "classes": ("collapse",),
+            },
+        ),
         (
             "Timestamps",
             {"fields": ("created_at", "updated_at"), "classes": ("collapse",)},
@@ -85,6 +116,7 @@ class CommentAdmin(admin.ModelAdmin):
     list_filter = ["is_approved", "created_at"]
     search_fields = ["content", "author__username", "post__title"]
     readonly_fields = ["created_at", "updated_at"]
+    actions = ["approve_comments", "unapprove_comments"]
 
     def comment_preview(self, obj):
         return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
@@ -94,6 +126,24 @@ class CommentAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related("author", "post")
 
+    def _set_approval(self, queryset, is_approved):
+        # Bulk updates bypass the signals, so refresh the post stats here
+        post_ids = set(queryset.values_list("post_id", flat=True))
+        updated = queryset.update(is_approved=is_approved)
+        rebuild_comment_stats(post_ids)
+        invalidate_tags("comments", *(f"post:{pk}" for pk in post_ids))
+        return updated
+
+    @admin.action(description="Approve selected comments")
+    def approve_comments(self, request, queryset):
+        updated = self._set_approval(queryset, True)
+        self.message_user(request, f"{updated} comments approved.")
+
+    @admin.action(description="Unapprove selected comments")
+    def unapprove_comments(self, request, queryset):
+        updated = self._set_approval(queryset, False)
+        self.message_user(request, f"{updated} comments unapproved.")
+
 
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
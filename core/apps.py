@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        from django.core import checks
+
+        from . import signals  # noqa: F401
+        from .assets import check_vendored_assets
+
+        checks.register(check_vendored_assets, checks.Tags.staticfiles, deploy=True)
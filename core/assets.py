@@ -0,0 +1,444 @@
+"""
+Self-hosted front-end assets.
+
+Bootstrap and Font Awesome are served from ``static/vendor/`` instead of
+public CDNs. ``manage.py vendor_assets`` downloads the pinned npm releases
+in ``PACKAGES``, checks them against the registry's published integrity
+hash, and writes the files the site needs after tree-shaking the CSS: rules
+whose class selectors never appear in the templates, the Python sources or
+the vendored JavaScript are dropped (``SAFELIST`` keeps classes built at
+render time, such as ``alert-{{ message.tags }}``), and ``@font-face``
+rules keep only the fonts that are vendored (Font Awesome's solid WOFF2).
+Source map references are removed so the manifest storage does not look
+for maps that are not shipped.
+
+Templates link assets with ``{% asset %}``, which falls back to the same
+files on jsDelivr until they have been vendored.
+
+The ``staticfiles`` storage (``core.storage.CompressedManifestStaticFilesStorage``)
+fingerprints the names at ``collectstatic`` time and writes ``.gz`` and
+``.br`` copies next to them; ``serve_static`` picks the best precompressed
+variant for the client and caches fingerprinted files for a year.
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import tarfile
+import urllib.request
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import checks
+from django.templatetags.static import static
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views import static as static_views
+
+from .storage import IMMUTABLE_MAX_AGE
+
+REGISTRY_URL = "https://registry.npmjs.org"
+CDN_URL = "https://cdn.jsdelivr.net/npm"
+
+# npm package -> (version, {file in the package: path under STATICFILES_DIRS})
+PACKAGES = {
+    "bootstrap": (
+        "5.1.3",
+        {
+            "dist/css/bootstrap.min.css": "vendor/bootstrap/css/bootstrap.min.css",
+            "dist/js/bootstrap.bundle.min.js": (
+                "vendor/bootstrap/js/bootstrap.bundle.min.js"
+            ),
+        },
+    ),
+    "@fortawesome/fontawesome-free": (
+        "6.0.0",
+        {
+            "css/all.min.css": "vendor/fontawesome/css/all.min.css",
+            "webfonts/fa-solid-900.woff2": (
+                "vendor/fontawesome/webfonts/fa-solid-900.woff2"
+            ),
+        },
+    ),
+}
+
+# Classes only assembled at render time, so absent from the sources
+SAFELIST = [re.compile(r"^alert-")]
+
+# Files whose contents count as "using" a class
+TOKEN_SOURCES = ("templates/**/*.html", "core/**/*.py")
+
+TOKEN_RE = re.compile(r"[A-Za-z_][\w-]*")
+CLASS_RE = re.compile(r"\.(-?[_a-zA-Z](?:[\w-]|\\.)*)")
+NOT_RE = re.compile(r":not\((?:[^()]|\([^()]*\))*\)")
+ATTRIBUTE_RE = re.compile(r"\[[^\]]*\]")
+URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+SOURCE_MAP_RE = re.compile(r"/\*# sourceMappingURL=[^*]*\*/|//# sourceMappingURL=\S*")
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{12}\.\w+$")
+
+
+class AssetError(Exception):
+    pass
+
+
+# Vendoring
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=30) as response:  # noqa: S310
+        return response.read()
+
+
+def verify_integrity(data, integrity):
+    """
+    Raise ``AssetError`` unless ``data`` matches the SRI string ``integrity``
+    """
+    algorithm, _, expected = integrity.partition("-")
+    if algorithm not in ("sha256", "sha384", "sha512"):
+        raise AssetError(f"Unsupported integrity algorithm {algorithm!r}")
+    digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+    if digest != expected:
+        raise AssetError(f"Integrity check failed ({algorithm})")
+
+
+def download_package(name, version):
+    """
+    Return ``{path: bytes}`` of the verified npm tarball of ``name``
+    """
+    metadata = json.loads(fetch(f"{REGISTRY_URL}/{name}/{version}"))
+    dist = metadata["dist"]
+    tarball = fetch(dist["tarball"])
+    verify_integrity(tarball, dist["integrity"])
+    files = {}
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode="r:gz") as archive:
+        for member in archive.getmembers():
+            if member.isfile():
+                # Entries live under a top-level "package/" directory
+                path = member.name.split("/", 1)[-1]
+                files[path] = archive.extractfile(member).read()
+    return files
+
+
+def used_tokens(base_dir, extra_sources=()):
+    """
+    Return every identifier-like token of the project sources (and of
+    ``extra_sources`` strings), a superset of the classes in use
+    """
+    tokens = set()
+    for pattern in TOKEN_SOURCES:
+        for path in Path(base_dir).glob(pattern):
+            tokens.update(TOKEN_RE.findall(path.read_text(errors="ignore")))
+    for source in extra_sources:
+        tokens.update(TOKEN_RE.findall(source))
+    return tokens
+
+
+def class_filter(tokens):
+    def keep(name):
+        return name in tokens or any(pattern.search(name) for pattern in SAFELIST)
+
+    return keep
+
+
+# CSS tree-shaking
+
+
+def _skip_string(css, pos):
+    quote = css[pos]
+    pos += 1
+    while pos < len(css) and css[pos] != quote:
+        pos += 2 if css[pos] == "\\" else 1
+    return pos + 1
+
+
+def _block_end(css, pos):
+    # Index of the "}" closing the block opened at ``pos``
+    depth = 0
+    while pos < len(css):
+        char = css[pos]
+        if char in "\"'":
+            pos = _skip_string(css, pos)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if not depth:
+                return pos
+        pos += 1
+    raise AssetError("Unbalanced braces in CSS")
+
+
+NESTED_AT_RULES = ("@media", "@supports", "@layer", "@container", "@document")
+
+
+def parse_css(css, pos=0):
+    """
+    Parse ``css`` (without comments) into ``(prelude, body)`` rules, where
+    ``body`` is the declarations string, a list of nested rules, or None for
+    statements such as ``@import``; return ``(rules, end position)``
+    """
+    rules = []
+    start = pos
+    while pos < len(css):
+        char = css[pos]
+        if char in "\"'":
+            pos = _skip_string(css, pos)
+            continue
+        if char == ";":
+            statement = css[start:pos].strip()
+            if statement:
+                rules.append((statement, None))
+            start = pos + 1
+        elif char == "{":
+            prelude = css[start:pos].strip()
+            if prelude.lower().startswith(NESTED_AT_RULES):
+                children, pos = parse_css(css, pos + 1)
+                rules.append((prelude, children))
+            else:
+                end = _block_end(css, pos)
+                rules.append((prelude, css[pos + 1 : end]))
+                pos = end + 1
+            start = pos
+            continue
+        elif char == "}":
+            return rules, pos + 1
+        pos += 1
+    return rules, pos
+
+
+def serialize_css(rules):
+    parts = []
+    for prelude, body in rules:
+        if body is None:
+            parts.append(f"{prelude};")
+        elif isinstance(body, list):
+            parts.append(f"{prelude}{{{serialize_css(body)}}}")
+        else:
+            parts.append(f"{prelude}{{{body}}}")
+    return "".join(parts)
+
+
+def split_top_level(text, separator=","):
+    parts, depth, start, pos = [], 0, 0, 0
+    while pos < len(text):
+        char = text[pos]
+        if char in "\"'":
+            pos = _skip_string(text, pos)
+            continue
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == separator and not depth:
+            parts.append(text[start:pos])
+            start = pos + 1
+        pos += 1
+    parts.append(text[start:])
+    return parts
+
+
+def selector_classes(selector):
+    # Classes inside :not() or attribute selectors do not need to be used
+    selector = ATTRIBUTE_RE.sub("", NOT_RE.sub("", selector))
+    return [name.replace("\\", "") for name in CLASS_RE.findall(selector)]
+
+
+def _trim_font_face(body, keep_url):
+    declarations = []
+    for declaration in split_top_level(body, ";"):
+        name, _, value = declaration.partition(":")
+        if name.strip().lower() == "src":
+            sources = [
+                source
+                for source in split_top_level(value)
+                if all(keep_url(url) for _, url in URL_RE.findall(source))
+            ]
+            if not sources:
+                return None
+            declaration = f"{name}:{','.join(sources)}"
+        declarations.append(declaration)
+    return ";".join(declarations)
+
+
+def purge_css(rules, keep_class, keep_url=lambda url: True):
+    """
+    Drop the selectors of ``rules`` using classes ``keep_class`` rejects,
+    and the ``@font-face`` sources whose URLs ``keep_url`` rejects
+    """
+    kept = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            children = purge_css(body, keep_class, keep_url)
+            if children:
+                kept.append((prelude, children))
+        elif body is None or (
+            prelude.startswith("@") and "font-face" not in prelude.lower()
+        ):
+            kept.append((prelude, body))
+        elif prelude.startswith("@"):
+            body = _trim_font_face(body, keep_url)
+            if body is not None:
+                kept.append((prelude, body))
+        else:
+            selectors = [
+                selector
+                for selector in split_top_level(prelude)
+                if all(keep_class(name) for name in selector_classes(selector))
+            ]
+            if selectors:
+                kept.append((",".join(selectors), body))
+    return kept
+
+
+def tree_shake_css(css, keep_class, keep_url=lambda url: True):
+    """
+    Return ``css`` without unused rules, comments and source map references,
+    keeping ``/*!`` license banners
+    """
+    banners = re.findall(r"/\*!.*?\*/", css, flags=re.DOTALL)
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    rules, _ = parse_css(css)
+    shaken = serialize_css(purge_css(rules, keep_class, keep_url))
+    return "\n".join([*banners, shaken])
+
+
+def vendor_assets(base_dir, packages=None, download=download_package):
+    """
+    Download, verify and tree-shake ``packages`` into ``base_dir/static``;
+    return the written paths with their sizes
+    """
+    packages = PACKAGES if packages is None else packages
+    outputs = {}
+    for name, (version, files) in packages.items():
+        contents = download(name, version)
+        for source, target in files.items():
+            if source not in contents:
+                raise AssetError(f"{name}@{version} has no {source}")
+            outputs[target] = contents[source]
+
+    scripts = [
+        SOURCE_MAP_RE.sub("", data.decode())
+        for path, data in outputs.items()
+        if path.endswith(".js")
+    ]
+    keep_class = class_filter(used_tokens(base_dir, scripts))
+    static_dir = Path(base_dir) / "static"
+    written = []
+    for target, data in outputs.items():
+        if target.endswith(".css"):
+
+            def keep_url(url, target=target):
+                resolved = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(target), url.split("?")[0])
+                )
+                return url.startswith("data:") or resolved in outputs
+
+            data = tree_shake_css(data.decode(), keep_class, keep_url).encode()
+        elif target.endswith(".js"):
+            data = SOURCE_MAP_RE.sub("", data.decode()).encode()
+        path = static_dir / target
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        written.append((target, len(data)))
+    return written
+
+
+# Serving
+
+
+def cdn_url(path):
+    """
+    Public CDN URL of the vendored ``path``, or None
+    """
+    for name, (version, files) in PACKAGES.items():
+        for source, target in files.items():
+            if target == path:
+                return f"{CDN_URL}/{name}@{version}/{source}"
+    return None
+
+
+@lru_cache(maxsize=None)
+def _is_vendored(path):
+    return bool(finders.find(path)) or staticfiles_storage.exists(path)
+
+
+def check_vendored_assets(app_configs, **kwargs):  # noqa: ARG001
+    """
+    Deployment check: every file of ``PACKAGES`` is under ``static/vendor/``
+    """
+    missing = [
+        target
+        for _, files in PACKAGES.values()
+        for target in files.values()
+        if not finders.find(target)
+    ]
+    if not missing:
+        return []
+    return [
+        checks.Warning(
+            f"{len(missing)} front-end assets are not vendored, so pages link "
+            f"them on {CDN_URL} (first missing: {missing[0]}).",
+            hint="Run manage.py vendor_assets and commit static/vendor/.",
+            id="core.W001",
+        )
+    ]
+
+
+def asset_url(path):
+    """
+    URL of the vendored static ``path``, or of its CDN original until
+    ``manage.py vendor_assets`` has written it
+    """
+    if _is_vendored(path) or cdn_url(path) is None:
+        return static(path)
+    return cdn_url(path)
+
+
+def accepted_encodings(request):
+    encodings = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, *params = (item.strip() for item in part.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.lower())
+    return encodings
+
+
+def serve_static(request, path, document_root=None):
+    """
+    Serve a collected static file, preferring its precompressed ``.br`` or
+    ``.gz`` variant, with year-long immutable caching for fingerprinted names
+    """
+    document_root = document_root or settings.STATIC_ROOT
+    accepted = accepted_encodings(request)
+    served = path
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        variant = path + suffix
+        if encoding in accepted and os.path.isfile(
+            os.path.join(document_root, variant)
+        ):
+            served = variant
+            break
+    response = static_views.serve(request, served, document_root=document_root)
+    patch_vary_headers(response, ["Accept-Encoding"])
+    if FINGERPRINT_RE.search(path):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, public=True, max_age=60)
+    return response
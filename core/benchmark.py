@@ -0,0 +1,638 @@
+"""
+In-process route benchmarks.
+
+Every named route of ``core.urls`` has a scenario describing one request to
+it. ``run_benchmark()`` replays a seeded, shuffled mix of anonymous and
+authenticated requests through the real WSGI and ASGI applications of
+``myproject`` (so the full middleware stack, sessions and CSRF are
+exercised) without a network server, and measures per route throughput,
+p50/p95/p99 latency and SQL queries per request. Query counts come from
+``QueryBudgetMiddleware`` through the ``request_queries`` signal.
+
+Results can be stored as a JSON baseline; ``compare()`` reports the routes
+whose p95 latency or query count regressed beyond a threshold.
+
+``run_auth_benchmark()`` measures successful password logins and
+registrations instead, which are bound by password hashing: it reports them
+per second of process CPU time, that is per core, next to the configured
+hasher.
+"""
+
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.models import User
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import clear_url_caches, resolve, reverse
+
+from .counters import view_counter
+from .dataset import generate_dataset
+from .models import Category, PendingComment, Post
+from .query_budget import request_queries
+from .search import reset_search_backend
+
+INTERFACES = ("wsgi", "asgi")
+
+# Latency differences below this many milliseconds are treated as noise
+NOISE_FLOOR_MS = 1.0
+# Mean queries per request may drift by this much (view count flushes)
+QUERY_TOLERANCE = 0.5
+
+AUTH_PASSWORD = "correct-Horse-7-staple"
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Scenario:
+    """
+    One request to a route and the kinds of visitors that make it
+    """
+
+    def __init__(
+        self,
+        route,
+        path,
+        method="GET",
+        data=None,
+        ajax=False,
+        anonymous=True,
+        authenticated=True,
+        writes=False,
+    ):
+        self.route = route
+        self.path = path
+        self.method = method
+        self.data = data
+        self.ajax = ajax
+        self.anonymous = anonymous
+        self.authenticated = authenticated
+        self.writes = writes
+
+    def visitor(self, rng, auth_ratio):
+        """
+        Pick ``"anonymous"`` or ``"authenticated"`` for one request
+        """
+        if not self.authenticated:
+            return "anonymous"
+        if not self.anonymous or rng.random() < auth_ratio:
+            return "authenticated"
+        return "anonymous"
+
+
+@contextmanager
+def throwaway_database(seed=0, **sizes):
+    """
+    Run the block against a new test database filled by ``generate_dataset``
+    """
+    old_config = setup_databases(
+        verbosity=0, interactive=False, aliases={"default"}, serialized_aliases=set()
+    )
+    reset_search_backend()
+    try:
+        generate_dataset(seed=seed, **sizes)
+        yield
+    finally:
+        # Buffered view counts belong to the test database
+        view_counter.flush()
+        reset_search_backend()
+        teardown_databases(old_config, verbosity=0)
+
+
+def reload_urls():
+    """
+    Re-import ``core.urls`` and the root URLconf, which pick their views
+    from ``ASYNC_VIEWS`` at import time
+    """
+    for module in ("core.urls", settings.ROOT_URLCONF):
+        importlib.reload(importlib.import_module(module))
+    clear_url_caches()
+
+
+@contextmanager
+def serving(driver):
+    """
+    Route requests to the views the ``driver``'s interface serves in
+    production while the block runs
+    """
+    try:
+        with override_settings(ASYNC_VIEWS=driver.async_views):
+            reload_urls()
+            view = resolve(reverse("core:home")).func
+            if iscoroutinefunction(view) != driver.async_views:
+                raise BenchmarkError(f"{driver.interface} routes to the wrong views")
+            yield
+    finally:
+        reload_urls()
+
+
+def route_names():
+    from . import urls
+
+    return [f"{urls.app_name}:{pattern.name}" for pattern in urls.urlpatterns]
+
+
+def build_scenarios(user=None):
+    """
+    Return ``{route name: Scenario}`` for every route of ``core.urls``;
+    ``user`` is the authenticated visitor
+    """
+    post = Post.objects.filter(is_published=True).order_by("-views_count").first()
+    category = Category.objects.filter(is_active=True, posts__is_published=True).first()
+    if post is None or category is None:
+        raise BenchmarkError("The database needs published posts to benchmark")
+    word = next((token for token in post.title.split() if len(token) > 2), post.title)
+    # Status polls need a comment the visitor submitted; without one only
+    # anonymous visitors (redirected to the login page) make them
+    submitted = (
+        PendingComment.objects.filter(author=user).order_by("-pk").first()
+        if user is not None
+        else None
+    )
+
+    scenarios = [
+        Scenario("core:home", reverse("core:home")),
+        Scenario("core:post_list", reverse("core:post_list")),
+        Scenario("core:post_detail", reverse("core:post_detail", args=[post.slug])),
+        Scenario(
+            "core:category_detail",
+            reverse("core:category_detail", args=[category.slug]),
+        ),
+        Scenario("core:search", f"{reverse('core:search')}?{urlencode({'q': word})}"),
+        Scenario(
+            "core:add_comment",
+            reverse("core:add_comment", args=[post.slug]),
+            method="POST",
+            data={"content": "Benchmark comment"},
+            ajax=True,
+            anonymous=False,
+            writes=True,
+        ),
+        Scenario(
+            "core:comment_status",
+            reverse("core:comment_status", args=[submitted.pk if submitted else 0]),
+            ajax=True,
+            authenticated=submitted is not None,
+        ),
+        Scenario("core:profile", reverse("core:profile"), anonymous=False),
+        Scenario("core:edit_profile", reverse("core:edit_profile"), anonymous=False),
+        Scenario("core:register", reverse("core:register")),
+        Scenario("core:login", reverse("core:login")),
+        # Logging out ends the session, so only anonymous visitors do it
+        Scenario("core:logout", reverse("core:logout"), authenticated=False),
+    ]
+    by_route = {scenario.route: scenario for scenario in scenarios}
+    missing = sorted(set(route_names()) - set(by_route))
+    if missing:
+        raise BenchmarkError(f"No benchmark scenario for {', '.join(missing)}")
+    return by_route
+
+
+def benchmark_host():
+    for host in settings.ALLOWED_HOSTS:
+        host = host.lstrip(".")
+        if host and host != "*":
+            return host
+    return "localhost"
+
+
+class Visitors:
+    """
+    Cookies and headers of the anonymous and authenticated visitors
+    """
+
+    def __init__(self, user):
+        request = HttpRequest()
+        self.csrf_token = get_token(request)
+        csrf_cookie = request.META["CSRF_COOKIE"]
+        client = Client()
+        client.force_login(user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.cookies = {
+            "anonymous": f"{settings.CSRF_COOKIE_NAME}={csrf_cookie}",
+            "authenticated": (
+                f"{settings.CSRF_COOKIE_NAME}={csrf_cookie}; "
+                f"{settings.SESSION_COOKIE_NAME}={session}"
+            ),
+        }
+
+    def request(self, scenario, visitor):
+        """
+        Return ``(method, path, query string, headers, body)``
+        """
+        path, _, query = scenario.path.partition("?")
+        headers = {"host": benchmark_host(), "cookie": self.cookies[visitor]}
+        body = b""
+        if scenario.method == "POST":
+            body = urlencode(scenario.data or {}).encode()
+            headers["content-type"] = "application/x-www-form-urlencoded"
+            headers["x-csrftoken"] = self.csrf_token
+        if scenario.ajax:
+            headers["x-requested-with"] = "XMLHttpRequest"
+        return scenario.method, path, query, headers, body
+
+
+class QueryCounter:
+    """
+    Collect the query counts reported by ``QueryBudgetMiddleware``
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        request_queries.connect(self.receive)
+        return self
+
+    def __exit__(self, *exc_info):
+        request_queries.disconnect(self.receive)
+
+    def receive(self, sender, count, **kwargs):
+        self.count += count
+
+    def take(self):
+        count, self.count = self.count, 0
+        return count
+
+
+class WSGIDriver:
+    interface = "wsgi"
+    async_views = False
+
+    def __init__(self, application=None):
+        if application is None:
+            from myproject.wsgi import application
+        self.application = application
+
+    def environ(self, method, path, query, headers, body):
+        scheme = "https" if settings.SECURE_SSL_REDIRECT else "http"
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": headers["host"],
+            "SERVER_PORT": "443" if scheme == "https" else "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scheme,
+            "wsgi.input": BytesIO(body),
+            "wsgi.errors": BytesIO(),
+            "wsgi.multithread": False,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            if name == "content-type":
+                environ["CONTENT_TYPE"] = value
+            else:
+                environ["HTTP_" + name.upper().replace("-", "_")] = value
+        return environ
+
+    def send_request(self, method, path, query, headers, body):
+        status = []
+
+        def start_response(line, _headers, _exc_info=None):
+            status.append(int(line.split(" ", 1)[0]))
+
+        response = self.application(
+            self.environ(method, path, query, headers, body), start_response
+        )
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+        return status[0]
+
+    def run(self, requests, counter):
+        """
+        Send ``requests`` in order and return ``(status, seconds, queries)``
+        for each
+        """
+        results = []
+        for request in requests:
+            started = time.perf_counter()
+            status = self.send_request(*request)
+            seconds = time.perf_counter() - started
+            results.append((status, seconds, counter.take()))
+        return results
+
+
+class ASGIDriver:
+    interface = "asgi"
+    async_views = True
+
+    def __init__(self, application=None):
+        if application is None:
+            from myproject.asgi import application
+        self.application = application
+
+    def scope(self, method, path, query, headers):
+        scheme = "https" if settings.SECURE_SSL_REDIRECT else "http"
+        return {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": scheme,
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [
+                (name.encode(), value.encode()) for name, value in headers.items()
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": (headers["host"], 443 if scheme == "https" else 80),
+        }
+
+    async def send_request(self, method, path, query, headers, body):
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        disconnected = asyncio.Event()
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client stays connected until the response is complete
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        headers = dict(headers, **{"content-length": str(len(body))})
+        await self.application(self.scope(method, path, query, headers), receive, send)
+        disconnected.set()
+        return status[0]
+
+    async def _run(self, requests, counter):
+        results = []
+        for request in requests:
+            started = time.perf_counter()
+            status = await self.send_request(*request)
+            seconds = time.perf_counter() - started
+            results.append((status, seconds, counter.take()))
+        return results
+
+    def run(self, requests, counter):
+        # One event loop for the whole run; running it under async_to_sync
+        # keeps thread-sensitive views on this thread and its connection
+        return async_to_sync(self._run)(requests, counter)
+
+
+DRIVERS = {"wsgi": WSGIDriver, "asgi": ASGIDriver}
+
+
+def percentile(cuts, fraction):
+    return cuts[round(fraction * 100) - 1]
+
+
+def summarize(latencies, queries, errors):
+    """
+    Reduce per request seconds and query counts to a result dictionary
+    """
+    milliseconds = sorted(latency * 1000 for latency in latencies)
+    if len(milliseconds) > 1:
+        cuts = statistics.quantiles(milliseconds, n=100, method="inclusive")
+    else:
+        cuts = milliseconds * 99
+    total = sum(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / total if total else 0.0,
+        "p50_ms": percentile(cuts, 0.50),
+        "p95_ms": percentile(cuts, 0.95),
+        "p99_ms": percentile(cuts, 0.99),
+        "queries": statistics.fmean(queries) if queries else 0.0,
+    }
+
+
+def plan_requests(scenarios, visitors, requests_per_route, auth_ratio, seed):
+    """
+    Return a shuffled list of ``(route, request)`` pairs
+    """
+    rng = random.Random(seed)
+    plan = [
+        (scenario.route, visitors.request(scenario, scenario.visitor(rng, auth_ratio)))
+        for scenario in scenarios
+        for _ in range(requests_per_route)
+    ]
+    rng.shuffle(plan)
+    return plan
+
+
+def run_benchmark(
+    interfaces=INTERFACES,
+    requests_per_route=50,
+    auth_ratio=0.5,
+    routes=None,
+    include_writes=True,
+    user=None,
+    seed=0,
+    warmup=1,
+):
+    """
+    Benchmark the routes of ``core.urls`` and return
+    ``{interface: {route: result}}``
+    """
+    user = user or User.objects.filter(is_active=True).order_by("pk").first()
+    if user is None:
+        raise BenchmarkError("The database needs a user to benchmark")
+    scenarios = build_scenarios(user)
+    if routes:
+        unknown = sorted(set(routes) - set(scenarios))
+        if unknown:
+            raise BenchmarkError(f"Unknown routes: {', '.join(unknown)}")
+        selected = [scenarios[route] for route in routes]
+    else:
+        selected = [
+            scenario
+            for scenario in scenarios.values()
+            if include_writes or not scenario.writes
+        ]
+    visitors = Visitors(user)
+
+    results = {}
+    # Query counts are only reported while the middleware counts
+    with override_settings(QUERY_BUDGET_MODE="log"), QueryCounter() as counter:
+        for interface in interfaces:
+            driver = DRIVERS[interface]()
+            with serving(driver):
+                # Fill caches, connections and lazily loaded indexes first
+                warm = plan_requests(selected, visitors, warmup, auth_ratio, seed)
+                driver.run([request for _, request in warm], counter)
+
+                plan = plan_requests(
+                    selected, visitors, requests_per_route, auth_ratio, seed
+                )
+                responses = driver.run([request for _, request in plan], counter)
+            samples = {scenario.route: ([], [], []) for scenario in selected}
+            for (route, _), (status, seconds, queries) in zip(plan, responses):
+                samples[route][0].append(seconds)
+                samples[route][1].append(queries)
+                samples[route][2].append(status >= 400)
+            results[interface] = {
+                route: summarize(latencies, queries, sum(errors))
+                for route, (latencies, queries, errors) in samples.items()
+            }
+    return results
+
+
+def run_auth_benchmark(interfaces=INTERFACES, requests=20, seed=0):
+    """
+    POST valid logins and registrations through each of ``interfaces`` and
+    return ``{interface: {route: result}}``; every result also has the
+    ``cpu_throughput`` per core and the ``hasher`` algorithm
+    """
+    hasher = get_hasher()
+    user = User.objects.create_user(
+        username=f"benchmark-login-{seed}", password=AUTH_PASSWORD
+    )
+    visitors = Visitors(user)
+    login = Scenario(
+        "core:login",
+        reverse("core:login"),
+        method="POST",
+        data={"username": user.username, "password": AUTH_PASSWORD},
+    )
+
+    def registration(number):
+        return Scenario(
+            "core:register",
+            reverse("core:register"),
+            method="POST",
+            data={
+                "username": f"benchmark-{seed}-{number}",
+                "password1": AUTH_PASSWORD,
+                "password2": AUTH_PASSWORD,
+            },
+        )
+
+    results = {}
+    numbers = itertools.count()
+    with override_settings(QUERY_BUDGET_MODE="log"), QueryCounter() as counter:
+        for interface in interfaces:
+            driver = DRIVERS[interface]()
+            results[interface] = {}
+            for route, make_scenario in (
+                ("core:login", lambda: login),
+                ("core:register", lambda: registration(next(numbers))),
+            ):
+                # Warm up connections and the hasher's imports
+                driver.run([visitors.request(make_scenario(), "anonymous")], counter)
+                batch = [
+                    visitors.request(make_scenario(), "anonymous")
+                    for _ in range(requests)
+                ]
+                cpu_started = time.process_time()
+                responses = driver.run(batch, counter)
+                cpu_seconds = time.process_time() - cpu_started
+                result = summarize(
+                    [seconds for _, seconds, _ in responses],
+                    [queries for _, _, queries in responses],
+                    # Both views redirect on success
+                    sum(status != 302 for status, _, _ in responses),
+                )
+                result["cpu_throughput"] = (
+                    len(responses) / cpu_seconds if cpu_seconds else 0.0
+                )
+                result["hasher"] = hasher.algorithm
+                results[interface][route] = result
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Return messages for routes slower or heavier than ``baseline``
+    """
+    regressions = []
+    for interface, routes in results.items():
+        for route, result in routes.items():
+            base = baseline.get(interface, {}).get(route)
+            if base is None:
+                continue
+            limit = max(
+                base["p95_ms"] * (1 + threshold), base["p95_ms"] + NOISE_FLOOR_MS
+            )
+            if result["p95_ms"] > limit:
+                regressions.append(
+                    f"{interface} {route}: p95 {result['p95_ms']:.2f}ms "
+                    f"(baseline {base['p95_ms']:.2f}ms)"
+                )
+            if result["queries"] > base["queries"] + QUERY_TOLERANCE:
+                regressions.append(
+                    f"{interface} {route}: {result['queries']:.1f} queries "
+                    f"per request (baseline {base['queries']:.1f})"
+                )
+            if result["errors"] > base.get("errors", 0):
+                regressions.append(
+                    f"{interface} {route}: {result['errors']} failed requests"
+                )
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+
+
+def format_report(results):
+    lines = [
+        f"{'interface':<9} {'route':<22} {'req/s':>9} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>6}"
+    ]
+    for interface, routes in results.items():
+        for route, result in routes.items():
+            lines.append(
+                f"{interface:<9} {route:<22} {result['throughput']:>9.1f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['queries']:>8.1f} "
+                f"{result['errors']:>6}"
+            )
+    return "\n".join(lines)
+
+
+def format_auth_report(results):
+    lines = [
+        f"{'interface':<9} {'route':<15} {'hasher':<14} {'req/s':>7} "
+        f"{'req/cpu-s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}"
+    ]
+    for interface, routes in results.items():
+        for route, result in routes.items():
+            lines.append(
+                f"{interface:<9} {route:<15} {result['hasher']:<14} "
+                f"{result['throughput']:>7.1f} {result['cpu_throughput']:>9.1f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['errors']:>6}"
+            )
+    return "\n".join(lines)
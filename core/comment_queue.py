@@ -0,0 +1,243 @@
+"""
+Asynchronous comment publishing.
+
+``add_comment`` only validates a submission and stores it in the
+``PendingComment`` outbox, a single narrow INSERT, then answers with the
+pending id; ``comment_status`` reports when it has been published. Bursts
+of comments on a popular post therefore no longer queue up behind each
+other's comment inserts, path updates, counter updates and cache
+invalidations.
+
+Outbox rows are published in batches: a worker claims up to
+``COMMENT_BATCH_SIZE`` pending rows with one UPDATE, inserts their comments
+with ``bulk_create``, bumps each post's comment stats once and invalidates
+each post's cached pages once. Claims older than ``COMMENT_CLAIM_TIMEOUT``
+seconds are taken over, so rows claimed by a crashed worker are not lost; a
+slow worker whose rows were taken over skips them when it gets to publish.
+
+Batches run on a pool of ``COMMENT_WORKERS`` threads, woken when a
+submission commits; ``0`` publishes inline before ``add_comment`` responds.
+``manage.py process_comments`` drains the outbox from a separate process
+and purges old published and failed rows.
+"""
+
+import logging
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .counters import record_approved_comment
+from .models import Comment, PendingComment, Post
+from .page_cache import invalidate_tags
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_drain_queued = False
+
+
+def comment_workers():
+    return getattr(settings, "COMMENT_WORKERS", 2)
+
+
+def enqueue_comment(post, author, content):
+    """
+    Store a validated comment in the outbox and return its PendingComment,
+    already published when comments are processed inline
+    """
+    if comment_workers() > 0:
+        pending = PendingComment.objects.create(
+            post=post, author=author, content=content
+        )
+        transaction.on_commit(schedule_drain)
+        return pending
+    # Created and published in one transaction, so no worker sees it pending
+    with transaction.atomic():
+        pending = PendingComment.objects.create(
+            post=post, author=author, content=content
+        )
+        publish([pending], held=True)
+    return pending
+
+
+def claim(batch_size=None, worker=None):
+    """
+    Claim up to ``batch_size`` pending rows for ``worker`` and return them
+    """
+    batch_size = batch_size or getattr(settings, "COMMENT_BATCH_SIZE", 100)
+    worker = worker or uuid.uuid4().hex
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, "COMMENT_CLAIM_TIMEOUT", 60))
+    claimable = Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale)
+    # Fetched first: MySQL rejects LIMIT in an IN (...) subquery
+    candidates = list(
+        PendingComment.objects.filter(
+            claimable, status=PendingComment.PENDING
+        ).values_list("pk", flat=True)[:batch_size]
+    )
+    if not candidates:
+        return []
+    # The claim conditions are repeated on the UPDATE itself so that two
+    # workers racing for the same rows cannot both get them
+    claimed = PendingComment.objects.filter(
+        claimable, pk__in=candidates, status=PendingComment.PENDING
+    ).update(claimed_by=worker, claimed_at=now)
+    if not claimed:
+        return []
+    return list(
+        PendingComment.objects.filter(claimed_by=worker, status=PendingComment.PENDING)
+    )
+
+
+def renew_claims(pending):
+    """
+    Renew the claims on ``pending`` and return the rows still held; rows
+    another worker has taken over meanwhile are left for it to publish
+    """
+    now = timezone.now()
+    by_worker = defaultdict(list)
+    for entry in pending:
+        by_worker[entry.claimed_by].append(entry.pk)
+    held = set()
+    for worker, pks in by_worker.items():
+        rows = PendingComment.objects.filter(
+            pk__in=pks, claimed_by=worker, status=PendingComment.PENDING
+        )
+        # Fresh claims cannot be taken over until this transaction ends
+        if rows.update(claimed_at=now):
+            held.update(rows.values_list("pk", flat=True))
+    return [entry for entry in pending if entry.pk in held]
+
+
+def publish(pending, held=False):
+    """
+    Publish claimed ``pending`` rows as comments in one transaction and
+    return how many were published; ``held`` skips checking the claims, for
+    rows no other transaction can see yet
+    """
+    # Part of the caller's transaction when there is one (enqueue_comment)
+    with transaction.atomic(savepoint=False):
+        if not held:
+            pending = renew_claims(pending)
+        live = set(
+            Post.objects.filter(
+                pk__in={entry.post_id for entry in pending}, is_published=True
+            ).values_list("pk", flat=True)
+        )
+        now = timezone.now()
+        published = []
+        for entry in pending:
+            entry.claimed_by = ""
+            # bulk_update() leaves auto_now fields alone
+            entry.updated_at = now
+            if entry.post_id in live:
+                published.append(entry)
+            else:
+                entry.status = PendingComment.FAILED
+                entry.error = "The post is no longer published."
+
+        comments = [
+            Comment(
+                post_id=entry.post_id, author_id=entry.author_id, content=entry.content
+            )
+            for entry in published
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Comment.objects.bulk_create(comments)
+            for comment in comments:
+                comment.path = comment.build_path()
+            Comment.objects.bulk_update(comments, ["path"])
+            by_post = defaultdict(list)
+            for comment in comments:
+                by_post[comment.post_id].append(comment.created_at)
+            for post_id, created in by_post.items():
+                record_approved_comment(post_id, max(created), len(created))
+            if by_post:
+                tags = [f"post:{post_id}" for post_id in by_post]
+                transaction.on_commit(lambda: invalidate_tags("comments", *tags))
+        else:
+            # Without primary keys from the bulk insert, save one by one and
+            # let the signal handlers maintain the stats and caches
+            for comment in comments:
+                comment.save()
+        for entry, comment in zip(published, comments):
+            entry.status = PendingComment.PUBLISHED
+            entry.comment = comment
+        PendingComment.objects.bulk_update(
+            pending, ["status", "comment", "error", "claimed_by", "updated_at"]
+        )
+    return len(comments)
+
+
+def drain(batch_size=None):
+    """
+    Publish pending comments until the outbox is empty and return how many
+    rows were processed
+    """
+    worker = uuid.uuid4().hex
+    processed = 0
+    batch_size = batch_size or getattr(settings, "COMMENT_BATCH_SIZE", 100)
+    while pending := claim(batch_size, worker):
+        publish(pending)
+        processed += len(pending)
+        if len(pending) < batch_size:
+            break
+    return processed
+
+
+def _drain_logged():
+    global _drain_queued
+    with _executor_lock:
+        # Submissions from now on need another run
+        _drain_queued = False
+    try:
+        drain()
+    except Exception:
+        logger.exception("Failed to publish pending comments")
+    finally:
+        # Worker threads open their own connections
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=comment_workers(), thread_name_prefix="comments"
+            )
+        return _executor
+
+
+def schedule_drain():
+    """
+    Have a worker thread drain the outbox, unless a run is already waiting
+    """
+    global _drain_queued
+    executor = get_executor()
+    with _executor_lock:
+        if _drain_queued:
+            return
+        _drain_queued = True
+    executor.submit(_drain_logged)
+
+
+def purge(older_than=timedelta(days=1)):
+    """
+    Delete published and failed outbox rows not updated within
+    ``older_than`` and return how many were deleted
+    """
+    cutoff = timezone.now() - older_than
+    deleted, _ = PendingComment.objects.filter(
+        status__in=[PendingComment.PUBLISHED, PendingComment.FAILED],
+        updated_at__lt=cutoff,
+    ).delete()
+    return deleted
@@ -0,0 +1,158 @@
+"""
+Conditional GET for the read views.
+
+``conditional_page(validator, *tags)`` answers ``If-None-Match`` and
+``If-Modified-Since`` with a 304 before the view runs, like Django's
+``condition`` decorator, but also for async views. A validator returns the
+querysets a page depends on, each reduced to one value with ``newest()``
+(``max(updated_at)`` through an index) or a cheap single-row column; they
+all run as scalar subqueries of one SELECT.
+
+``Last-Modified`` is the newest of those timestamps. The ETag also covers
+the page-cache versions of ``tags`` (so deletions and bulk updates, which
+leave ``updated_at`` alone, still change it), the visitor (pages show who
+is logged in and embed their CSRF token) and ``ETAG_VERSION``, to be bumped
+when a deploy changes the templates. Pages with pending flash messages are
+never answered with a 304. View counts are not part of the validators, so a
+revalidated page may show a slightly old count.
+
+Responses carry ``Cache-Control: no-cache`` so browsers revalidate every
+time instead of guessing a freshness lifetime from ``Last-Modified``. The
+page cache keeps both validators with the pages it stores and answers
+revalidations of cache hits itself, without running the validator query.
+"""
+
+import datetime
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db import connections, router
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+from .page_cache import _tag_versions, get_cache
+
+
+def newest(queryset):
+    """
+    Reduce ``queryset`` to its latest ``updated_at``
+    """
+    return queryset.order_by("-updated_at").values_list("updated_at")[:1]
+
+
+def _to_python(value):
+    # Raw cursors return SQLite datetimes as strings
+    if isinstance(value, str):
+        value = parse_datetime(value) or value
+    if isinstance(value, datetime.datetime) and timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def fetch_values(querysets):
+    """
+    Evaluate single-value ``querysets`` as the columns of one SELECT
+    """
+    parts, params = [], []
+    for queryset in querysets:
+        sql, query_params = queryset.query.sql_with_params()
+        parts.append(f"({sql})")
+        params.extend(query_params)
+    alias = router.db_for_read(querysets[0].model)
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(parts)}", params)
+        row = cursor.fetchone()
+    return [_to_python(value) for value in row]
+
+
+def compute_validators(request, querysets, tags):
+    """
+    Return ``(etag, last modified timestamp)`` for a page depending on
+    ``querysets`` and the page-cache ``tags``
+    """
+    values = fetch_values(querysets)
+    timestamps = [value for value in values if isinstance(value, datetime.datetime)]
+    last_modified = int(max(timestamps).timestamp()) if timestamps else None
+
+    fingerprint = [
+        getattr(settings, "ETAG_VERSION", ""),
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+        *(
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in values
+        ),
+    ]
+    if tags:
+        versions = _tag_versions(get_cache(), tags)
+        fingerprint.extend(versions[tag] for tag in sorted(tags))
+    digest = hashlib.md5(repr(fingerprint).encode()).hexdigest()
+    return f'W/"{digest}"', last_modified
+
+
+def _precondition(validator, tags, request, args, kwargs):
+    if request.method not in ("GET", "HEAD") or len(get_messages(request)):
+        return None, None, None
+    querysets = validator(request, *args, **kwargs)
+    etag, last_modified = compute_validators(request, querysets, tags)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return response, etag, last_modified
+
+
+def _finish(request, response, etag, last_modified):
+    if etag is None or response.status_code not in (200, 304):
+        return response
+    response.headers.setdefault("ETag", etag)
+    if last_modified and not response.has_header("Last-Modified"):
+        response.headers["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True)
+    patch_vary_headers(response, ["Cookie"])
+    return response
+
+
+def conditional_page(validator, *tags):
+    """
+    View decorator answering conditional GETs from ``validator(request,
+    *args, **kwargs)``, which returns the querysets the page depends on.
+
+    Place it inside ``cache_anonymous_page``, so cached pages are stored
+    with their validators.
+    """
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                response, etag, last_modified = await sync_to_async(_precondition)(
+                    validator, tags, request, args, kwargs
+                )
+                if response is None:
+                    response = await view_func(request, *args, **kwargs)
+                return _finish(request, response, etag, last_modified)
+
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            response, etag, last_modified = _precondition(
+                validator, tags, request, args, kwargs
+            )
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+
+        return _wrapped_view
+
+    return decorator
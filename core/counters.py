@@ -0,0 +1,332 @@
+"""
+Denormalized counters.
+
+Page views are accumulated in a buffer and written back periodically as a
+single ``F()`` update per post, so a hot post costs one UPDATE per flush
+interval instead of one write transaction per reader.
+
+Published-post counts on categories and tags, and approved-comment stats on
+posts, are maintained incrementally by the signal handlers in
+``core.signals`` and can be rebuilt in bulk with
+``manage.py rebuild_post_counts``.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+logger = logging.getLogger(__name__)
+
+
+class LocalViewBuffer:
+    """
+    Per-process buffer kept in a dictionary guarded by a lock
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+
+    def add(self, slug, amount=1):
+        with self._lock:
+            self._pending[slug] += amount
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        return dict(pending)
+
+    def restore(self, counts):
+        with self._lock:
+            for slug, amount in counts.items():
+                self._pending[slug] += amount
+
+
+class CacheViewBuffer:
+    """
+    Buffer shared between processes through the Django cache.
+
+    Each slug has its own atomic counter key. The first view of a slug since
+    the last flush also sets a dirty marker with ``cache.add()``, and only
+    the process that wins that add appends the slug to an index of numbered
+    slots, so recording a view never reads or rewrites a shared set.
+    Draining clears each marker before reading its counter and decrements
+    by the amount read, so increments that race with a flush are carried
+    over to the next one instead of being lost.
+
+    Markers expire after ``dirty_timeout`` seconds, so a slug whose slot was
+    lost (evicted, or never written by a crashed process) is indexed again
+    by its next view.
+    """
+
+    key_prefix = "views"
+    dirty_timeout = 3600
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+        self.seq_key = f"{self.key_prefix}:seq"
+        self.cursor_key = f"{self.key_prefix}:drained"
+        self.gap_key = f"{self.key_prefix}:gap"
+        self.lock_key = f"{self.key_prefix}:draining"
+
+    def _counter_key(self, slug):
+        return f"{self.key_prefix}:count:{slug}"
+
+    def _dirty_key(self, slug):
+        return f"{self.key_prefix}:dirty:{slug}"
+
+    def _slot_key(self, number):
+        return f"{self.key_prefix}:slot:{number}"
+
+    def _incr(self, key, amount):
+        if not self.cache.add(key, amount, timeout=None):
+            try:
+                return self.cache.incr(key, amount)
+            except ValueError:
+                self.cache.set(key, amount, timeout=None)
+        return amount
+
+    def add(self, slug, amount=1):
+        self._incr(self._counter_key(slug), amount)
+        if self.cache.add(self._dirty_key(slug), 1, timeout=self.dirty_timeout):
+            number = self._incr(self.seq_key, 1)
+            self.cache.set(self._slot_key(number), slug, timeout=None)
+
+    def _take_slugs(self):
+        cursor = self.cache.get(self.cursor_key, 0)
+        last = self.cache.get(self.seq_key, 0)
+        if last <= cursor:
+            return set()
+        numbers = range(cursor + 1, last + 1)
+        slots = self.cache.get_many([self._slot_key(n) for n in numbers])
+        slugs = set()
+        for number in numbers:
+            slug = slots.get(self._slot_key(number))
+            if slug is None and self.cache.get(self.gap_key) != number:
+                # Probably claimed by a process that is about to write it;
+                # if it is still empty on the next drain it is skipped
+                self.cache.set(self.gap_key, number, timeout=None)
+                break
+            cursor = number
+            if slug is not None:
+                slugs.add(slug)
+        self.cache.set(self.cursor_key, cursor, timeout=None)
+        self.cache.delete_many([self._slot_key(n) for n in numbers if n <= cursor])
+        return slugs
+
+    def drain(self):
+        # Only one process drains at a time, or both would count the views
+        if not self.cache.add(self.lock_key, 1, timeout=60):
+            return {}
+        try:
+            slugs = self._take_slugs()
+            if not slugs:
+                return {}
+            self.cache.delete_many([self._dirty_key(slug) for slug in slugs])
+            keys = {self._counter_key(slug): slug for slug in slugs}
+            counts = {}
+            for key, amount in self.cache.get_many(keys).items():
+                if amount:
+                    self.cache.decr(key, amount)
+                    counts[keys[key]] = amount
+            return counts
+        finally:
+            self.cache.delete(self.lock_key)
+
+    def restore(self, counts):
+        for slug, amount in counts.items():
+            self.add(slug, amount)
+
+
+def buffer_is_shared():
+    """
+    Whether buffered views are visible to other processes, such as
+    ``manage.py flush_view_counts``
+    """
+    from django.core.cache.backends.locmem import LocMemCache
+
+    if getattr(settings, "VIEW_COUNT_BUFFER", "local") != "cache":
+        return False
+    return not isinstance(caches["default"], LocMemCache)
+
+
+class ViewCounter:
+    """
+    Records post views and flushes them to the database in batches
+    """
+
+    def __init__(self, buffer=None, flush_interval=None):
+        self.buffer = buffer
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._flush_lock = threading.Lock()
+
+    def _get_buffer(self):
+        if self.buffer is None:
+            backend = getattr(settings, "VIEW_COUNT_BUFFER", "local")
+            self.buffer = CacheViewBuffer() if backend == "cache" else LocalViewBuffer()
+        return self.buffer
+
+    def _get_flush_interval(self):
+        if self.flush_interval is None:
+            return getattr(settings, "VIEW_COUNT_FLUSH_INTERVAL", 10)
+        return self.flush_interval
+
+    def record(self, slug, amount=1):
+        """
+        Buffer ``amount`` views for the post with the given slug
+        """
+        self._get_buffer().add(slug, amount)
+        if time.monotonic() - self._last_flush >= self._get_flush_interval():
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered views to the database and return the number of
+        posts updated.
+
+        Posts that received the same number of views share one UPDATE.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_flush = time.monotonic()
+            counts = self._get_buffer().drain()
+            if not counts:
+                return 0
+
+            by_amount = defaultdict(list)
+            for slug, amount in counts.items():
+                by_amount[amount].append(slug)
+
+            from .models import Post
+
+            try:
+                with transaction.atomic():
+                    for amount, slugs in by_amount.items():
+                        Post.objects.filter(slug__in=slugs, is_published=True).update(
+                            views_count=F("views_count") + amount
+                        )
+            except Exception:
+                logger.exception("Failed to flush %d buffered view counts", len(counts))
+                self._get_buffer().restore(counts)
+                return 0
+            return len(counts)
+        finally:
+            self._flush_lock.release()
+
+
+view_counter = ViewCounter()
+
+
+@atexit.register
+def _flush_on_exit():
+    if view_counter.buffer is not None:
+        try:
+            view_counter.flush()
+        except Exception:  # pragma: no cover
+            logger.exception("Failed to flush view counts at exit")
+
+
+def adjust_post_counts(delta, category_ids=(), tag_ids=()):
+    """
+    Shift the materialized published-post counters of the given categories
+    and tags by ``delta``
+    """
+    from .models import Category, Tag
+
+    category_ids = {pk for pk in category_ids if pk}
+    tag_ids = {pk for pk in tag_ids if pk}
+    if category_ids:
+        Category.objects.filter(pk__in=category_ids).update(
+            post_count=Greatest(F("post_count") + delta, 0)
+        )
+    if tag_ids:
+        Tag.objects.filter(pk__in=tag_ids).update(
+            post_count=Greatest(F("post_count") + delta, 0)
+        )
+
+
+def rebuild_post_counts(category_model=None, tag_model=None, post_model=None):
+    """
+    Recompute every category and tag counter with one UPDATE per table.
+
+    The model arguments allow data migrations to pass historical models.
+    """
+    if category_model is None:
+        from .models import Category, Post, Tag
+
+        category_model, tag_model, post_model = Category, Tag, Post
+
+    category_counts = (
+        post_model.objects.filter(category=OuterRef("pk"), is_published=True)
+        .order_by()
+        .values("category")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    categories = category_model.objects.update(
+        post_count=Coalesce(Subquery(category_counts), 0)
+    )
+
+    through = post_model.tags.through
+    tag_counts = (
+        through.objects.filter(tag=OuterRef("pk"), post__is_published=True)
+        .order_by()
+        .values("tag")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    tags = tag_model.objects.update(post_count=Coalesce(Subquery(tag_counts), 0))
+    return categories, tags
+
+
+def record_approved_comment(post_id, created_at, count=1):
+    """
+    Count ``count`` newly approved comments, the latest made at
+    ``created_at``, on their post without aggregating
+    """
+    from .models import Post
+
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F("comment_count") + count,
+        last_comment_at=Greatest(
+            Coalesce(F("last_comment_at"), created_at), created_at
+        ),
+    )
+
+
+def rebuild_comment_stats(post_ids=None, post_model=None, comment_model=None):
+    """
+    Recompute ``comment_count`` and ``last_comment_at`` for the given posts
+    (all posts when ``post_ids`` is None) in a single UPDATE
+    """
+    if post_model is None:
+        from .models import Comment, Post
+
+        post_model, comment_model = Post, Comment
+
+    approved = (
+        comment_model.objects.filter(post=OuterRef("pk"), is_approved=True)
+        .order_by()
+        .values("post")
+    )
+    posts = post_model.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    return posts.update(
+        comment_count=Coalesce(
+            Subquery(approved.annotate(total=Count("pk")).values("total")), 0
+        ),
+        last_comment_at=Subquery(
+            approved.annotate(latest=Max("created_at")).values("latest")
+        ),
+    )
@@ -0,0 +1,492 @@
+"""
+Deterministic synthetic dataset generator for load and scale testing.
+
+Rows are generated in fixed-size chunks of posts, each chunk from its own
+seeded random stream, so the same seed and sizes always produce the same
+data regardless of how many worker processes generate the chunks. Workers
+only build plain tuples and the parent process inserts them. Users,
+profiles, categories and tags go through ``bulk_create``; posts, their tag
+through rows and comments, which make up nearly all of the volume, are
+written with a plain ``executemany`` INSERT per batch, because compiling
+every value through ``bulk_create`` costs more than the insert itself.
+
+Distributions are skewed the way real blogs are: authors, categories, tags,
+words and views follow Zipf-like laws, and a few posts attract most of the
+comments, many of which are replies nested into threads.
+"""
+
+import json
+import math
+import multiprocessing
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+from itertools import product
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .counters import rebuild_comment_stats, rebuild_post_counts
+from .markdown import RENDERER_VERSION, render_markdown, summarize
+from .models import Category, Comment, Post, Profile, Tag
+from .search import get_search_backend
+
+BASE_WORDS = (
+    "the of and to in is for on with as it this that by from be are at or an "
+    "django python query cache index database model view template request "
+    "response server client api test deploy performance latency throughput "
+    "async thread process memory disk network queue worker search page post "
+    "comment user profile tag category session cookie header static media "
+    "image render migrate schema table column join filter order limit offset"
+).split()
+SYLLABLES = "ka lo mi ne ru sa ti vo ze pa de fi gu ho ja li mo nu ri su".split()
+
+VOCABULARY_SIZE = 5000
+CHUNK_SIZE = 2000
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+# Per-post comment threads: chance that a comment is a reply, and the depth
+# beyond which replies attach to the thread root instead
+REPLY_PROBABILITY = 0.45
+MAX_THREAD_DEPTH = 12
+
+# Column order of the tuples produced by build_chunk()
+POST_FIELDS = (
+    "id",
+    "title",
+    "slug",
+    "author",
+    "category",
+    "content",
+    "excerpt",
+    "featured_image",
+    "is_published",
+    "published_at",
+    "views_count",
+    "comment_count",
+    "last_comment_at",
+    "created_at",
+    "updated_at",
+    "content_html",
+    "content_html_version",
+    "toc",
+    "summary",
+    "image_derivatives",
+)
+POST_TAG_FIELDS = ("post", "tag")
+COMMENT_FIELDS = (
+    "id",
+    "post",
+    "author",
+    "content",
+    "parent",
+    "path",
+    "is_approved",
+    "created_at",
+    "updated_at",
+)
+
+
+@lru_cache(maxsize=1)
+def vocabulary():
+    words = list(BASE_WORDS)
+    for length in (2, 3, 4):
+        for syllables in product(SYLLABLES, repeat=length):
+            if len(words) >= VOCABULARY_SIZE:
+                return np.array(words)
+            words.append("".join(syllables))
+    return np.array(words)
+
+
+@lru_cache(maxsize=16)
+def zipf_cdf(size, exponent=1.1):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def zipf_sample(rng, size, count, exponent=1.1):
+    """
+    Draw ``count`` indexes in ``range(size)``, index 0 being the most likely
+    """
+    indexes = np.searchsorted(zipf_cdf(size, exponent), rng.random(count))
+    return np.minimum(indexes, size - 1)
+
+
+def texts(rng, lengths):
+    """
+    Return one string of Zipf-distributed words per entry of ``lengths``
+    """
+    drawn = vocabulary()[zipf_sample(rng, VOCABULARY_SIZE, int(lengths.sum()))]
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    return [
+        " ".join(drawn[bounds[i] : bounds[i + 1]].tolist()) for i in range(len(lengths))
+    ]
+
+
+def chunk_rng(seed, chunk):
+    return np.random.default_rng([seed, 0, chunk])
+
+
+def comment_offset(spec, post_index):
+    # Comments are spread over chunks by a fixed formula, so every chunk
+    # knows its comment id range without seeing the others
+    return spec["comments"] * post_index // spec["posts"]
+
+
+def build_chunk(spec, chunk):
+    """
+    Generate the posts of ``chunk`` with their tags and comments as tuples
+    """
+    rng = chunk_rng(spec["seed"], chunk)
+    start = chunk * spec["chunk_size"]
+    stop = min(start + spec["chunk_size"], spec["posts"])
+    count = stop - start
+    now = spec["now"]
+    user_ids, category_ids, tag_ids = (
+        spec["user_ids"],
+        spec["category_ids"],
+        spec["tag_ids"],
+    )
+
+    post_ids = spec["post_base"] + np.arange(start, stop)
+    authors = user_ids[zipf_sample(rng, len(user_ids), count)]
+    if len(category_ids):
+        categories = category_ids[zipf_sample(rng, len(category_ids), count, 0.8)]
+        categories = np.where(rng.random(count) < 0.05, 0, categories)
+    else:
+        categories = np.zeros(count, dtype=np.int64)
+    published = rng.random(count) < 0.95
+    ages = rng.random(count) * 3 * SECONDS_PER_YEAR
+    views = np.minimum(rng.zipf(1.6, count) * 10, 10_000_000)
+    lengths = np.maximum(rng.poisson(spec["words_per_post"], count), 10)
+
+    titles = texts(rng, rng.integers(4, 10, count))
+    contents = texts(rng, lengths)
+    tag_counts = rng.integers(0, 7, count) if len(tag_ids) else np.zeros(count, int)
+    tag_picks = np.split(
+        zipf_sample(rng, max(len(tag_ids), 1), int(tag_counts.sum())),
+        np.cumsum(tag_counts)[:-1],
+    )
+
+    posts, post_tags, created = [], [], []
+    for i in range(count):
+        post_id = int(post_ids[i])
+        created.append(now - timedelta(seconds=float(ages[i])))
+        content_html, toc = render_markdown(contents[i])
+        excerpt = " ".join(contents[i].split()[:25])
+        posts.append(
+            (
+                post_id,
+                titles[i].capitalize(),
+                f"{'-'.join(titles[i].split()[:6])}-{post_id}",
+                int(authors[i]),
+                int(categories[i]) or None,
+                contents[i],
+                excerpt,
+                "",
+                bool(published[i]),
+                created[i] if published[i] else None,
+                int(views[i]) if published[i] else 0,
+                0,
+                None,
+                created[i],
+                created[i],
+                content_html,
+                RENDERER_VERSION,
+                toc,
+                summarize(excerpt, content_html),
+                {},
+            )
+        )
+        post_tags.extend((post_id, int(tag_ids[t])) for t in np.unique(tag_picks[i]))
+
+    # A few posts attract most of the discussion
+    first = comment_offset(spec, start)
+    total = comment_offset(spec, stop) - first
+    weights = (rng.pareto(1.2, count) + 0.01) * published
+    if not weights.sum():
+        weights = np.ones(count)
+    per_post = rng.multinomial(total, weights / weights.sum())
+
+    commenters = user_ids[zipf_sample(rng, len(user_ids), total)].tolist()
+    bodies = texts(rng, rng.integers(8, 40, total))
+    approved = (rng.random(total) < 0.97).tolist()
+    replies = (rng.random(total) < REPLY_PROBABILITY).tolist()
+    # Replies favour recent comments: how far back in the thread to attach
+    distances = (rng.zipf(1.5, total) - 1).tolist()
+    gaps = rng.exponential(600, total).tolist()
+
+    comments = []
+    n = 0
+    for i in np.flatnonzero(per_post):
+        post_id = posts[i][0]
+        thread = []
+        for _ in range(int(per_post[i])):
+            comment_id = spec["comment_base"] + first + n
+            parent = None
+            if thread and replies[n]:
+                parent = thread[max(len(thread) - 1 - distances[n], 0)]
+                if parent[1].count("/") >= MAX_THREAD_DEPTH:
+                    parent = None
+            segment = str(comment_id).zfill(Comment.PATH_SEGMENT_WIDTH)
+            path = f"{parent[1]}/{segment}" if parent else segment
+            after = parent[2] if parent else created[i]
+            timestamp = min(after + timedelta(minutes=gaps[n]), now)
+            thread.append((comment_id, path, timestamp))
+            comments.append(
+                (
+                    comment_id,
+                    post_id,
+                    commenters[n],
+                    bodies[n],
+                    parent[0] if parent else None,
+                    path,
+                    approved[n],
+                    timestamp,
+                    timestamp,
+                )
+            )
+            n += 1
+    return posts, post_tags, comments
+
+
+_worker_spec = None
+
+
+def _init_worker(spec):
+    global _worker_spec
+    _worker_spec = spec
+
+
+def _prepare_chunk(chunk):
+    return prepare_chunk(_worker_spec, chunk)
+
+
+@contextmanager
+def preserved_timestamps(*models):
+    """
+    Let ``bulk_create`` store the generated ``created_at``/``updated_at``
+    """
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+
+
+def bulk_insert(model, objects, batch_size):
+    for start in range(0, len(objects), batch_size):
+        model.objects.bulk_create(objects[start : start + batch_size])
+
+
+def create_users(count, seed, now, batch_size):
+    base = next_id(User)
+    password = make_password("password123")
+    rng = np.random.default_rng([seed, 1])
+    ages = rng.random(count) * 4 * SECONDS_PER_YEAR
+    for start in range(0, count, batch_size):
+        users, profiles = [], []
+        for i in range(start, min(start + batch_size, count)):
+            joined = now - timedelta(seconds=float(ages[i]))
+            users.append(
+                User(
+                    id=base + i,
+                    username=f"user{base + i}",
+                    email=f"user{base + i}@example.com",
+                    password=password,
+                    date_joined=joined,
+                )
+            )
+            profiles.append(
+                Profile(user_id=base + i, created_at=joined, updated_at=joined)
+            )
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            Profile.objects.bulk_create(profiles)
+    return np.arange(base, base + count, dtype=np.int64)
+
+
+def create_named(model, count, prefix, now, batch_size, **defaults):
+    base = next_id(model)
+    objects = [
+        model(
+            id=base + i,
+            name=f"{prefix} {base + i}",
+            slug=f"{prefix}-{base + i}",
+            created_at=now,
+            updated_at=now,
+            **defaults,
+        )
+        for i in range(count)
+    ]
+    bulk_insert(model, objects, batch_size)
+    return np.arange(base, base + count, dtype=np.int64)
+
+
+def adapt_rows(model, field_names, rows):
+    """
+    Convert datetimes and JSON values in ``rows`` to what the database
+    driver expects
+    """
+    adapters = {}
+    for index, name in enumerate(field_names):
+        field = model._meta.get_field(name)
+        if isinstance(field, models.DateTimeField):
+            adapters[index] = connection.ops.adapt_datetimefield_value
+        elif isinstance(field, models.JSONField):
+            adapters[index] = json.dumps
+    adapted = []
+    for row in rows:
+        row = list(row)
+        for index, adapt in adapters.items():
+            row[index] = adapt(row[index])
+        adapted.append(row)
+    return adapted
+
+
+def prepare_chunk(spec, chunk):
+    """
+    ``build_chunk()`` with values ready for ``insert_chunk()``; runs in the
+    worker processes, which do not otherwise touch the database
+    """
+    posts, post_tags, comments = build_chunk(spec, chunk)
+    return (
+        adapt_rows(Post, POST_FIELDS, posts),
+        post_tags,
+        adapt_rows(Comment, COMMENT_FIELDS, comments),
+    )
+
+
+def insert_rows(model, field_names, rows, batch_size):
+    """
+    INSERT prepared ``rows`` (in ``field_names`` order) with ``executemany``
+    """
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in field_names]
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(model._meta.db_table),
+        ", ".join(quote(column) for column in columns),
+        ", ".join(["%s"] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start : start + batch_size])
+
+
+def insert_chunk(posts, post_tags, comments, batch_size):
+    with transaction.atomic():
+        insert_rows(Post, POST_FIELDS, posts, batch_size)
+        insert_rows(Post.tags.through, POST_TAG_FIELDS, post_tags, batch_size)
+        insert_rows(Comment, COMMENT_FIELDS, comments, batch_size)
+
+
+def reset_sequences(*models):
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+def generate_dataset(
+    users=1000,
+    posts=10_000,
+    comments=50_000,
+    tags=500,
+    categories=12,
+    seed=0,
+    workers=1,
+    chunk_size=CHUNK_SIZE,
+    batch_size=1000,
+    words_per_post=120,
+    index=True,
+    log=None,
+):
+    """
+    Insert a synthetic dataset of the given size and return the row counts.
+
+    Authors, categories and tags are drawn from the newly created rows, or
+    from the existing ones when a size is zero. Denormalized counters are
+    rebuilt at the end, and the search index too unless ``index`` is False.
+    """
+    log = log or (lambda message: None)
+    now = timezone.now()
+
+    with preserved_timestamps(Profile, Category, Tag):
+        log(f"Creating {users} users")
+        user_ids = create_users(users, seed, now, batch_size)
+        if not users:
+            user_ids = np.array(User.objects.values_list("pk", flat=True), np.int64)
+        if posts and not len(user_ids):
+            raise ValueError("Posts need authors: generate users or create some")
+
+        log(f"Creating {categories} categories and {tags} tags")
+        category_ids = (
+            create_named(Category, categories, "Category", now, batch_size)
+            if categories
+            else np.array(Category.objects.values_list("pk", flat=True), np.int64)
+        )
+        tag_ids = (
+            create_named(Tag, tags, "Tag", now, batch_size)
+            if tags
+            else np.array(Tag.objects.values_list("pk", flat=True), np.int64)
+        )
+
+        spec = {
+            "seed": seed,
+            "now": now,
+            "posts": posts,
+            "comments": comments,
+            "chunk_size": chunk_size,
+            "words_per_post": words_per_post,
+            "post_base": next_id(Post),
+            "comment_base": next_id(Comment),
+            "user_ids": user_ids,
+            "category_ids": np.asarray(category_ids, dtype=np.int64),
+            "tag_ids": np.asarray(tag_ids, dtype=np.int64),
+        }
+        chunks = range(math.ceil(posts / chunk_size))
+        log(f"Creating {posts} posts and {comments} comments in {len(chunks)} chunks")
+        if workers > 1:
+            # Workers only generate rows; inserts stay on this connection
+            context = multiprocessing.get_context("fork")
+            with context.Pool(workers, _init_worker, (spec,)) as pool:
+                for rows in pool.imap(_prepare_chunk, chunks):
+                    insert_chunk(*rows, batch_size)
+        else:
+            for chunk in chunks:
+                insert_chunk(*prepare_chunk(spec, chunk), batch_size)
+
+    reset_sequences(User, Profile, Category, Tag, Post, Post.tags.through, Comment)
+    log("Rebuilding counters")
+    rebuild_post_counts()
+    rebuild_comment_stats()
+    if index:
+        log("Rebuilding the search index")
+        get_search_backend().rebuild()
+    return {
+        "users": users,
+        "categories": categories,
+        "tags": tags,
+        "posts": posts,
+        "comments": comments,
+    }
@@ -152,11 +152,8 @@ class PostForm(forms.ModelForm):
             "tags": forms.SelectMultiple(attrs={"class": "form-control"}),
             "is_published": forms.CheckboxInput(attrs={"class": "form-check-input"}),
         }
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fields[
-            "slug"
-        ].help_text = "URL-friendly version of the title. Leave blank to auto-generate."
-        self.fields["excerpt"].help_text = "Brief description of the post (optional)."
-        self.fields["tags"].help_text = "Select relevant tags for this post."
+        help_texts = {
+            "slug": "URL-friendly version of the title. Leave blank to auto-generate.",
+            "excerpt": "Brief description of the post (optional).",
+            "tags": "Select relevant tags for this post.",
+        }
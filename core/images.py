@@ -0,0 +1,219 @@
+"""
+Responsive derivatives of post featured images.
+
+Uploads are kept as they are, but pages never send them: after a post with
+a new ``featured_image`` is committed, a background worker resizes the
+image to each of ``IMAGE_DERIVATIVE_WIDTHS`` (never enlarging it), encodes
+every size as WebP and JPEG, and stores the resulting URLs in
+``Post.image_derivatives``. Templates turn them into ``srcset``/``sizes``
+through ``core/includes/featured_image.html`` and fall back to the original
+until the derivatives of the current upload exist.
+
+Jobs run on a thread pool of ``IMAGE_DERIVATIVE_WORKERS`` threads (Pillow
+releases the GIL while decoding, resizing and encoding); ``0`` generates
+them inline when the transaction commits. ``manage.py
+generate_image_derivatives`` fills in posts that have none.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .page_cache import invalidate_tags
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivative_widths():
+    return sorted(getattr(settings, "IMAGE_DERIVATIVE_WIDTHS", (320, 640, 960, 1280)))
+
+
+def derivative_name(name, width, extension):
+    """
+    Storage name of the ``width`` pixels wide ``extension`` copy of ``name``
+    """
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, "derivatives", f"{stem}-{width}w.{extension}")
+
+
+def srcset(entries):
+    return ", ".join(f"{url} {width}w" for width, url in entries)
+
+
+class ResponsiveImageMixin:
+    """
+    Template helpers for objects with ``featured_image`` and
+    ``image_derivatives``
+    """
+
+    __slots__ = ()
+
+    @property
+    def responsive_image(self):
+        """
+        ``{"webp", "jpeg"}`` srcsets plus a fallback ``src`` and the original
+        ``width``/``height``, or None until the current upload is processed
+        """
+        derivatives = self.image_derivatives
+        if (
+            not self.featured_image
+            or not derivatives
+            or derivatives.get("source") != self.featured_image.name
+        ):
+            return None
+        return {
+            "webp": srcset(derivatives["webp"]),
+            "jpeg": srcset(derivatives["jpeg"]),
+            "src": derivatives["jpeg"][-1][1],
+            "width": derivatives["width"],
+            "height": derivatives["height"],
+        }
+
+
+def _flatten(image):
+    # JPEG has no alpha channel, so transparent areas become white
+    if image.mode == "RGB":
+        return image
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def build_derivatives(name, storage):
+    """
+    Write the WebP and JPEG derivatives of the image ``name`` in ``storage``
+    and return the ``image_derivatives`` value describing them
+    """
+    with storage.open(name, "rb") as source, Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    derivatives = {
+        "source": name,
+        "width": image.width,
+        "height": image.height,
+        **{extension: [] for extension in FORMATS},
+    }
+    for width in sorted({min(width, image.width) for width in derivative_widths()}):
+        height = max(round(image.height * width / image.width), 1)
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for extension, options in FORMATS.items():
+            frame = _flatten(resized) if extension == "jpeg" else resized
+            buffer = BytesIO()
+            frame.save(buffer, **options)
+            # Content-addressed storages pick the final name; derivatives no
+            # longer referenced are left to manage.py collect_media_garbage
+            path = storage.save(
+                derivative_name(name, width, extension),
+                ContentFile(buffer.getvalue()),
+            )
+            derivatives[extension].append([width, storage.url(path)])
+    return derivatives
+
+
+def generate_derivatives(post_id, name):
+    """
+    Build the derivatives of ``name`` and store them on post ``post_id``
+    unless its image has changed meanwhile; return True if stored
+    """
+    from .models import Post
+
+    storage = Post._meta.get_field("featured_image").storage
+    derivatives = build_derivatives(name, storage)
+    updated = Post.objects.filter(pk=post_id, featured_image=name).update(
+        image_derivatives=derivatives
+    )
+    if updated:
+        invalidate_tags("posts", f"post:{post_id}")
+    return bool(updated)
+
+
+def _generate_logged(post_id, name):
+    try:
+        return generate_derivatives(post_id, name)
+    except Exception:
+        logger.exception("Failed to generate image derivatives for post %s", post_id)
+        return False
+
+
+def _work(post_id, name):
+    try:
+        return _generate_logged(post_id, name)
+    finally:
+        # Worker threads open their own connections
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2),
+                thread_name_prefix="image-derivatives",
+            )
+        return _executor
+
+
+def schedule_derivatives(post):
+    """
+    Queue derivative generation for ``post`` once the transaction commits
+    """
+    post_id, name = post.pk, post.featured_image.name
+
+    def submit():
+        if getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2) > 0:
+            get_executor().submit(_work, post_id, name)
+        else:
+            _generate_logged(post_id, name)
+
+    transaction.on_commit(submit)
+
+
+def generate_missing_derivatives(full=False, workers=None):
+    """
+    Generate derivatives for posts whose current image has none (or for
+    every post with an image if ``full``) on ``workers`` threads, and
+    return ``(stored, failed)``
+    """
+    from .models import Post
+
+    if workers is None:
+        workers = getattr(settings, "IMAGE_DERIVATIVE_WORKERS", 2)
+    rows = (
+        Post.objects.exclude(featured_image="")
+        .exclude(featured_image__isnull=True)
+        .order_by("pk")
+        .values_list("pk", "featured_image", "image_derivatives")
+    )
+    jobs = [
+        (pk, name)
+        for pk, name, derivatives in rows.iterator()
+        if full or (derivatives or {}).get("source") != name
+    ]
+    if workers > 0:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_work, *zip(*jobs))) if jobs else []
+    else:
+        results = [_generate_logged(pk, name) for pk, name in jobs]
+    stored = sum(results)
+    return stored, len(results) - stored
@@ -0,0 +1,370 @@
+"""
+In-process inverted index with BM25 ranking.
+
+Postings are stored as parallel ``array`` objects (document numbers and
+weighted term frequencies), so a term costs 8 bytes per document instead of
+a Python object per posting. An index is made of two layers:
+
+* a read-only snapshot file that is memory-mapped, so every worker process
+  started from the same file shares its pages through the OS page cache;
+* an in-memory delta holding documents added since the snapshot was written.
+
+Updating or removing a document tombstones its old document number; the
+tombstones are dropped when the next snapshot is written.
+
+Snapshot layout (native byte order, recorded in the header)::
+
+    MAGIC | header length (uint64 LE) | JSON header | padding to 8 bytes
+    post ids        int64 x n_docs, ascending
+    doc lengths     int32 x n_docs
+    term offsets    int64 x (n_terms + 1) into the term bytes
+    posting offsets int64 x (n_terms + 1), relative to the postings
+    term bytes      UTF-8 terms in ascending byte order, padded to 8 bytes
+    postings        for every term: doc numbers int32 x df, frequencies
+                    int32 x df
+
+Documents are numbered in post id order and terms are sorted, so both are
+found by binary search over the mapped arrays: loading a snapshot reads the
+header only, and a worker's private memory does not grow with the number of
+documents or terms in it.
+"""
+
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+MAGIC = b"CPIDX2\n\0"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Weight of a token occurrence in each field when computing term frequency
+FIELD_WEIGHTS = {"title": 3, "excerpt": 2, "tags": 2, "content": 1}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+class TermList:
+    """
+    Sequence view of the sorted terms of a snapshot, as UTF-8 bytes
+    """
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, number):
+        return bytes(self._data[self._offsets[number] : self._offsets[number + 1]])
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped layer of an index
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mtime = os.stat(path).st_mtime
+        view = memoryview(self._mmap)
+        if bytes(view[: len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a search index snapshot")
+        (header_length,) = struct.unpack_from("<Q", view, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(view[start : start + header_length]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(
+                f"{path} was written on a {header['byteorder']}-endian host"
+            )
+        self.n_docs = n_docs = header["n_docs"]
+        self.n_terms = n_terms = header["n_terms"]
+        self.total_length = header["total_length"]
+        self.meta = header.get("meta", {})
+
+        def section(start, size):
+            return view[start : start + size], start + size
+
+        offset = start + header_length
+        offset += -offset % 8
+        post_ids, offset = section(offset, 8 * n_docs)
+        doc_lengths, offset = section(offset, 4 * n_docs)
+        offset += -offset % 8
+        term_offsets, offset = section(offset, 8 * (n_terms + 1))
+        posting_offsets, offset = section(offset, 8 * (n_terms + 1))
+        self.post_ids = post_ids.cast("q")
+        self.doc_lengths = doc_lengths.cast("i")
+        self._posting_offsets = posting_offsets.cast("q")
+        term_offsets = term_offsets.cast("q")
+        term_bytes, offset = section(offset, term_offsets[n_terms] if n_terms else 0)
+        offset += -offset % 8
+        self.terms = TermList(term_bytes, term_offsets)
+        self._postings_start = offset
+        self._view = view
+
+    def docno(self, post_id):
+        """
+        Document number of ``post_id``, or None
+        """
+        docno = bisect.bisect_left(self.post_ids, post_id)
+        if docno < self.n_docs and self.post_ids[docno] == post_id:
+            return docno
+        return None
+
+    def postings(self, term):
+        key = term.encode()
+        number = bisect.bisect_left(self.terms, key)
+        if number == self.n_terms or self.terms[number] != key:
+            return (), ()
+        return self._postings_at(number)
+
+    def _postings_at(self, number):
+        start = self._postings_start + self._posting_offsets[number]
+        df = (self._posting_offsets[number + 1] - self._posting_offsets[number]) // 8
+        docs = self._view[start : start + 4 * df].cast("i")
+        freqs = self._view[start + 4 * df : start + 8 * df].cast("i")
+        return docs, freqs
+
+    def iter_terms(self):
+        """
+        Yield ``(term, (docs, freqs))`` for every term in the snapshot
+        """
+        for number in range(self.n_terms):
+            yield self.terms[number].decode(), self._postings_at(number)
+
+
+class InvertedIndex:
+    """
+    BM25-ranked index of posts keyed by post id
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, snapshot=None):
+        self._lock = threading.RLock()
+        self.snapshot = snapshot
+        self._postings = {}
+        self._post_ids = array("q")
+        self._doc_lengths = array("i")
+        self._deleted = set()
+        # Only documents added since the snapshot; snapshot documents are
+        # looked up in the mapped arrays
+        self._delta_docs = {}
+        self._live_docs = 0
+        self._live_length = 0
+        if snapshot is not None:
+            self._live_docs = snapshot.n_docs
+            self._live_length = snapshot.total_length
+
+    @classmethod
+    def load(cls, path):
+        return cls(Snapshot(path))
+
+    @property
+    def _base_docs(self):
+        return self.snapshot.n_docs if self.snapshot is not None else 0
+
+    def __len__(self):
+        return self._live_docs
+
+    def __contains__(self, post_id):
+        return self._find(post_id) is not None
+
+    def _find(self, post_id):
+        docno = self._delta_docs.get(post_id)
+        if docno is None and self.snapshot is not None:
+            docno = self.snapshot.docno(post_id)
+            if docno in self._deleted:
+                docno = None
+        return docno
+
+    def _doc_length(self, docno):
+        base = self._base_docs
+        if docno < base:
+            return self.snapshot.doc_lengths[docno]
+        return self._doc_lengths[docno - base]
+
+    def _post_id(self, docno):
+        base = self._base_docs
+        if docno < base:
+            return self.snapshot.post_ids[docno]
+        return self._post_ids[docno - base]
+
+    def add(self, post_id, fields):
+        """
+        Index (or re-index) a document given as ``{field name: text}``
+        """
+        frequencies = {}
+        length = 0
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS.get(field, 1)
+            for token in tokenize(text or ""):
+                frequencies[token] = frequencies.get(token, 0) + weight
+                length += weight
+
+        with self._lock:
+            self._remove(post_id)
+            docno = self._base_docs + len(self._post_ids)
+            self._post_ids.append(post_id)
+            self._doc_lengths.append(length)
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("i"), array("i"))
+                postings[0].append(docno)
+                postings[1].append(frequency)
+            self._delta_docs[post_id] = docno
+            self._live_docs += 1
+            self._live_length += length
+
+    def remove(self, post_id):
+        with self._lock:
+            self._remove(post_id)
+
+    def _remove(self, post_id):
+        docno = self._find(post_id)
+        if docno is not None:
+            self._delta_docs.pop(post_id, None)
+            self._deleted.add(docno)
+            self._live_docs -= 1
+            self._live_length -= self._doc_length(docno)
+
+    def _term_postings(self, term):
+        if self.snapshot is not None:
+            yield self.snapshot.postings(term)
+        postings = self._postings.get(term)
+        if postings is not None:
+            yield postings
+
+    def search(self, query, limit, offset=0):
+        """
+        Return post ids of the best ``limit`` matches after ``offset``
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = self._live_docs
+            if not terms or not n_docs:
+                return []
+            average_length = self._live_length / n_docs or 1
+            scores = {}
+            deleted = self._deleted
+            for term in terms:
+                matches = [
+                    (docno, frequency)
+                    for docs, freqs in self._term_postings(term)
+                    for docno, frequency in zip(docs, freqs)
+                    if docno not in deleted
+                ]
+                if not matches:
+                    continue
+                df = len(matches)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for docno, frequency in matches:
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self._doc_length(docno) / average_length
+                    )
+                    score = idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    scores[docno] = scores.get(docno, 0.0) + score
+            best = heapq.nlargest(
+                offset + limit, scores.items(), key=lambda item: (item[1], item[0])
+            )
+            return [self._post_id(docno) for docno, _ in best[offset:]]
+
+    def _live(self):
+        # (post id, document number) of every live document
+        if self.snapshot is not None:
+            for docno, post_id in enumerate(self.snapshot.post_ids):
+                if docno not in self._deleted:
+                    yield post_id, docno
+        yield from self._delta_docs.items()
+
+    def save(self, path, meta=None):
+        """
+        Write the live documents to a compacted snapshot at ``path``, with
+        ``meta`` (JSON) in its header.
+
+        The file is written next to the target and renamed into place, so
+        processes mapping the previous snapshot keep a consistent view.
+        """
+        with self._lock:
+            live = sorted(self._live())
+            renumber = {docno: new for new, (_, docno) in enumerate(live)}
+            post_ids = array("q", (post_id for post_id, _ in live))
+            doc_lengths = array("i", (self._doc_length(docno) for _, docno in live))
+
+            layers = [self._postings.items()]
+            if self.snapshot is not None:
+                layers.insert(0, self.snapshot.iter_terms())
+            merged = {}
+            for layer in layers:
+                for term, (layer_docs, layer_freqs) in layer:
+                    for docno, frequency in zip(layer_docs, layer_freqs):
+                        if docno in renumber:
+                            docs, freqs = merged.setdefault(
+                                term, (array("i"), array("i"))
+                            )
+                            docs.append(renumber[docno])
+                            freqs.append(frequency)
+            total_length = self._live_length
+
+        terms = sorted(merged)
+        encoded = [term.encode() for term in terms]
+        term_offsets, posting_offsets = array("q", [0]), array("q", [0])
+        for term, key in zip(terms, encoded):
+            term_offsets.append(term_offsets[-1] + len(key))
+            posting_offsets.append(posting_offsets[-1] + 8 * len(merged[term][0]))
+        term_bytes = b"".join(encoded)
+        header = json.dumps(
+            {
+                "byteorder": sys.byteorder,
+                "n_docs": len(post_ids),
+                "n_terms": len(terms),
+                "total_length": total_length,
+                "meta": meta or {},
+            },
+            separators=(",", ":"),
+        ).encode()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+
+                def pad():
+                    handle.write(b"\0" * (-handle.tell() % 8))
+
+                handle.write(MAGIC)
+                handle.write(struct.pack("<Q", len(header)))
+                handle.write(header)
+                pad()
+                post_ids.tofile(handle)
+                doc_lengths.tofile(handle)
+                pad()
+                term_offsets.tofile(handle)
+                posting_offsets.tofile(handle)
+                handle.write(term_bytes)
+                pad()
+                for term in terms:
+                    docs, freqs = merged[term]
+                    docs.tofile(handle)
+                    freqs.tofile(handle)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return len(post_ids)
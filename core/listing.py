@@ -0,0 +1,154 @@
+"""
+Listing read model.
+
+Listing pages only show post cards, so they have no use for full ``Post``
+rows and their potentially huge ``content``, ``content_html`` and ``toc``
+columns. ``Post.objects.cards()`` selects just the card columns, with the
+author and category joined in the same query, and yields compact
+``__slots__`` objects instead of model instances; the tags of the fetched
+rows are loaded with one extra query. The result is still a queryset, so it
+can be filtered, ordered, sliced, paginated and iterated asynchronously.
+
+Cards compare equal to the ``Post`` they show.
+"""
+
+from django.db.models.query import ValuesListIterable
+from django.urls import reverse
+
+from .images import ResponsiveImageMixin
+from .models import Post
+
+POST_CARD_FIELDS = (
+    "pk",
+    "title",
+    "slug",
+    "summary",
+    "featured_image",
+    "published_at",
+    "views_count",
+    "comment_count",
+    "last_comment_at",
+    "image_derivatives",
+)
+AUTHOR_CARD_FIELDS = (
+    "author_id",
+    "author__username",
+    "author__first_name",
+    "author__last_name",
+)
+CATEGORY_CARD_FIELDS = ("category_id", "category__name", "category__slug")
+
+
+class Card:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.pk}>"
+
+
+class AuthorCard(Card):
+    __slots__ = ("pk", "username", "first_name", "last_name")
+
+    def get_full_name(self):
+        return f"{self.first_name} {self.last_name}".strip()
+
+
+class CategoryCard(Card):
+    __slots__ = ("pk", "name", "slug")
+
+
+class TagCard(Card):
+    __slots__ = ("pk", "name", "slug")
+
+
+class TagList(list):
+    """
+    Tags of a card, usable in templates like a prefetched related manager
+    """
+
+    __slots__ = ()
+
+    def all(self):
+        return self
+
+    def exists(self):
+        return bool(self)
+
+
+class PostCard(ResponsiveImageMixin, Card):
+    __slots__ = (*POST_CARD_FIELDS, "author", "category", "tags")
+
+    @property
+    def id(self):
+        return self.pk
+
+    def __eq__(self, other):
+        if isinstance(other, (PostCard, Post)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def get_absolute_url(self):
+        return reverse("core:post_detail", kwargs={"slug": self.slug})
+
+
+def tags_by_post(post_ids):
+    """
+    Return ``{post id: TagList}`` for ``post_ids`` with one query
+    """
+    tags = {post_id: TagList() for post_id in post_ids}
+    rows = (
+        Post.tags.through.objects.filter(post_id__in=post_ids)
+        .order_by("tag__name")
+        .values_list("post_id", "tag_id", "tag__name", "tag__slug")
+    )
+    for post_id, *tag in rows:
+        tags[post_id].append(TagCard(*tag))
+    return tags
+
+
+class PostCardIterable(ValuesListIterable):
+    """
+    Yield ``PostCard`` objects for a queryset made by ``as_cards()``
+    """
+
+    with_tags = True
+
+    def __iter__(self):
+        rows = list(super().__iter__())
+        if self.with_tags:
+            tags = tags_by_post([row[0] for row in rows])
+        image_field = Post._meta.get_field("featured_image")
+        posts, authors = len(POST_CARD_FIELDS), len(AUTHOR_CARD_FIELDS)
+        for row in rows:
+            card = PostCard(*row[:posts])
+            card.featured_image = image_field.attr_class(
+                None, image_field, card.featured_image or ""
+            )
+            card.author = AuthorCard(*row[posts : posts + authors])
+            category = row[posts + authors :]
+            card.category = CategoryCard(*category) if category[0] else None
+            card.tags = tags[card.pk] if self.with_tags else TagList()
+            yield card
+
+
+class UntaggedPostCardIterable(PostCardIterable):
+    with_tags = False
+
+
+def as_cards(queryset, tags=True):
+    """
+    Turn a ``Post`` queryset into one yielding ``PostCard`` objects, with
+    their tags unless ``tags`` is False
+    """
+    queryset = queryset.values_list(
+        *POST_CARD_FIELDS, *AUTHOR_CARD_FIELDS, *CATEGORY_CARD_FIELDS
+    )
+    queryset._iterable_class = PostCardIterable if tags else UntaggedPostCardIterable
+    return queryset
@@ -0,0 +1,134 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import (
+    INTERFACES,
+    BenchmarkError,
+    compare,
+    format_auth_report,
+    format_report,
+    load_baseline,
+    run_auth_benchmark,
+    run_benchmark,
+    save_baseline,
+    throwaway_database,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every route of core.urls in-process through the WSGI and "
+        "ASGI applications and compare the results with a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interface",
+            choices=INTERFACES,
+            action="append",
+            help="Application interface to drive (repeatable, default: both)",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Measured requests per route"
+        )
+        parser.add_argument(
+            "--auth-ratio",
+            type=float,
+            default=0.5,
+            help="Share of requests made by a logged-in user where both kinds apply",
+        )
+        parser.add_argument(
+            "--routes", nargs="+", help="Only benchmark these route names"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--auth",
+            action="store_true",
+            help=(
+                "Benchmark successful logins and registrations (per CPU core "
+                "and configured password hasher) instead of the route mix"
+            ),
+        )
+        parser.add_argument(
+            "--existing",
+            action="store_true",
+            help=(
+                "Use the configured database instead of a generated test "
+                "database; routes that write are skipped unless named in --routes"
+            ),
+        )
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=500)
+        parser.add_argument("--comments", type=int, default=2000)
+        parser.add_argument(
+            "--baseline",
+            default="benchmarks/baseline.json",
+            help="Baseline file to compare with (or write with --save-baseline)",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Store this run as the new baseline instead of comparing",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.25,
+            help="Allowed relative p95 latency increase over the baseline",
+        )
+
+    def handle(self, *args, **options):
+        if options["auth"]:
+            return self.handle_auth(options)
+        kwargs = {
+            "interfaces": options["interface"] or INTERFACES,
+            "requests_per_route": options["requests"],
+            "auth_ratio": options["auth_ratio"],
+            "routes": options["routes"],
+            "seed": options["seed"],
+        }
+        try:
+            if options["existing"]:
+                results = run_benchmark(include_writes=False, **kwargs)
+            else:
+                with throwaway_database(
+                    seed=options["seed"],
+                    users=options["users"],
+                    posts=options["posts"],
+                    comments=options["comments"],
+                    tags=50,
+                    categories=8,
+                ):
+                    results = run_benchmark(**kwargs)
+        except BenchmarkError as error:
+            raise CommandError(error) from error
+
+        self.stdout.write(format_report(results))
+        if options["save_baseline"]:
+            save_baseline(options["baseline"], results)
+            self.stdout.write(
+                self.style.SUCCESS(f"Saved baseline to {options['baseline']}")
+            )
+            return
+
+        try:
+            baseline = load_baseline(options["baseline"])
+        except FileNotFoundError:
+            self.stdout.write(f"No baseline at {options['baseline']}")
+            return
+        regressions = compare(results, baseline, options["threshold"])
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def handle_auth(self, options):
+        if options["existing"]:
+            raise CommandError("--auth creates users and needs a generated database")
+        with throwaway_database(
+            seed=options["seed"], users=1, posts=1, comments=0, tags=1, categories=1
+        ):
+            results = run_auth_benchmark(
+                interfaces=options["interface"] or INTERFACES,
+                requests=options["requests"],
+                seed=options["seed"],
+            )
+        self.stdout.write(format_auth_report(results))
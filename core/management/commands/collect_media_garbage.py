@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete uploaded media files that no post or profile references any more"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=24,
+            help="Keep files written or reused more recently than this",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="List the unreferenced files without deleting them",
+        )
+
+    def handle(self, *args, **options):
+        garbage = collect_garbage(
+            grace=timedelta(hours=options["grace_hours"]),
+            dry_run=options["dry_run"],
+        )
+        if options["dry_run"]:
+            for name in garbage:
+                self.stdout.write(name)
+            self.stdout.write(f"{len(garbage)} unreferenced files")
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Deleted {len(garbage)} unreferenced files")
+            )
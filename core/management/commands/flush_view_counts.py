@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.counters import buffer_is_shared, view_counter
+
+
+class Command(BaseCommand):
+    help = "Write buffered post view counts to the database"
+
+    def handle(self, *args, **options):
+        if not buffer_is_shared():
+            # A per-process buffer lives in the web processes, which flush it
+            # themselves every VIEW_COUNT_FLUSH_INTERVAL seconds and at exit
+            raise CommandError(
+                "View counts are buffered per process; set VIEW_COUNT_BUFFER=cache "
+                "with a shared cache backend to flush them from here"
+            )
+        updated = view_counter.flush()
+        self.stdout.write(
+            self.style.SUCCESS(f"Flushed view counts for {updated} posts")
+        )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from core.images import generate_missing_derivatives
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the WebP/JPEG derivatives of featured images that have none "
+        "(or of every featured image with --all)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Regenerate every post's derivatives, not only missing ones",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Worker threads (default: IMAGE_DERIVATIVE_WORKERS, 0 for inline)",
+        )
+
+    def handle(self, *args, **options):
+        stored, failed = generate_missing_derivatives(
+            full=options["all"], workers=options["workers"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Generated derivatives for {stored} posts")
+        )
+        if failed:
+            self.stderr.write(f"{failed} images could not be processed (see the log)")
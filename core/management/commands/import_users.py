@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.user_import import CHUNK_SIZE, FORMATS, UserImportError, import_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users and profiles from a CSV or NDJSON file; run it again on "
+        "the same file to resume an interrupted import"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV (with a header row) or NDJSON file")
+        parser.add_argument(
+            "--format",
+            choices=sorted(set(FORMATS.values())),
+            help="File format (default: from the file extension)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Accounts created per transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes hashing plaintext passwords",
+        )
+        parser.add_argument(
+            "--max-errors",
+            type=int,
+            default=20,
+            help="Invalid records to list",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stats, errors = import_users(
+                options["path"],
+                format_=options["format"],
+                chunk_size=options["chunk_size"],
+                workers=options["workers"],
+                log=lambda message: self.stdout.write(message),
+            )
+        except (OSError, UserImportError) as error:
+            raise CommandError(error) from error
+
+        for line, message in errors[: options["max_errors"]]:
+            self.stderr.write(f"Line {line}: {message}")
+        if len(errors) > options["max_errors"]:
+            self.stderr.write(f"... and {len(errors) - options['max_errors']} more")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {stats['created']} accounts; skipped {stats['existing']} "
+                f"existing, {stats['duplicate']} duplicate and "
+                f"{stats['invalid']} invalid records"
+            )
+        )
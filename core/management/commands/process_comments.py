@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.comment_queue import drain, purge
+
+
+class Command(BaseCommand):
+    help = "Publish comments waiting in the outbox and purge old entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Comments published per transaction (default COMMENT_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting when it is empty",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep between polls with --loop",
+        )
+        parser.add_argument(
+            "--purge-hours",
+            type=int,
+            default=24,
+            help="Delete published and failed entries older than this",
+        )
+
+    def handle(self, *args, **options):
+        older_than = timedelta(hours=options["purge_hours"])
+        while True:
+            processed = drain(batch_size=options["batch_size"])
+            purged = purge(older_than)
+            if processed or purged or not options["loop"]:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Processed {processed} comments, purged {purged} entries"
+                    )
+                )
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import rebuild_comment_stats, rebuild_post_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the published-post counters on categories and tags and the "
+        "approved-comment stats on posts"
+    )
+
+    def handle(self, *args, **options):
+        categories, tags = rebuild_post_counts()
+        posts = rebuild_comment_stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt post counts for {categories} categories and {tags} tags"
+            )
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt comment stats for {posts} posts")
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Re-index every published post in the configured search backend"
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        indexed = backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {indexed} posts with {backend.__class__.__name__}"
+            )
+        )
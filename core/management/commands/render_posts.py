@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.markdown import RENDERER_VERSION, render_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-render the stored HTML of posts rendered by an older Markdown "
+        "renderer (or of every post with --all)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-render every post, not only those with an outdated version",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = render_posts(full=options["all"], batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered {updated} posts with renderer version {RENDERER_VERSION}"
+            )
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.related import rebuild_related_posts, update_related_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the precomputed related posts of posts changed since the "
+        "last run (or of every post with --full)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Recompute every published post instead of only changed ones",
+        )
+
+    def handle(self, *args, **options):
+        update = rebuild_related_posts if options["full"] else update_related_posts
+        updated = update()
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated related posts for {updated} posts")
+        )
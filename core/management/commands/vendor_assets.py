@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.assets import PACKAGES, AssetError, vendor_assets
+
+
+class Command(BaseCommand):
+    help = (
+        "Download the pinned Bootstrap and Font Awesome releases, verify them "
+        "and write the tree-shaken files the templates use into static/vendor/"
+    )
+
+    def handle(self, *args, **options):
+        for name, (version, _) in PACKAGES.items():
+            self.stdout.write(f"Fetching {name}@{version}")
+        try:
+            written = vendor_assets(settings.BASE_DIR)
+        except (AssetError, OSError) as error:
+            raise CommandError(f"Could not vendor assets: {error}") from error
+        for path, size in written:
+            self.stdout.write(f"  {path} ({size / 1024:.1f} KiB)")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Vendored {len(written)} files; commit static/vendor/ and run "
+                "collectstatic"
+            )
+        )
@@ -0,0 +1,316 @@
+"""
+Safe Markdown renderer for post bodies.
+
+Supports the subset posts are written in: ATX headings, paragraphs, fenced
+code blocks, bulleted and numbered lists (nested by indentation), block
+quotes, horizontal rules, and inline code, emphasis, strong emphasis, links,
+images and ``<https://...>`` autolinks. Raw HTML is not supported: the
+source is escaped before any markup is added, and link and image targets
+are limited to http(s), mailto and relative URLs, so the output can be
+marked safe without a separate sanitizer.
+
+Headings get unique ``id`` anchors and are collected into a table of
+contents in the same pass. Bump ``RENDERER_VERSION`` whenever the output
+changes, so ``manage.py render_posts`` re-renders the stored HTML.
+"""
+
+import re
+from html import unescape
+from urllib.parse import urlsplit
+
+from django.utils.html import escape, strip_tags
+from django.utils.text import Truncator, slugify
+
+from .page_cache import invalidate_tags
+
+RENDERER_VERSION = 1
+
+# Length of the plain-text summary stored for listings
+SUMMARY_WORDS = 40
+
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*([\w+#.-]*)[^`]*$")
+HEADING_RE = re.compile(r"^ {0,3}(#{1,6})(?:\s+(.*?))?(?:\s+#+)?\s*$")
+RULE_RE = re.compile(r"^ {0,3}([-*_])(?:\s*\1){2,}\s*$")
+BULLET_RE = re.compile(r"^( {0,3})[-*+]\s+(.*)$")
+ORDERED_RE = re.compile(r"^( {0,3})\d{1,9}[.)]\s+(.*)$")
+QUOTE_RE = re.compile(r"^ {0,3}>\s?(.*)$")
+
+CODE_SPAN_RE = re.compile(r"(`+)(.+?)\1")
+IMAGE_RE = re.compile(r"!\[([^\]]*)\]\(([^)\s]+)(?:\s+&quot;(.*?)&quot;)?\)")
+LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)\s]+)(?:\s+&quot;(.*?)&quot;)?\)")
+AUTOLINK_RE = re.compile(r"&lt;((?:https?://|mailto:)[^\s&]+(?:&amp;[^\s&]+)*)&gt;")
+STRONG_RE = re.compile(
+    r"\*\*(?=\S)(.+?)(?<=\S)\*\*|(?<!\w)__(?=\S)(.+?)(?<=\S)__(?!\w)"
+)
+EMPHASIS_RE = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)")
+PLACEHOLDER_RE = re.compile("\x00(\\d+)\x00")
+
+SAFE_SCHEMES = {"", "http", "https", "mailto"}
+
+
+def safe_url(url):
+    """
+    Return the (escaped) ``url`` if its scheme is allowed, else None
+    """
+    # Browsers ignore control characters and whitespace inside a scheme
+    target = re.sub(r"[\x00-\x20\x7f]", "", unescape(url))
+    try:
+        scheme = urlsplit(target).scheme.lower()
+    except ValueError:
+        return None
+    return url if scheme in SAFE_SCHEMES else None
+
+
+class Renderer:
+    def __init__(self):
+        self.toc = []
+        self._anchors = set()
+
+    def anchor(self, title):
+        base = slugify(title) or "section"
+        anchor, number = base, 1
+        while anchor in self._anchors:
+            number += 1
+            anchor = f"{base}-{number}"
+        self._anchors.add(anchor)
+        return anchor
+
+    def inline(self, text):
+        """
+        Render the inline markup of ``text``, escaping everything else
+        """
+        held = []
+
+        def hold(html):
+            held.append(html)
+            return f"\x00{len(held) - 1}\x00"
+
+        def code(match):
+            return hold(f"<code>{escape(match.group(2).strip())}</code>")
+
+        def image(match):
+            alt, url, title = match.groups()
+            url = safe_url(url)
+            if url is None:
+                return match.group(0)
+            title = f' title="{title}"' if title else ""
+            return hold(f'<img src="{url}" alt="{alt}"{title} loading="lazy">')
+
+        def link(match):
+            label, url, title = match.groups()
+            url = safe_url(url)
+            if url is None:
+                return label
+            title = f' title="{title}"' if title else ""
+            return hold(f'<a href="{url}"{title}>{self.emphasis(label)}</a>')
+
+        def autolink(match):
+            return hold(f'<a href="{match.group(1)}">{match.group(1)}</a>')
+
+        text = CODE_SPAN_RE.sub(code, text.replace("\x00", ""))
+        text = escape(text)
+        text = IMAGE_RE.sub(image, text)
+        text = LINK_RE.sub(link, text)
+        text = AUTOLINK_RE.sub(autolink, text)
+        text = self.emphasis(text)
+        while "\x00" in text:
+            text = PLACEHOLDER_RE.sub(lambda match: held[int(match.group(1))], text)
+        return text
+
+    @staticmethod
+    def emphasis(text):
+        text = STRONG_RE.sub(
+            lambda match: f"<strong>{match.group(1) or match.group(2)}</strong>", text
+        )
+        return EMPHASIS_RE.sub(
+            lambda match: f"<em>{match.group(1) or match.group(2)}</em>", text
+        )
+
+    def blocks(self, lines):
+        """
+        Render a list of lines as block-level HTML
+        """
+        output = []
+        paragraph = []
+
+        def flush():
+            if paragraph:
+                output.append(f"<p>{self.inline(chr(10).join(paragraph))}</p>")
+                del paragraph[:]
+
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                flush()
+                i += 1
+                continue
+
+            fence = FENCE_RE.match(line)
+            if fence:
+                flush()
+                marker, language = fence.groups()
+                code = []
+                i += 1
+                while i < len(lines) and not lines[i].strip().startswith(marker):
+                    code.append(lines[i])
+                    i += 1
+                i += 1
+                css = f' class="language-{escape(language)}"' if language else ""
+                output.append(
+                    f"<pre><code{css}>{escape(chr(10).join(code))}</code></pre>"
+                )
+                continue
+
+            heading = HEADING_RE.match(line)
+            if heading:
+                flush()
+                level = len(heading.group(1))
+                html = self.inline(heading.group(2) or "")
+                title = unescape(strip_tags(html))
+                anchor = self.anchor(title)
+                self.toc.append({"level": level, "title": title, "anchor": anchor})
+                output.append(f'<h{level} id="{anchor}">{html}</h{level}>')
+                i += 1
+                continue
+
+            if RULE_RE.match(line):
+                flush()
+                output.append("<hr>")
+                i += 1
+                continue
+
+            if QUOTE_RE.match(line):
+                flush()
+                quoted = []
+                while i < len(lines) and lines[i].strip():
+                    match = QUOTE_RE.match(lines[i])
+                    quoted.append(match.group(1) if match else lines[i])
+                    i += 1
+                output.append(f"<blockquote>{self.blocks(quoted)}</blockquote>")
+                continue
+
+            if BULLET_RE.match(line) or ORDERED_RE.match(line):
+                flush()
+                i = self.list(lines, i, output)
+                continue
+
+            paragraph.append(line.strip())
+            i += 1
+        flush()
+        return "\n".join(output)
+
+    def list(self, lines, i, output):
+        """
+        Render the list starting at ``lines[i]`` and return the next index
+        """
+        pattern = BULLET_RE if BULLET_RE.match(lines[i]) else ORDERED_RE
+        tag = "ul" if pattern is BULLET_RE else "ol"
+        indent = len(pattern.match(lines[i]).group(1))
+
+        def item_start(line):
+            match = pattern.match(line)
+            return match if match and len(match.group(1)) <= indent + 1 else None
+
+        items = []
+        while i < len(lines):
+            line = lines[i]
+            match = item_start(line)
+            if match:
+                items.append([match.group(2)])
+            elif line.strip() and line[:1] == " ":
+                # Continuation or nested block, indented under the item
+                items[-1].append(line)
+            elif not line.strip():
+                following = lines[i + 1] if i + 1 < len(lines) else ""
+                if not (item_start(following) or following[:1] == " "):
+                    break
+                if not item_start(following):
+                    items[-1].append("")
+            else:
+                break
+            i += 1
+
+        rendered = []
+        for item in items:
+            text, rest = [item[0]], item[1:]
+            # Lines up to the first nested block continue the item's text
+            while rest and rest[0] and not self.starts_block(rest[0].strip()):
+                text.append(rest.pop(0).strip())
+            nested = self.blocks(dedent(rest)) if rest else ""
+            body = self.inline("\n".join(text))
+            rendered.append(f"<li>{body}{nested}</li>")
+        output.append(f"<{tag}>\n" + "\n".join(rendered) + f"\n</{tag}>")
+        return i
+
+    @staticmethod
+    def starts_block(line):
+        return any(
+            pattern.match(line)
+            for pattern in (BULLET_RE, ORDERED_RE, FENCE_RE, QUOTE_RE, HEADING_RE)
+        )
+
+
+def dedent(lines):
+    indents = [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+    width = min(indents, default=0)
+    return [line[width:] for line in lines]
+
+
+def render_markdown(text):
+    """
+    Return ``(html, toc)`` for the Markdown ``text``.
+
+    ``toc`` lists the headings as ``{"level", "title", "anchor"}`` dicts.
+    """
+    renderer = Renderer()
+    lines = (text or "").replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    html = renderer.blocks([line.expandtabs(4) for line in lines])
+    return html, renderer.toc
+
+
+def summarize(excerpt, html):
+    """
+    Return the plain-text listing summary: the excerpt if there is one,
+    else the first ``SUMMARY_WORDS`` words of the rendered content
+    """
+    text = excerpt or unescape(strip_tags(html or ""))
+    return Truncator(" ".join(text.split())).words(SUMMARY_WORDS)
+
+
+def render_posts(full=False, batch_size=500, post_model=None):
+    """
+    Store freshly rendered HTML for posts rendered by an older renderer (or
+    for every post if ``full``) and return how many were updated
+    """
+    if post_model is None:
+        from .models import Post as post_model
+
+    queryset = post_model.objects.order_by("pk")
+    if not full:
+        queryset = queryset.exclude(content_html_version=RENDERER_VERSION)
+    updated = last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).values_list("pk", "content", "excerpt")[
+                :batch_size
+            ]
+        )
+        if not rows:
+            return updated
+        posts = []
+        for pk, content, excerpt in rows:
+            html, toc = render_markdown(content)
+            posts.append(
+                post_model(
+                    pk=pk,
+                    content_html=html,
+                    toc=toc,
+                    content_html_version=RENDERER_VERSION,
+                    summary=summarize(excerpt, html),
+                )
+            )
+        post_model.objects.bulk_update(posts, post_model.RENDERED_FIELDS)
+        invalidate_tags(*(f"post:{pk}" for pk, *_ in rows))
+        updated += len(rows)
+        last_pk = rows[-1][0]
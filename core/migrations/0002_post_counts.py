@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+def populate_post_counts(apps, schema_editor):
+    from core.counters import rebuild_post_counts
+
+    rebuild_post_counts(
+        category_model=apps.get_model("core", "Category"),
+        tag_model=apps.get_model("core", "Tag"),
+        post_model=apps.get_model("core", "Post"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="post_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, help_text="Number of published posts"
+            ),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="post_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, help_text="Number of published posts"
+            ),
+        ),
+        migrations.RunPython(populate_post_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_comment_stats(apps, schema_editor):
+    from core.counters import rebuild_comment_stats
+
+    rebuild_comment_stats(
+        post_model=apps.get_model("core", "Post"),
+        comment_model=apps.get_model("core", "Comment"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_post_counts"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, help_text="Number of approved comments"
+            ),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="last_comment_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["is_published", "-last_comment_at"],
+                name="core_post_is_publ_cd287d_idx",
+            ),
+        ),
+        migrations.RunPython(populate_comment_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+from django.db import OperationalError, migrations
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_post_fts "
+    "USING fts5(title, excerpt, content, tokenize='porter unicode61')"
+)
+SQLITE_POPULATE = (
+    "INSERT INTO core_post_fts (rowid, title, excerpt, content) "
+    "SELECT id, title, excerpt, content FROM core_post WHERE is_published"
+)
+SQLITE_DROP = "DROP TABLE IF EXISTS core_post_fts"
+
+POSTGRES_CREATE = [
+    "ALTER TABLE core_post ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(excerpt, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'C')"
+    ") STORED",
+    "CREATE INDEX IF NOT EXISTS core_post_search_vector_idx "
+    "ON core_post USING GIN (search_vector)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS core_post_search_vector_idx",
+    "ALTER TABLE core_post DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        try:
+            schema_editor.execute(SQLITE_CREATE)
+        except OperationalError:
+            # SQLite built without FTS5; search falls back to icontains
+            return
+        schema_editor.execute(SQLITE_POPULATE)
+    elif vendor == "postgresql":
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(SQLITE_DROP)
+    elif vendor == "postgresql":
+        for statement in POSTGRES_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_post_comment_stats"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
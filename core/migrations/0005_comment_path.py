@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def populate_comment_paths(apps, schema_editor):
+    Comment = apps.get_model("core", "Comment")
+    segment = LPad(Cast("pk", models.CharField()), 10, Value("0"))
+    Comment.objects.filter(parent__isnull=True).update(path=segment)
+    # One set-based UPDATE per thread level, from the paths of the level above
+    parent_path = Subquery(
+        Comment.objects.filter(pk=OuterRef("parent_id")).values("path")
+    )
+    while Comment.objects.filter(path="", parent__path__gt="").update(
+        path=Concat(parent_path, Value("/"), segment, output_field=models.CharField())
+    ):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_post_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="path",
+            field=models.CharField(blank=True, editable=False, max_length=1024),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["post", "path"], name="core_commen_post_id_3e9299_idx"
+            ),
+        ),
+        migrations.RunPython(populate_comment_paths, migrations.RunPython.noop),
+    ]
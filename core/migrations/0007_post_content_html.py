@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_related_posts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="content_html",
+            field=models.TextField(
+                blank=True, editable=False, help_text="Content rendered from Markdown"
+            ),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="content_html_version",
+            field=models.PositiveSmallIntegerField(
+                default=0, editable=False, help_text="Renderer version of content_html"
+            ),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="toc",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                editable=False,
+                help_text="Headings of the content",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+from core.markdown import render_markdown, summarize
+
+
+def populate_summaries(apps, schema_editor):
+    Post = apps.get_model("core", "Post")
+    batch = []
+    posts = Post.objects.only("pk", "content", "excerpt", "content_html")
+    for post in posts.order_by("pk").iterator():
+        html = post.content_html or render_markdown(post.content)[0]
+        post.summary = summarize(post.excerpt, html)
+        batch.append(post)
+        if len(batch) >= 1000:
+            Post.objects.bulk_update(batch, ["summary"])
+            batch = []
+    Post.objects.bulk_update(batch, ["summary"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_post_content_html"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="summary",
+            field=models.TextField(
+                blank=True,
+                editable=False,
+                help_text="Excerpt, or the start of the content, shown in listings",
+            ),
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
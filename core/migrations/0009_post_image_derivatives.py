@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_post_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="image_derivatives",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                help_text="Resized WebP/JPEG copies of the featured image",
+            ),
+        ),
+    ]
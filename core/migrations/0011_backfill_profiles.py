@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+def create_missing_profiles(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Profile = apps.get_model("core", "Profile")
+    now = timezone.now()
+    user_ids = User.objects.filter(profile__isnull=True).values_list("pk", flat=True)
+    Profile.objects.bulk_create(
+        (Profile(user_id=pk, created_at=now, updated_at=now) for pk in user_ids),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("core", "0010_updated_at_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_profiles, migrations.RunPython.noop),
+    ]
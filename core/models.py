@@ -1,7 +1,12 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .images import ResponsiveImageMixin
+from .markdown import RENDERER_VERSION, render_markdown, summarize
 
 
 class TimeStampedModel(models.Model):
@@ -15,10 +20,41 @@ class TimeStampedModel(models.Model):
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+    def get_loaded_value(self, field_name, default=None):
+        """
+        Return the value ``field_name`` had when the instance was loaded
+        """
+        return getattr(self, "_loaded_values", {}).get(field_name, default)
+
+
+class ProfileQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """
+        The profile of ``user``, recreated if it has gone missing
+        """
+        try:
+            return user.profile
+        except Profile.DoesNotExist:
+            return self.get_or_create(user=user)[0]
+
 
 class Profile(TimeStampedModel):
     """
-    User profile model extending Django's built-in User model
+    User profile model extending Django's built-in User model. Every user
+    gets one when it is created (see core.signals).
     """
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
@@ -28,6 +64,11 @@ class Profile(TimeStampedModel):
     phone = models.CharField(max_length=20, blank=True)
     avatar = models.ImageField(upload_to="avatars/", blank=True, null=True)
 
+    objects = ProfileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["updated_at"])]
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
@@ -44,10 +85,14 @@ class Category(TimeStampedModel):
     slug = models.SlugField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
+    post_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Number of published posts"
+    )
 
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ["name"]
+        indexes = [models.Index(fields=["updated_at"])]
 
     def __str__(self):
         return self.name
@@ -56,7 +101,17 @@ class Category(TimeStampedModel):
         return reverse("core:category_detail", kwargs={"slug": self.slug})
 
 
-class Post(TimeStampedModel):
+class PostQuerySet(models.QuerySet):
+    def cards(self, tags=True):
+        """
+        Lightweight listing rows without the post bodies (see core.listing)
+        """
+        from .listing import as_cards
+
+        return as_cards(self, tags)
+
+
+class Post(ResponsiveImageMixin, TimeStampedModel):
     """
     Blog post model
     """
@@ -75,12 +130,44 @@ class Post(TimeStampedModel):
     is_published = models.BooleanField(default=False)
     published_at = models.DateTimeField(null=True, blank=True)
     views_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Number of approved comments"
+    )
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
     tags = models.ManyToManyField("Tag", blank=True, related_name="posts")
+    content_html = models.TextField(
+        blank=True, editable=False, help_text="Content rendered from Markdown"
+    )
+    content_html_version = models.PositiveSmallIntegerField(
+        default=0, editable=False, help_text="Renderer version of content_html"
+    )
+    toc = models.JSONField(
+        default=list, blank=True, editable=False, help_text="Headings of the content"
+    )
+    summary = models.TextField(
+        blank=True,
+        editable=False,
+        help_text="Excerpt, or the start of the content, shown in listings",
+    )
+
+    image_derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Resized WebP/JPEG copies of the featured image",
+    )
+
+    objects = PostQuerySet.as_manager()
+
+    # Written by render_content() whenever the content changes
+    RENDERED_FIELDS = ("content_html", "content_html_version", "toc", "summary")
 
     class Meta:
         ordering = ["-published_at", "-created_at"]
         indexes = [
             models.Index(fields=["is_published", "-published_at"]),
+            models.Index(fields=["is_published", "-last_comment_at"]),
+            models.Index(fields=["is_published", "-updated_at"]),
             models.Index(fields=["author", "-created_at"]),
             models.Index(fields=["category", "-created_at"]),
         ]
@@ -91,8 +178,43 @@ class Post(TimeStampedModel):
     def save(self, *args, **kwargs):
         if self.is_published and not self.published_at:
             self.published_at = timezone.now()
+        update_fields = kwargs.get("update_fields")
+        if (update_fields is None or "content" in update_fields) and (
+            self.content_html_version != RENDERER_VERSION
+            or self.content != self.get_loaded_value("content")
+        ):
+            self.render_content()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, *self.RENDERED_FIELDS}
+        elif update_fields is None or "excerpt" in update_fields:
+            self.summary = summarize(self.excerpt, self._current_rendering()[0])
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "summary"}
         super().save(*args, **kwargs)
 
+    def render_content(self):
+        """
+        Render ``content`` into the stored HTML, table of contents and summary
+        """
+        self.content_html, self.toc = render_markdown(self.content)
+        self.content_html_version = RENDERER_VERSION
+        self.summary = summarize(self.excerpt, self.content_html)
+
+    def _current_rendering(self):
+        # Rows stored by an older renderer are rendered on the fly until
+        # manage.py render_posts has updated them
+        if self.content_html_version == RENDERER_VERSION:
+            return self.content_html, self.toc
+        return render_markdown(self.content)
+
+    @property
+    def rendered_content(self):
+        return mark_safe(self._current_rendering()[0])
+
+    @property
+    def table_of_contents(self):
+        return self._current_rendering()[1]
+
     def get_absolute_url(self):
         return reverse("core:post_detail", kwargs={"slug": self.slug})
 
@@ -105,6 +227,32 @@ class Post(TimeStampedModel):
         )
 
 
+class RelatedPost(models.Model):
+    """
+    Precomputed ``rank``-th most similar post to ``post``, maintained by
+    ``core.related``
+    """
+
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="related_entries"
+    )
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["post", "rank"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "rank"], name="core_relatedpost_post_rank"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.related} is related to {self.post} (#{self.rank})"
+
+
 class Tag(TimeStampedModel):
     """
     Tag model for tagging posts
@@ -112,9 +260,13 @@ class Tag(TimeStampedModel):
 
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=50, unique=True)
+    post_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Number of published posts"
+    )
 
     class Meta:
         ordering = ["name"]
+        indexes = [models.Index(fields=["updated_at"])]
 
     def __str__(self):
         return self.name
@@ -123,23 +275,44 @@ class Tag(TimeStampedModel):
         return reverse("core:tag_detail", kwargs={"slug": self.slug})
 
 
+class CommentQuerySet(models.QuerySet):
+    def thread(self):
+        """
+        Approved comments with their authors in depth-first thread order
+        """
+        return self.filter(is_approved=True).select_related("author").order_by("path")
+
+
 class Comment(TimeStampedModel):
     """
-    Comment model for posts
+    Comment model for posts.
+
+    ``path`` is a materialized path of zero-padded primary keys from the
+    root comment down to this one (``"0000000003/0000000017"``), so ordering
+    by it yields a whole thread depth first and a subtree is a prefix match.
     """
 
+    PATH_SEGMENT_WIDTH = 10
+    PATH_SEPARATOR = "/"
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     content = models.TextField(max_length=1000)
     parent = models.ForeignKey(
         "self", on_delete=models.CASCADE, null=True, blank=True, related_name="replies"
     )
+    path = models.CharField(max_length=1024, blank=True, editable=False)
     is_approved = models.BooleanField(default=True)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ["created_at"]
         indexes = [
             models.Index(fields=["post", "is_approved", "created_at"]),
+            models.Index(fields=["post", "path"]),
+            models.Index(fields=["post", "updated_at"]),
+            models.Index(fields=["updated_at"]),
         ]
 
     def __str__(self):
@@ -147,3 +320,88 @@ class Comment(TimeStampedModel):
 
     def get_absolute_url(self):
         return f"{self.post.get_absolute_url()}#comment-{self.pk}"
+
+    @property
+    def depth(self):
+        return self.path.count(self.PATH_SEPARATOR)
+
+    def build_path(self):
+        segment = str(self.pk).zfill(self.PATH_SEGMENT_WIDTH)
+        if self.parent_id is None:
+            return segment
+        return f"{self.parent.path}{self.PATH_SEPARATOR}{segment}"
+
+    def save(self, *args, **kwargs):
+        moved = self.get_loaded_value("parent_id", self.parent_id) != self.parent_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.path and not moved:
+                return
+            old_path, self.path = self.path, self.build_path()
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            if old_path:
+                # Re-root the subtree under the new path
+                Comment.objects.filter(
+                    path__startswith=old_path + self.PATH_SEPARATOR
+                ).update(
+                    path=Concat(
+                        models.Value(self.path), Substr("path", len(old_path) + 1)
+                    )
+                )
+
+
+class PendingComment(TimeStampedModel):
+    """
+    A submitted comment waiting in the outbox for ``core.comment_queue`` to
+    publish it
+    """
+
+    PENDING = "pending"
+    PUBLISHED = "published"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PUBLISHED, "Published"),
+        (FAILED, "Failed"),
+    ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="+")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    content = models.TextField(max_length=1000)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    comment = models.OneToOneField(
+        Comment, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    error = models.CharField(max_length=200, blank=True)
+    claimed_by = models.CharField(max_length=32, blank=True, editable=False)
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ["pk"]
+        indexes = [
+            models.Index(fields=["status", "claimed_at"]),
+            models.Index(fields=["status", "updated_at"]),
+        ]
+
+    def __str__(self):
+        return f"Pending comment by {self.author_id} on post {self.post_id}"
+
+
+def build_comment_tree(comments):
+    """
+    Attach ``children`` lists to ``comments`` (in thread order) and return
+    the roots. Comments whose parent is not in ``comments`` are dropped, so
+    replies under an unapproved comment stay hidden.
+    """
+    nodes = {}
+    roots = []
+    for comment in comments:
+        comment.children = []
+        if comment.parent_id is None:
+            roots.append(comment)
+        elif comment.parent_id in nodes:
+            nodes[comment.parent_id].children.append(comment)
+        else:
+            continue
+        nodes[comment.pk] = comment
+    return roots
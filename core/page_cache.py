@@ -0,0 +1,211 @@
+"""
+Full-page cache for anonymous readers.
+
+Pages are keyed by their absolute URL (including the query string) and carry
+a set of dependency tags such as ``"posts"`` or ``"post:42"``. Every tag has a
+version token in the cache; an entry is only served while all of its tags
+still have the token it was stored with. Invalidating a tag deletes its token,
+which evicts exactly the pages that depend on it.
+
+Tag versions are captured before the view runs (and when a view declares a
+tag with ``add_page_tags``), so a page rendered while one of its tags is
+invalidated is stored under the old version and never served.
+
+Conditional requests for a cached page are answered from the ``ETag`` and
+``Last-Modified`` headers stored with it (see core.conditional).
+"""
+
+import hashlib
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+PAGE_KEY_PREFIX = "pagecache:page"
+TAG_KEY_PREFIX = "pagecache:tag"
+
+
+def get_cache():
+    return caches[getattr(settings, "PAGE_CACHE_ALIAS", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "PAGE_CACHE_TIMEOUT", 600)
+
+
+def _page_key(request):
+    url = request.build_absolute_uri()
+    return f"{PAGE_KEY_PREFIX}:{hashlib.md5(url.encode()).hexdigest()}"
+
+
+def _tag_key(tag):
+    return f"{TAG_KEY_PREFIX}:{tag}"
+
+
+def add_page_tags(request, *tags):
+    """
+    Declare extra dependencies for the page being rendered for ``request``
+    """
+    request._page_cache_tags = getattr(request, "_page_cache_tags", set()) | set(tags)
+    versions = getattr(request, "_page_cache_versions", None)
+    if versions is not None:
+        new = set(tags) - set(versions)
+        if new:
+            versions.update(_tag_versions(get_cache(), new))
+
+
+def invalidate_tags(*tags):
+    """
+    Evict every cached page that depends on any of ``tags``
+    """
+    if tags:
+        get_cache().delete_many([_tag_key(tag) for tag in set(tags)])
+
+
+def _tag_versions(cache, tags):
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions = {keys[key]: token for key, token in cache.get_many(keys).items()}
+    for tag in set(tags) - set(versions):
+        token = uuid.uuid4().hex
+        if not cache.add(_tag_key(tag), token, timeout=None):
+            token = cache.get(_tag_key(tag), token)
+        versions[tag] = token
+    return versions
+
+
+def _is_cacheable_request(request):
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if request.user.is_authenticated:
+        return False
+    return not len(get_messages(request))
+
+
+def _is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and "private" not in response.get("Cache-Control", "")
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        and not request.user.is_authenticated
+    )
+
+
+def _capture_versions(request, tags):
+    request._page_cache_versions = _tag_versions(get_cache(), tags)
+
+
+def _store(request, response, key, tags):
+    if not _is_cacheable_response(request, response):
+        return
+    cache = get_cache()
+    tags = tags | getattr(request, "_page_cache_tags", set())
+    versions = dict(getattr(request, "_page_cache_versions", {}))
+    missing = tags - set(versions)
+    if missing:
+        versions.update(_tag_versions(cache, missing))
+    entry = {
+        "content": response.content,
+        "status": response.status_code,
+        "headers": list(response.items()),
+        "tags": {tag: versions[tag] for tag in tags},
+    }
+    cache.set(key, entry, get_timeout())
+
+
+def _fetch(key):
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    tags = entry["tags"]
+    if tags:
+        current = cache.get_many([_tag_key(tag) for tag in tags])
+        for tag, token in tags.items():
+            if current.get(_tag_key(tag)) != token:
+                return None
+    response = HttpResponse(entry["content"], status=entry["status"])
+    for header, value in entry["headers"]:
+        response[header] = value
+    return response
+
+
+def _lookup(request):
+    """
+    Return ``(page key, cached response or None)``, or ``(None, None)`` when
+    ``request`` cannot be served from the cache
+    """
+    if not _is_cacheable_request(request):
+        return None, None
+    key = _page_key(request)
+    cached = _fetch(key)
+    if cached is not None and (
+        cached.has_header("ETag") or cached.has_header("Last-Modified")
+    ):
+        # Stored validators stay valid as long as the entry does
+        cached = get_conditional_response(
+            request,
+            etag=cached.get("ETag"),
+            last_modified=parse_http_date_safe(cached.get("Last-Modified")),
+            response=cached,
+        )
+    return key, cached
+
+
+def _remember(request, response, key, tags):
+    if hasattr(response, "render") and callable(response.render):
+        response.add_post_render_callback(lambda r: _store(request, r, key, tags))
+    else:
+        _store(request, response, key, tags)
+
+
+def cache_anonymous_page(*tags):
+    """
+    View decorator that serves anonymous GET requests from the page cache.
+
+    ``tags`` are the static dependencies of the view; views may declare
+    object-level dependencies while rendering with ``add_page_tags``. Async
+    views get an async wrapper, which runs the cache and session lookups in
+    a worker thread.
+    """
+    static_tags = set(tags)
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                key, cached = await sync_to_async(_lookup)(request)
+                if cached is not None:
+                    return cached
+                if key is not None:
+                    await sync_to_async(_capture_versions)(request, static_tags)
+                response = await view_func(request, *args, **kwargs)
+                if key is not None:
+                    await sync_to_async(_remember)(request, response, key, static_tags)
+                return response
+
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            key, cached = _lookup(request)
+            if cached is not None:
+                return cached
+            if key is not None:
+                _capture_versions(request, static_tags)
+            response = view_func(request, *args, **kwargs)
+            if key is not None:
+                _remember(request, response, key, static_tags)
+            return response
+
+        return _wrapped_view
+
+    return decorator
@@ -0,0 +1,262 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` and a ``COUNT(*)``, each page is fetched with a
+``WHERE (ordering columns) < (values of the last row seen)`` condition, so
+every page costs one index range scan no matter how deep it is. Cursors are
+opaque URL-safe tokens encoding the boundary row and the direction.
+
+Ranked results (full-text search) have no stable column to seek on, so
+``RankedPaginator`` pages through a backend's result window instead while
+exposing the same cursor interface to templates.
+"""
+
+import base64
+import datetime
+import json
+from collections.abc import Sequence
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+DEFAULT_ORDERING = ("-published_at", "-pk")
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    JSON encoder that keeps full microsecond precision for datetimes, which
+    the keyset comparison relies on
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(payload):
+    data = json.dumps(payload, cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError as exc:
+        raise InvalidCursor(cursor) from exc
+    if not isinstance(payload, dict):
+        raise InvalidCursor(cursor)
+    return payload
+
+
+class CursorPage(Sequence):
+    """
+    A page of results that knows its neighbours but not the total count
+    """
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f"<CursorPage of {len(self.object_list)} objects>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate a queryset by a unique, indexed ordering.
+
+    ``ordering`` must end with a unique column (normally ``-pk``) so that
+    the position of every row is well defined.
+    """
+
+    def __init__(self, queryset, per_page, ordering=DEFAULT_ORDERING):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = [
+            (field.lstrip("-"), field.startswith("-")) for field in ordering
+        ]
+
+    def _fields(self):
+        model = self.queryset.model
+        return [
+            model._meta.pk if name == "pk" else model._meta.get_field(name)
+            for name, _ in self.ordering
+        ]
+
+    def _nulls_largest(self):
+        # Keep the database's own NULL placement so the ordering still
+        # matches the indexes; the keyset condition follows it
+        return connections[self.queryset.db].features.nulls_order_largest
+
+    def _position(self, obj):
+        return [getattr(obj, name) for name, _ in self.ordering]
+
+    def encode_cursor(self, position, reverse):
+        return encode_cursor({"p": position, "r": reverse})
+
+    def decode_cursor(self, cursor):
+        payload = decode_cursor(cursor)
+        try:
+            raw, reverse = payload["p"], bool(payload["r"])
+            fields = self._fields()
+            if len(raw) != len(fields):
+                raise InvalidCursor(cursor)
+            position = [field.to_python(value) for field, value in zip(fields, raw)]
+            if any(
+                value is None and not field.null
+                for field, value in zip(fields, position)
+            ):
+                raise InvalidCursor(cursor)
+        except (ValueError, TypeError, KeyError, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+        return position, reverse
+
+    def _keyset_filter(self, position, reverse):
+        """
+        Build the lexicographic "strictly after ``position``" condition.
+
+        NULLs sort after every value when the database orders them as the
+        largest, before every value otherwise.
+        """
+        nulls_largest = self._nulls_largest()
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, (name, descending), value in zip(
+            self._fields(), self.ordering, position
+        ):
+            lookup = "lt" if descending != reverse else "gt"
+            towards_nulls = (lookup == "gt") == nulls_largest
+            if value is None:
+                # Only non-NULL rows are on the far side of a NULL
+                if not towards_nulls:
+                    condition |= equal & Q(**{f"{name}__isnull": False})
+                equal &= Q(**{f"{name}__isnull": True})
+                continue
+            after = Q(**{f"{name}__{lookup}": value})
+            if towards_nulls and field.null:
+                after |= Q(**{f"{name}__isnull": True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+        return condition
+
+    def _order_by(self, reverse):
+        return [
+            f"-{name}" if descending != reverse else name
+            for name, descending in self.ordering
+        ]
+
+    def _window(self, cursor):
+        position, reverse = (None, False) if not cursor else self.decode_cursor(cursor)
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if position is not None:
+            queryset = queryset.filter(self._keyset_filter(position, reverse))
+        return queryset[: self.per_page + 1], position, reverse
+
+    def page(self, cursor=None):
+        """
+        Return the page starting after ``cursor`` (the first page if None).
+
+        Raises ``InvalidCursor`` for malformed tokens.
+        """
+        queryset, position, reverse = self._window(cursor)
+        return self._make_page(list(queryset), position, reverse)
+
+    async def apage(self, cursor=None):
+        """
+        Async ``page()``, fetching the rows through the async ORM
+        """
+        queryset, position, reverse = self._window(cursor)
+        return self._make_page([row async for row in queryset], position, reverse)
+
+    def _make_page(self, rows, position, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = self.encode_cursor(self._position(rows[-1]), False)
+            if position is not None and (has_more or not reverse):
+                previous_cursor = self.encode_cursor(self._position(rows[0]), True)
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        """
+        Like ``page()`` but fall back to the first page for invalid cursors
+        """
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
+
+    async def aget_page(self, cursor=None):
+        try:
+            return await self.apage(cursor)
+        except InvalidCursor:
+            return await self.apage(None)
+
+
+class RankedPaginator:
+    """
+    Paginate results that come from ``fetch(limit, offset)`` in rank order.
+
+    ``fetch`` is asked for one row more than a page to detect whether a
+    next page exists, so no total count is ever computed.
+    """
+
+    def __init__(self, fetch, per_page):
+        self.fetch = fetch
+        self.per_page = int(per_page)
+
+    def decode_cursor(self, cursor):
+        payload = decode_cursor(cursor)
+        offset = payload.get("o")
+        if not isinstance(offset, int) or offset < 0:
+            raise InvalidCursor(cursor)
+        return offset
+
+    def page(self, cursor=None):
+        offset = self.decode_cursor(cursor) if cursor else 0
+        rows = list(self.fetch(self.per_page + 1, offset))
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+
+        next_cursor = previous_cursor = None
+        if has_more:
+            next_cursor = encode_cursor({"o": offset + self.per_page})
+        if offset:
+            previous_cursor = encode_cursor({"o": max(offset - self.per_page, 0)})
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
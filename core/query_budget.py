@@ -0,0 +1,193 @@
+"""
+Per-view SQL query budgets.
+
+URL modules declare the maximum number of queries each named route may run
+with ``declare_budgets()``. ``QueryBudgetMiddleware`` counts the queries of
+every request through a database execute wrapper (so it works with
+``DEBUG=False``) and, when a budget is exceeded, reports the repeated SQL
+fingerprints together with the template line that issued them.
+
+Counting only keeps the SQL strings. Fingerprints are computed for the
+report, and the stack is walked for template lines only with ``DEBUG`` or
+for the queries past the budget, so requests within budget pay next to
+nothing.
+
+``QUERY_BUDGET_MODE`` selects what happens on a violation: ``"log"`` (the
+default) emits a warning, ``"raise"`` raises ``QueryBudgetExceeded`` (used
+by the test suite), and ``"off"`` disables counting altogether.
+"""
+
+import logging
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+_budgets = {}
+
+# Sent after every counted request with the number of queries it ran
+request_queries = Signal()
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+PLACEHOLDER_LIST_RE = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def declare_budgets(namespace, budgets):
+    """
+    Register ``{url name: max queries}`` for the routes of ``namespace``
+    """
+    for name, limit in budgets.items():
+        _budgets[f"{namespace}:{name}" if namespace else name] = limit
+
+
+def get_budget(view_name):
+    return _budgets.get(view_name)
+
+
+def fingerprint(sql):
+    """
+    Reduce ``sql`` to its shape, so queries differing only in values match
+    """
+    sql = LITERAL_RE.sub("?", sql)
+    return PLACEHOLDER_LIST_RE.sub("(...)", sql)
+
+
+def _template_line():
+    # The innermost template node being rendered, if any
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            token = getattr(node, "token", None)
+            origin = getattr(node, "origin", None)
+            if token is not None and origin is not None:
+                return f"{origin.template_name or origin.name}:{token.lineno}"
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+    """
+    Execute wrapper recording queries, with the template line that issued
+    them for every query when ``trace`` is set and otherwise for those past
+    the budget of ``request``'s view
+    """
+
+    def __init__(self, request=None, trace=True):
+        self.queries = []
+        self.request = request
+        self.trace = trace
+        self._budget = None
+
+    def _tracing(self):
+        if self.trace:
+            return True
+        if self._budget is None:
+            # The URL is resolved after the session and user lookups
+            match = getattr(self.request, "resolver_match", None)
+            if match is None:
+                return False
+            self._budget = get_budget(match.view_name) or float("inf")
+        return len(self.queries) >= self._budget
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, _template_line() if self._tracing() else None))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def duplicates(self):
+        """
+        Return ``[(fingerprint, count, template lines)]`` for repeated queries
+        """
+        queries = [(fingerprint(sql), line) for sql, line in self.queries]
+        counts = Counter(sql for sql, _ in queries)
+        report = []
+        for sql, count in counts.most_common():
+            if count < 2:
+                break
+            lines = sorted({line for query, line in queries if query == sql and line})
+            report.append((sql, count, lines))
+        return report
+
+
+def format_violation(view_name, recorder, budget):
+    lines = [f"{view_name} ran {len(recorder)} queries (budget {budget})"]
+    for sql, count, templates in recorder.duplicates():
+        where = f" from {', '.join(templates)}" if templates else ""
+        lines.append(f"  {count}x {sql}{where}")
+    return "\n".join(lines)
+
+
+def wrap_connections(stack, wrapper):
+    """
+    Install ``wrapper`` on every connection of the current thread until
+    ``stack`` is closed
+    """
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = getattr(settings, "QUERY_BUDGET_MODE", "log")
+        if mode == "off":
+            return self.get_response(request)
+
+        recorder = QueryRecorder(request, trace=settings.DEBUG)
+        with ExitStack() as stack:
+            wrap_connections(stack, recorder)
+            response = self.get_response(request)
+        self.check(request, recorder, mode)
+        return response
+
+    async def __acall__(self, request):
+        mode = getattr(settings, "QUERY_BUDGET_MODE", "log")
+        if mode == "off":
+            return await self.get_response(request)
+
+        # Async ORM queries run on the request's sync thread, so the wrappers
+        # are installed on that thread's connections
+        recorder = QueryRecorder(request, trace=settings.DEBUG)
+        stack = ExitStack()
+        await sync_to_async(wrap_connections)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.check(request, recorder, mode)
+        return response
+
+    def check(self, request, recorder, mode):
+        request_queries.send(
+            sender=self.__class__, request=request, count=len(recorder)
+        )
+        match = request.resolver_match
+        budget = get_budget(match.view_name) if match else None
+        if budget is not None and len(recorder) > budget:
+            message = format_violation(match.view_name, recorder, budget)
+            if mode == "raise":
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
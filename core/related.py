@@ -0,0 +1,445 @@
+"""
+Related-posts engine.
+
+Two published posts are similar in proportion to the Jaccard overlap of
+their tags plus the cosine similarity of their TF-IDF content vectors. Both
+are kept as sparse rows with per-column postings, so a post is only scored
+against the posts sharing a term or a tag with it and memory grows with the
+number of non-zero entries, never with posts x vocabulary or posts x tags.
+The best ``RELATED_POSTS_COUNT`` matches of every post are stored in
+``RelatedPost``, so the detail page reads them with one indexed lookup.
+
+``rebuild_related_posts()`` reads every published post and saves the corpus
+to ``RELATED_POSTS_CORPUS_PATH``. ``update_related_posts()`` is incremental:
+it loads that file, re-reads only the posts changed since (tag changes bump
+``updated_at``, see ``touch_posts()``) and recomputes them and the posts
+whose stored lists they can affect. The vocabulary and IDF weights are those
+of the last full rebuild, so run ``--full`` now and then.
+"""
+
+import os
+import tempfile
+from array import array
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from .inverted_index import tokenize
+from .models import Post, RelatedPost
+from .page_cache import invalidate_tags
+
+TAG_WEIGHT = 0.4
+TEXT_WEIGHT = 0.6
+
+# Vocabulary size (most frequent terms) and ids per IN (...) lookup
+MAX_FEATURES = 4096
+CHUNK_SIZE = 500
+
+
+def get_count():
+    return getattr(settings, "RELATED_POSTS_COUNT", 3)
+
+
+def get_corpus_path():
+    return getattr(settings, "RELATED_POSTS_CORPUS_PATH", "related_corpus.npz")
+
+
+def touch_posts(post_ids):
+    """
+    Make the next ``update_related_posts()`` recompute ``post_ids``
+    """
+    Post.objects.filter(pk__in=post_ids).update(updated_at=timezone.now())
+
+
+def chunks(values):
+    values = list(values)
+    for start in range(0, len(values), CHUNK_SIZE):
+        yield values[start : start + CHUNK_SIZE]
+
+
+def tfidf_rows(documents, vocabulary, idf):
+    """
+    Return ``(post ids, row post ids, columns, values)`` of the L2-normalised
+    sublinear TF-IDF vectors of the ``(post id, content)`` ``documents``
+    """
+    ids, posts, columns, values = array("q"), array("q"), array("i"), array("f")
+    for pk, content in documents:
+        ids.append(pk)
+        counts = Counter(tokenize(content))
+        row = [
+            (vocabulary[term], n) for term, n in counts.items() if term in vocabulary
+        ]
+        if not row:
+            continue
+        row_columns, row_counts = np.array(row, dtype=np.int64).T
+        weights = np.log1p(row_counts) * idf[row_columns]
+        weights /= np.linalg.norm(weights)
+        posts.extend([pk] * len(row))
+        columns.extend(row_columns.tolist())
+        values.extend(weights.tolist())
+    return (
+        np.array(ids, dtype=np.int64),
+        np.array(posts, dtype=np.int64),
+        np.array(columns, dtype=np.int32),
+        np.array(values, dtype=np.float32),
+    )
+
+
+def tag_pairs(posts):
+    """
+    Return ``(post ids, tag ids)`` of the tags of ``posts`` (ids or a queryset)
+    """
+    pairs = Post.tags.through.objects.filter(post__in=posts).values_list(
+        "post_id", "tag_id"
+    )
+    post_ids, tag_ids = array("q"), array("q")
+    for post_id, tag_id in pairs.iterator():
+        post_ids.append(post_id)
+        tag_ids.append(tag_id)
+    return np.array(post_ids, dtype=np.int64), np.array(tag_ids, dtype=np.int64)
+
+
+class SparseRows:
+    """
+    Sparse matrix as CSR rows plus the postings of every column (the CSC
+    form), which is all a row-by-matrix product needs
+    """
+
+    def __init__(self, rows, columns, values, shape):
+        order = np.lexsort((columns, rows))
+        self.rows, self.columns = rows[order], columns[order]
+        self.values = values[order]
+        self.indptr = np.searchsorted(self.rows, np.arange(shape[0] + 1))
+        by_column = np.argsort(self.columns, kind="stable")
+        self.column_rows = self.rows[by_column]
+        self.column_values = self.values[by_column]
+        self.column_indptr = np.searchsorted(
+            self.columns[by_column], np.arange(shape[1] + 1)
+        )
+
+    def row(self, row):
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.columns[start:end], self.values[start:end]
+
+    def products(self, row):
+        """
+        Return ``(rows, partial products)`` of ``row`` with every row sharing
+        a column with it; the sum per row is the dot product
+        """
+        columns, values = self.row(row)
+        starts = self.column_indptr[columns]
+        lengths = self.column_indptr[columns + 1] - starts
+        # Positions of the postings of all ``columns``, one after the other
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions += np.arange(len(positions))
+        return (
+            self.column_rows[positions],
+            self.column_values[positions] * np.repeat(values, lengths),
+        )
+
+
+class Corpus:
+    """
+    Published posts as aligned sparse TF-IDF and tag-incidence rows
+    """
+
+    def __init__(self, ids, terms, idf, text, tags, computed_at):
+        self.ids = ids
+        self.terms = terms
+        self.idf = idf
+        # (post ids, columns, values) and (post ids, tag ids) entries
+        self.text_entries = text
+        self.tag_entries = tags
+        self.computed_at = computed_at
+        self._index()
+
+    @classmethod
+    def build(cls, computed_at):
+        posts = Post.objects.filter(is_published=True).order_by("pk")
+        document_frequency, n_documents = Counter(), 0
+        for content in posts.values_list("content", flat=True).iterator():
+            document_frequency.update(set(tokenize(content)))
+            n_documents += 1
+        terms = [term for term, _ in document_frequency.most_common(MAX_FEATURES)]
+        df = np.array([document_frequency[term] for term in terms], np.float32)
+        idf = np.log((1 + n_documents) / (1 + df)) + 1
+
+        ids, *text = tfidf_rows(
+            posts.values_list("pk", "content").iterator(),
+            {term: column for column, term in enumerate(terms)},
+            idf,
+        )
+        tag_posts, tag_ids = tag_pairs(posts)
+        # Posts published after the contents were read
+        known = np.isin(tag_posts, ids)
+        return cls(
+            ids,
+            terms,
+            idf,
+            tuple(text),
+            (tag_posts[known], tag_ids[known]),
+            computed_at,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return the corpus saved at ``path``, or ``None`` if there is none
+        """
+        try:
+            data = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        with data:
+            return cls(
+                data["ids"],
+                data["terms"].tolist(),
+                data["idf"],
+                (data["text_posts"], data["text_columns"], data["text_values"]),
+                (data["tag_posts"], data["tag_ids"]),
+                datetime.fromisoformat(str(data["computed_at"])),
+            )
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                np.savez(
+                    handle,
+                    ids=self.ids,
+                    terms=np.array(self.terms, dtype=str),
+                    idf=self.idf,
+                    text_posts=self.text_entries[0],
+                    text_columns=self.text_entries[1],
+                    text_values=self.text_entries[2],
+                    tag_posts=self.tag_entries[0],
+                    tag_ids=self.tag_entries[1],
+                    computed_at=np.array(self.computed_at.isoformat()),
+                )
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _index(self):
+        text_posts, text_columns, text_values = self.text_entries
+        self.text = SparseRows(
+            np.searchsorted(self.ids, text_posts),
+            text_columns,
+            text_values,
+            (len(self.ids), len(self.terms)),
+        )
+        tag_posts, tag_ids = self.tag_entries
+        tag_rows = np.searchsorted(self.ids, tag_posts)
+        tags, tag_columns = np.unique(tag_ids, return_inverse=True)
+        self.tags = SparseRows(
+            tag_rows,
+            tag_columns.astype(np.int32),
+            np.ones(len(tag_rows), dtype=np.float32),
+            (len(self.ids), len(tags)),
+        )
+        self.tag_sizes = np.bincount(tag_rows, minlength=len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, post_ids):
+        """
+        Rows of those of ``post_ids`` that are in the corpus
+        """
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, post_ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == post_ids[found]
+        return rows[found]
+
+    def update(self, post_ids, computed_at):
+        """
+        Re-read ``post_ids``, dropping those that are no longer published
+        """
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        vocabulary = {term: column for column, term in enumerate(self.terms)}
+        ids, text, tags = [], [], []
+        for chunk in chunks(post_ids.tolist()):
+            posts = Post.objects.filter(pk__in=chunk, is_published=True)
+            chunk_ids, *chunk_text = tfidf_rows(
+                posts.values_list("pk", "content").iterator(), vocabulary, self.idf
+            )
+            ids.append(chunk_ids)
+            text.append(chunk_text)
+            tags.append(tag_pairs(chunk_ids.tolist()))
+
+        kept = ~np.isin(self.text_entries[0], post_ids)
+        text.append([entries[kept] for entries in self.text_entries])
+        kept = ~np.isin(self.tag_entries[0], post_ids)
+        tags.append([entries[kept] for entries in self.tag_entries])
+        ids.append(self.ids[~np.isin(self.ids, post_ids)])
+
+        self.ids = np.sort(np.concatenate(ids))
+        self.text_entries = tuple(np.concatenate(column) for column in zip(*text))
+        self.tag_entries = tuple(np.concatenate(column) for column in zip(*tags))
+        self.computed_at = computed_at
+        self._index()
+
+    def similar(self, row):
+        """
+        Return ``(rows, scores)`` of the posts similar to the one at ``row``
+        """
+        text_rows, cosine_parts = self.text.products(row)
+        tag_rows, overlap_parts = self.tags.products(row)
+        others, inverse = np.unique(
+            np.concatenate([text_rows, tag_rows]), return_inverse=True
+        )
+        cosine = np.bincount(
+            inverse[: len(text_rows)], weights=cosine_parts, minlength=len(others)
+        )
+        overlap = np.bincount(
+            inverse[len(text_rows) :], weights=overlap_parts, minlength=len(others)
+        )
+        union = self.tag_sizes[row] + self.tag_sizes[others] - overlap
+        jaccard = np.divide(overlap, union, out=np.zeros(len(others)), where=union > 0)
+        scores = TAG_WEIGHT * jaccard + TEXT_WEIGHT * cosine
+        keep = (others != row) & (scores > 0)
+        return others[keep], scores[keep]
+
+    def top(self, rows, k):
+        """
+        Yield ``(post id, [(related id, score), ...])`` for ``rows``
+        """
+        k = min(k, len(self) - 1)
+        for row in rows:
+            if k <= 0:
+                yield int(self.ids[row]), []
+                continue
+            others, scores = self.similar(row)
+            if len(others) > k:
+                best = np.argpartition(-scores, k - 1)[:k]
+                others, scores = others[best], scores[best]
+            ranked = np.lexsort((others, -scores))
+            yield (
+                int(self.ids[row]),
+                [
+                    (int(self.ids[other]), float(score))
+                    for other, score in zip(others[ranked], scores[ranked])
+                ],
+            )
+
+
+def store(results, computed_at, post_ids):
+    """
+    Replace the stored lists of ``post_ids`` with ``results``
+    """
+    entries = [
+        RelatedPost(
+            post_id=post_id,
+            related_id=related_id,
+            rank=rank,
+            score=score,
+            computed_at=computed_at,
+        )
+        for post_id, matches in results
+        for rank, (related_id, score) in enumerate(matches)
+    ]
+    with transaction.atomic():
+        for chunk in chunks(post_ids):
+            RelatedPost.objects.filter(post_id__in=chunk).delete()
+        RelatedPost.objects.bulk_create(entries, batch_size=1000)
+    invalidate_tags(*(f"post:{pk}" for pk in post_ids))
+
+
+def rebuild_related_posts(k=None):
+    """
+    Recompute the related posts of every published post
+    """
+    computed_at = timezone.now()
+    corpus = Corpus.build(computed_at)
+    results = list(corpus.top(range(len(corpus)), k or get_count()))
+    stale = set(RelatedPost.objects.values_list("post_id", flat=True).distinct())
+    store(results, computed_at, stale | set(corpus.ids.tolist()))
+    corpus.save(get_corpus_path())
+    return len(results)
+
+
+def affected_rows(corpus, changed_rows, changed_ids, k):
+    """
+    Rows whose stored lists may change because of the ``changed`` posts
+    """
+    rows = set(changed_rows.tolist())
+    # Lists that currently point at a changed post
+    for chunk in chunks(changed_ids):
+        pointing = (
+            RelatedPost.objects.filter(related_id__in=chunk)
+            .values_list("post_id", flat=True)
+            .distinct()
+        )
+        rows.update(corpus.rows(list(pointing)).tolist())
+
+    # Lists a changed post would now enter: its score beats their worst entry
+    best = {}
+    for row in changed_rows:
+        for other, score in zip(*corpus.similar(row)):
+            if score > best.get(other, 0):
+                best[other] = score
+    full = min(k, len(corpus) - 1)
+    for chunk in chunks(best):
+        stored = (
+            RelatedPost.objects.filter(post_id__in=corpus.ids[chunk].tolist())
+            .values("post_id")
+            .annotate(size=Count("pk"), lowest=Min("score"))
+        )
+        thresholds = {
+            entry["post_id"]: entry["lowest"]
+            for entry in stored
+            if entry["size"] >= full
+        }
+        for other in chunk:
+            if best[other] > thresholds.get(int(corpus.ids[other]), 0):
+                rows.add(other)
+    return sorted(rows)
+
+
+def update_related_posts(k=None):
+    """
+    Recompute the posts changed since the last run and return how many
+    lists were rewritten
+    """
+    k = k or get_count()
+    path = get_corpus_path()
+    corpus = Corpus.load(path)
+    watermark = RelatedPost.objects.aggregate(last=Max("computed_at"))["last"]
+    # No saved corpus, or lists written by a run that did not save it
+    if watermark is None or corpus is None or watermark > corpus.computed_at:
+        return rebuild_related_posts(k)
+
+    computed_at = timezone.now()
+    changed_ids = set(
+        Post.objects.filter(updated_at__gte=corpus.computed_at).values_list(
+            "pk", flat=True
+        )
+    )
+    # Deleted posts never show up as changed, so look for them explicitly
+    removed = set()
+    for chunk in chunks(corpus.ids.tolist()):
+        kept = Post.objects.filter(pk__in=chunk, is_published=True)
+        removed.update(set(chunk) - set(kept.values_list("pk", flat=True)))
+    # Their entries went with them, so recompute every list they could be in
+    neighbours = set()
+    for row in corpus.rows(sorted(removed)):
+        neighbours.update(corpus.ids[corpus.similar(row)[0]].tolist())
+    changed_ids = sorted(changed_ids | removed)
+    if not changed_ids:
+        return 0
+    corpus.update(changed_ids, computed_at)
+    rows = affected_rows(corpus, corpus.rows(changed_ids), changed_ids, k)
+    rows = sorted(set(rows) | set(corpus.rows(sorted(neighbours)).tolist()))
+    results = list(corpus.top(rows, k))
+    # Unpublished posts lose their lists entirely
+    store(results, computed_at, {post_id for post_id, _ in results} | set(changed_ids))
+    corpus.save(path)
+    return len(results)
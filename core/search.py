@@ -0,0 +1,427 @@
+"""
+Pluggable post search backends.
+
+``get_search_backend()`` returns the backend named by ``settings.SEARCH_BACKEND``
+(a dotted path), or picks one for the database in use: SQLite FTS5, PostgreSQL
+``tsvector``/GIN, or a plain ``icontains`` scan for anything else. Every
+backend returns published posts ranked by relevance through
+``search(query, limit, offset)``.
+
+``InMemorySearchBackend`` needs no database support at all; it must be
+selected explicitly through ``SEARCH_BACKEND``.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .inverted_index import InvertedIndex
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "core_post_fts"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def hydrate(post_ids):
+    """
+    Load listing cards of the published posts in ``post_ids``, preserving order
+    """
+    posts = Post.objects.filter(pk__in=post_ids, is_published=True).cards(tags=False)
+    by_id = {post.pk: post for post in posts}
+    return [by_id[pk] for pk in post_ids if pk in by_id]
+
+
+class BaseSearchBackend:
+    """
+    Interface shared by all search backends
+    """
+
+    # Whether tag names are part of the index, so tag changes need re-indexing
+    indexes_tags = False
+
+    def search(self, query, limit, offset=0):
+        raise NotImplementedError
+
+    def index_post(self, post):
+        """
+        Bring the index entry for ``post`` up to date
+        """
+
+    def remove_post(self, post_id):
+        """
+        Drop ``post_id`` from the index
+        """
+
+    def rebuild(self):
+        """
+        Re-index every post and return the number indexed
+        """
+        return 0
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Portable fallback: substring match on title, excerpt and content
+    """
+
+    def search(self, query, limit, offset=0):
+        return list(
+            Post.objects.filter(
+                Q(title__icontains=query)
+                | Q(content__icontains=query)
+                | Q(excerpt__icontains=query),
+                is_published=True,
+            )
+            .order_by("-published_at", "-pk")
+            .cards(tags=False)[offset : offset + limit]
+        )
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 index over published posts, ranked with BM25.
+
+    Title matches weigh more than excerpt matches, which weigh more than
+    body matches.
+    """
+
+    weights = (10.0, 4.0, 1.0)
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every token so user input cannot use FTS5 query syntax
+        tokens = TOKEN_RE.findall(query)
+        return " ".join('"{}"'.format(token.replace('"', '""')) for token in tokens)
+
+    def search(self, query, limit, offset=0):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, %s, %s, %s), rowid DESC "
+                "LIMIT %s OFFSET %s",
+                [expression, *self.weights, limit, offset],
+            )
+            post_ids = [row[0] for row in cursor.fetchall()]
+        return hydrate(post_ids)
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [post.pk])
+            if post.is_published:
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE} (rowid, title, excerpt, content) "
+                    "VALUES (%s, %s, %s, %s)",
+                    [post.pk, post.title, post.excerpt, post.content],
+                )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [post_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, excerpt, content) "
+                "SELECT id, title, excerpt, content FROM core_post "
+                "WHERE is_published"
+            )
+            return cursor.rowcount
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    PostgreSQL full-text search on the generated ``search_vector`` column.
+
+    The column is maintained by the database itself and backed by a GIN
+    index, so saving a post needs no extra work.
+    """
+
+    config = "english"
+
+    def search(self, query, limit, offset=0):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM core_post, websearch_to_tsquery(%s, %s) query "
+                "WHERE is_published AND search_vector @@ query "
+                "ORDER BY ts_rank(search_vector, query) DESC, id DESC "
+                "LIMIT %s OFFSET %s",
+                [self.config, query, limit, offset],
+            )
+            post_ids = [row[0] for row in cursor.fetchall()]
+        return hydrate(post_ids)
+
+
+def post_fields(post):
+    return {
+        "title": post.title,
+        "excerpt": post.excerpt,
+        "content": post.content,
+        "tags": " ".join(tag.name for tag in post.tags.all()),
+    }
+
+
+CHANGES_EPOCH_KEY = "search:changes:epoch"
+CHANGES_SEQ_KEY = "search:changes:seq"
+# Entries older than this are assumed replayed by every worker
+CHANGE_LOG_TIMEOUT = 24 * 3600
+
+
+def _change_key(number):
+    return f"search:change:{number}"
+
+
+def record_change(post_id):
+    """
+    Append ``post_id`` to the change log that InMemorySearchBackend
+    instances in other processes replay
+    """
+    cache = caches["default"]
+    cache.add(CHANGES_EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+    if cache.add(CHANGES_SEQ_KEY, 1, timeout=None):
+        number = 1
+    else:
+        number = cache.incr(CHANGES_SEQ_KEY)
+    cache.set(_change_key(number), post_id, timeout=CHANGE_LOG_TIMEOUT)
+
+
+def current_changes():
+    """
+    ``(epoch, sequence number)`` of the latest change in the log
+    """
+    cache = caches["default"]
+    values = cache.get_many([CHANGES_EPOCH_KEY, CHANGES_SEQ_KEY])
+    return values.get(CHANGES_EPOCH_KEY), values.get(CHANGES_SEQ_KEY, 0)
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """
+    Pure-Python BM25 index over title, excerpt, content and tag names.
+
+    The index is loaded from the snapshot at ``SEARCH_INDEX_PATH``. A newer
+    snapshot written by ``rebuild_search_index`` in any process is picked up
+    within ``SEARCH_INDEX_RELOAD_INTERVAL`` seconds. Requests never build the
+    index: until the command has written the first snapshot, searches are
+    answered with a database scan.
+
+    Post signals update the index of the process that saved the post and,
+    once the transaction commits, append the post id to a change log in the
+    default cache. Before every search each process replays the entries it
+    has not seen yet, re-reading those posts from the database, so all
+    workers agree as soon as the cache is shared between them. With a
+    per-process cache (or after the cache is flushed) other processes only
+    see the changes with the next snapshot.
+    """
+
+    indexes_tags = True
+
+    def __init__(self, path=None):
+        self.path = str(
+            path or getattr(settings, "SEARCH_INDEX_PATH", "search_index.bin")
+        )
+        self.reload_interval = getattr(settings, "SEARCH_INDEX_RELOAD_INTERVAL", 30)
+        self._index = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._warned = False
+        # Position in the change log the index reflects
+        self._changes = (None, 0)
+
+    def _snapshot_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _load(self):
+        self._index = InvertedIndex.load(self.path)
+        epoch, seq = self._index.snapshot.meta.get("changes", (None, 0))
+        self._changes = (epoch, seq)
+        self._checked_at = time.monotonic()
+
+    def warm(self):
+        """
+        Map the snapshot if one exists, without touching the database
+        """
+        with self._lock:
+            if self._index is None and self._snapshot_mtime() is not None:
+                self._load()
+
+    def get_index(self):
+        """
+        The current index, or None until ``rebuild_search_index`` has written
+        the first snapshot
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._index is None or now - self._checked_at >= self.reload_interval:
+                self._checked_at = now
+                mtime = self._snapshot_mtime()
+                if mtime is not None:
+                    snapshot = self._index.snapshot if self._index else None
+                    if snapshot is None or snapshot.mtime != mtime:
+                        self._load()
+            index = self._index
+            if index is None:
+                if not self._warned:
+                    logger.warning(
+                        "No search index at %s; run rebuild_search_index",
+                        self.path,
+                    )
+                    self._warned = True
+                return None
+        self._catch_up()
+        return self._index
+
+    def _catch_up(self):
+        epoch, seq = current_changes()
+        with self._lock:
+            seen_epoch, seen = self._changes
+            if (epoch, seq) == (seen_epoch, seen) or epoch is None:
+                return
+            if epoch != seen_epoch:
+                if seen_epoch is not None:
+                    logger.warning(
+                        "Search change log was lost; run rebuild_search_index"
+                    )
+                seen = 0
+            if seq <= seen:
+                return
+            keys = [_change_key(number) for number in range(seen + 1, seq + 1)]
+            entries = caches["default"].get_many(keys)
+            if len(entries) < len(keys):
+                logger.warning(
+                    "%d search index changes expired before they were replayed",
+                    len(keys) - len(entries),
+                )
+            post_ids = set(entries.values())
+            posts = {
+                post.pk: post
+                for post in Post.objects.filter(
+                    pk__in=post_ids, is_published=True
+                ).prefetch_related("tags")
+            }
+            for post_id in post_ids:
+                if post_id in posts:
+                    self._index.add(post_id, post_fields(posts[post_id]))
+                else:
+                    self._index.remove(post_id)
+            self._changes = (epoch, seq)
+
+    def build(self):
+        index = InvertedIndex()
+        posts = Post.objects.filter(is_published=True).prefetch_related("tags")
+        for post in posts.iterator(chunk_size=2000):
+            index.add(post.pk, post_fields(post))
+        return index
+
+    def search(self, query, limit, offset=0):
+        index = self.get_index()
+        if index is None:
+            return DatabaseSearchBackend().search(query, limit, offset)
+        return hydrate(index.search(query, limit, offset))
+
+    def index_post(self, post):
+        transaction.on_commit(partial(record_change, post.pk))
+        index = self._index
+        if index is None:
+            return
+        if post.is_published:
+            index.add(post.pk, post_fields(post))
+        else:
+            index.remove(post.pk)
+
+    def remove_post(self, post_id):
+        transaction.on_commit(partial(record_change, post_id))
+        if self._index is not None:
+            self._index.remove(post_id)
+
+    def rebuild(self):
+        # Changes logged from here on may be missing from the build, so
+        # they are replayed on top of the snapshot
+        changes = current_changes()
+        index = self.build()
+        indexed = index.save(self.path, meta={"changes": changes})
+        with self._lock:
+            self._load()
+        return indexed
+
+
+def fts_available(using_connection=None):
+    """
+    Return whether the FTS5 index table exists on an SQLite connection
+    """
+    using_connection = using_connection or connection
+    if using_connection.vendor != "sqlite":
+        return False
+    with using_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [FTS_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == "postgresql":
+            _backend = PostgresSearchBackend()
+        elif fts_available():
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = DatabaseSearchBackend()
+    return _backend
+
+
+def warm_search_backend():
+    """
+    Load an explicitly configured in-process index before workers fork
+    """
+    if getattr(settings, "SEARCH_BACKEND", None):
+        backend = get_search_backend()
+        if hasattr(backend, "warm"):
+            backend.warm()
+
+
+def reset_search_backend():
+    global _backend
+    _backend = None
+
+
+def sync_post(post):
+    try:
+        with transaction.atomic():
+            get_search_backend().index_post(post)
+    except DatabaseError:
+        logger.exception("Failed to index post %s", post.pk)
+
+
+def unsync_post(post_id):
+    try:
+        with transaction.atomic():
+            get_search_backend().remove_post(post_id)
+    except DatabaseError:
+        logger.exception("Failed to remove post %s from the search index", post_id)
@@ -0,0 +1,248 @@
+"""
+Per-request performance instrumentation.
+
+``ServerTimingMiddleware`` measures, for every request, the time spent in
+SQL queries (and how many ran), rendering templates, and reading the cache
+(with hits and misses), plus the total time spent below the middleware. The
+figures are sent in a ``Server-Timing`` header, which browser devtools show
+next to the request, and logged as one ``key=value`` line tagged with the
+resolved URL name (also attached to the record as ``server_timing`` for
+structured log handlers).
+
+Queries are timed through a database execute wrapper. Django has no hooks
+for template rendering or cache reads, so the template backend's ``render``
+and the configured cache backends' ``get``/``get_many`` are wrapped once;
+the wrappers only record while a request is being measured. Queries run
+lazily from templates count towards both ``db`` and ``tpl``.
+
+``SERVER_TIMING_HEADER`` controls the header (it reveals timings to
+clients, so it defaults to ``DEBUG``); the log line is always emitted on
+the ``core.server_timing`` logger at INFO level.
+"""
+
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .query_budget import wrap_connections
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("server_timing", default=None)
+
+_MISSING = object()
+
+
+class RequestTimings:
+    """
+    Durations (seconds) and counters of one request
+    """
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.template = 0.0
+        self.cache = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total = 0.0
+        # Set while inside a measured call, so nested calls are not counted
+        self._rendering = False
+        self._in_cache = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+    @contextmanager
+    def rendering(self):
+        self._rendering = True
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.template += time.perf_counter() - started
+            self._rendering = False
+
+    @contextmanager
+    def reading_cache(self):
+        self._in_cache = True
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.cache += time.perf_counter() - started
+            self._in_cache = False
+
+    def header(self):
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+                f"tpl;dur={self.template * 1000:.1f}",
+                f'cache;dur={self.cache * 1000:.1f};desc="{self.cache_hits} hits / '
+                f'{self.cache_misses} misses"',
+                f"total;dur={self.total * 1000:.1f}",
+            ]
+        )
+
+    def as_dict(self):
+        return {
+            "total_ms": round(self.total * 1000, 2),
+            "db_ms": round(self.db * 1000, 2),
+            "queries": self.queries,
+            "template_ms": round(self.template * 1000, 2),
+            "cache_ms": round(self.cache * 1000, 2),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+def current_timings():
+    """
+    Return the ``RequestTimings`` of the request being measured, if any
+    """
+    return _current.get()
+
+
+def _wrap_render(render):
+    @wraps(render)
+    def wrapper(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None or timings._rendering:
+            return render(self, context, request)
+        with timings.rendering():
+            return render(self, context, request)
+
+    wrapper._server_timing = True
+    return wrapper
+
+
+def _wrap_cache_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        timings = _current.get()
+        if timings is None or timings._in_cache:
+            return get(self, key, default, version)
+        with timings.reading_cache():
+            value = get(self, key, _MISSING, version)
+        if value is _MISSING:
+            timings.cache_misses += 1
+            return default
+        timings.cache_hits += 1
+        return value
+
+    wrapper._server_timing = True
+    return wrapper
+
+
+def _wrap_cache_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, version=None):
+        timings = _current.get()
+        if timings is None or timings._in_cache:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        with timings.reading_cache():
+            values = get_many(self, keys, version)
+        timings.cache_hits += len(values)
+        timings.cache_misses += len(keys) - len(values)
+        return values
+
+    wrapper._server_timing = True
+    return wrapper
+
+
+def _patch(cls, name, wrap):
+    method = getattr(cls, name)
+    if not getattr(method, "_server_timing", False):
+        setattr(cls, name, wrap(method))
+
+
+def instrument():
+    """
+    Wrap template rendering and the configured cache backends (once)
+    """
+    from django.template.backends.django import Template
+
+    _patch(Template, "render", _wrap_render)
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        _patch(backend, "get", _wrap_cache_get)
+        _patch(backend, "get_many", _wrap_cache_get_many)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        instrument()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                wrap_connections(stack, timings)
+                response = self.get_response(request)
+        finally:
+            timings.total = time.perf_counter() - started
+            _current.reset(token)
+        return self.report(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        # Async ORM queries run on the request's sync thread
+        stack = ExitStack()
+        await sync_to_async(wrap_connections)(stack, timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            timings.total = time.perf_counter() - started
+            _current.reset(token)
+        return self.report(request, response, timings)
+
+    def report(self, request, response, timings):
+        if getattr(settings, "SERVER_TIMING_HEADER", settings.DEBUG):
+            existing = response.get("Server-Timing")
+            header = timings.header()
+            response["Server-Timing"] = f"{existing}, {header}" if existing else header
+
+        match = request.resolver_match
+        view_name = match.view_name if match else "-"
+        fields = timings.as_dict()
+        logger.info(
+            "view=%s method=%s status=%s %s",
+            view_name,
+            request.method,
+            response.status_code,
+            " ".join(f"{name}={value}" for name, value in fields.items()),
+            extra={
+                "server_timing": dict(
+                    fields,
+                    view=view_name,
+                    method=request.method,
+                    status=response.status_code,
+                )
+            },
+        )
+        return response
@@ -0,0 +1,41 @@
+"""
+Expired-session sweeping.
+
+Sessions use Django's ``cached_db`` engine (``SESSION_ENGINE``): reads are
+served from the cache and fall back to ``django_session``. Expired rows are
+removed by ``sweep_expired()`` (``manage.py sweep_sessions``) in short
+batches rather than the single table-wide DELETE of ``clearsessions``.
+"""
+
+import logging
+import time
+
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_expired(batch_size=1000, pause=0.0):
+    """
+    Delete expired session rows ``batch_size`` at a time, sleeping ``pause``
+    seconds between batches, and return how many were deleted. Cached
+    copies expire on their own.
+    """
+    deleted = 0
+    while True:
+        keys = list(
+            Session.objects.filter(expire_date__lt=timezone.now())
+            .order_by("expire_date")
+            .values_list("session_key", flat=True)[:batch_size]
+        )
+        if not keys:
+            break
+        deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+        if len(keys) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    if deleted:
+        logger.info("Deleted %d expired sessions", deleted)
+    return deleted
@@ -0,0 +1,271 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .counters import adjust_post_counts, rebuild_comment_stats, record_approved_comment
+from .images import schedule_derivatives
+from .models import Category, Comment, Post, Profile, Tag
+from .page_cache import invalidate_tags
+from .related import touch_posts
+from .search import get_search_backend, sync_post, unsync_post
+
+# One profile per user
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, raw, **kwargs):  # noqa: ARG001
+    # Inside the caller's transaction, so the pair is committed together
+    if created and not raw:
+        Profile.objects.create(user=instance)
+
+
+# Page cache invalidation
+
+AUTHOR_FIELDS = {"username", "first_name", "last_name"}
+
+
+def _post_tags(post):
+    tags = {"posts", f"post:{post.pk}"}
+    for category_id in (post.category_id, post.get_loaded_value("category_id")):
+        if category_id:
+            tags.add(f"category:{category_id}")
+    return tags
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):  # noqa: ARG001
+    invalidate_tags(*_post_tags(instance))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_post_tag_pages(
+    sender,  # noqa: ARG001
+    instance,
+    action,
+    reverse,
+    pk_set,
+    **kwargs,  # noqa: ARG001
+):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        # tag.posts.add(...) and friends: instance is the Tag
+        tags = {"posts", f"tag:{instance.pk}"}
+        tags.update(f"post:{pk}" for pk in pk_set or ())
+        invalidate_tags(*tags)
+    else:
+        invalidate_tags(*_post_tags(instance))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):  # noqa: ARG001
+    invalidate_tags(f"post:{instance.post_id}", "comments")
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_pages(sender, instance, **kwargs):  # noqa: ARG001
+    invalidate_tags("categories", "posts", f"category:{instance.pk}")
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_pages(sender, instance, **kwargs):  # noqa: ARG001
+    invalidate_tags("posts", "tags", f"tag:{instance.pk}")
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_author_pages(sender, instance, **kwargs):  # noqa: ARG001
+    invalidate_tags(f"user:{instance.user_id}")
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_pages(
+    sender,  # noqa: ARG001
+    instance,
+    created,
+    update_fields,
+    **kwargs,  # noqa: ARG001
+):
+    # Pages show the author's username and full name, not what logins update
+    if created or (update_fields and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    invalidate_tags(f"user:{instance.pk}")
+
+
+# Materialized published-post counts on Category and Tag
+
+
+@receiver(post_save, sender=Post)
+def update_post_counts(sender, instance, created, **kwargs):  # noqa: ARG001
+    if created:
+        was_published, old_category_id = False, None
+    else:
+        was_published = instance.get_loaded_value("is_published", instance.is_published)
+        old_category_id = instance.get_loaded_value("category_id", instance.category_id)
+
+    if (was_published, old_category_id) != (
+        instance.is_published,
+        instance.category_id,
+    ):
+        if was_published:
+            adjust_post_counts(-1, category_ids=[old_category_id])
+        if instance.is_published:
+            adjust_post_counts(1, category_ids=[instance.category_id])
+
+    if not created and was_published != instance.is_published:
+        tag_ids = instance.tags.values_list("pk", flat=True)
+        adjust_post_counts(1 if instance.is_published else -1, tag_ids=tag_ids)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_tags(sender, instance, **kwargs):  # noqa: ARG001
+    # The through rows are gone by post_delete, so collect the tags now
+    if instance.is_published:
+        instance._counted_tag_ids = list(instance.tags.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def release_post_counts(sender, instance, **kwargs):  # noqa: ARG001
+    if instance.is_published:
+        adjust_post_counts(
+            -1,
+            category_ids=[instance.category_id],
+            tag_ids=getattr(instance, "_counted_tag_ids", ()),
+        )
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_tag_post_counts(
+    sender,  # noqa: ARG001
+    instance,
+    action,
+    reverse,
+    pk_set,
+    **kwargs,  # noqa: ARG001
+):
+    if reverse:
+        # instance is a Tag and pk_set holds post ids
+        if action in ("post_add", "post_remove"):
+            published = Post.objects.filter(pk__in=pk_set, is_published=True).count()
+            if published:
+                delta = published if action == "post_add" else -published
+                adjust_post_counts(delta, tag_ids=[instance.pk])
+        elif action == "post_clear":
+            Tag.objects.filter(pk=instance.pk).update(post_count=0)
+        return
+
+    if not instance.is_published:
+        return
+    if action == "post_add":
+        adjust_post_counts(1, tag_ids=pk_set)
+    elif action == "post_remove":
+        adjust_post_counts(-1, tag_ids=pk_set)
+    elif action == "pre_clear":
+        instance._counted_tag_ids = list(instance.tags.values_list("pk", flat=True))
+    elif action == "post_clear":
+        adjust_post_counts(-1, tag_ids=getattr(instance, "_counted_tag_ids", ()))
+
+
+# Approved-comment stats on Post
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_stats(sender, instance, created, **kwargs):  # noqa: ARG001
+    was_approved = (
+        False
+        if created
+        else instance.get_loaded_value("is_approved", instance.is_approved)
+    )
+    if was_approved == instance.is_approved:
+        return
+    if instance.is_approved:
+        record_approved_comment(instance.post_id, instance.created_at)
+    else:
+        rebuild_comment_stats([instance.post_id])
+
+
+@receiver(post_delete, sender=Comment)
+def release_comment_stats(sender, instance, **kwargs):  # noqa: ARG001
+    if instance.is_approved:
+        rebuild_comment_stats([instance.post_id])
+
+
+# Search index
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):  # noqa: ARG001
+    sync_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):  # noqa: ARG001
+    unsync_post(instance.pk)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def reindex_post_tags(
+    sender,  # noqa: ARG001
+    instance,
+    action,
+    reverse,
+    pk_set,
+    **kwargs,  # noqa: ARG001
+):
+    if not action.startswith("post_") or not get_search_backend().indexes_tags:
+        return
+    if not reverse:
+        sync_post(instance)
+    elif pk_set:
+        for post in Post.objects.filter(pk__in=pk_set).prefetch_related("tags"):
+            sync_post(post)
+
+
+@receiver(post_save, sender=Tag)
+def reindex_tagged_posts(sender, instance, created, **kwargs):  # noqa: ARG001
+    if created or not get_search_backend().indexes_tags:
+        return
+    for post in instance.posts.prefetch_related("tags"):
+        sync_post(post)
+
+
+# Related posts: tag changes do not save the post, so bump its updated_at for
+# update_related_posts
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_retagged_posts(
+    sender,  # noqa: ARG001
+    instance,
+    action,
+    reverse,
+    pk_set,
+    **kwargs,  # noqa: ARG001
+):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            touch_posts([instance.pk])
+    elif action == "pre_clear":
+        instance._retagged_post_ids = list(instance.posts.values_list("pk", flat=True))
+    elif action == "post_clear":
+        touch_posts(getattr(instance, "_retagged_post_ids", ()))
+    elif action in ("post_add", "post_remove") and pk_set:
+        touch_posts(pk_set)
+
+
+@receiver(pre_delete, sender=Tag)
+def touch_untagged_posts(sender, instance, **kwargs):  # noqa: ARG001
+    touch_posts(list(instance.posts.values_list("pk", flat=True)))
+
+
+# Featured image derivatives
+
+
+@receiver(post_save, sender=Post)
+def process_featured_image(sender, instance, **kwargs):  # noqa: ARG001
+    image = instance.featured_image
+    if image and image.name != (instance.image_derivatives or {}).get("source"):
+        schedule_derivatives(instance)
@@ -0,0 +1,225 @@
+"""
+Content-addressed media storage.
+
+``ContentAddressedStorage`` names every upload after the SHA-256 of its
+bytes, keeping the ``upload_to`` directory and the extension
+(``posts/3f/3f2a...c1.jpg``). Uploading identical bytes again reuses the
+existing file instead of writing a copy, and since a name can never point
+at different content, media URLs may be cached forever: ``serve`` adds
+year-long ``immutable`` caching headers to content-addressed files.
+
+Because files are shared between rows, they are never deleted along with
+a row; ``collect_garbage()`` (``manage.py collect_media_garbage``) removes
+the blobs no row references any more. A blob reused by an upload has its
+modification time refreshed, so the grace period also protects files that
+are about to be referenced again.
+
+Static files get the same guarantee from
+``CompressedManifestStaticFilesStorage``, which fingerprints them at
+``collectstatic`` time and writes precompressed copies (see core.assets).
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import posixpath
+import re
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import FileField
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views import static
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+HASHED_NAME_RE = re.compile(r"(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.\w+)?$")
+
+# A year, the longest lifetime caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def is_content_addressed(name):
+    return HASHED_NAME_RE.search(name) is not None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming files by the hash of their content
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = posixpath.split(name.replace("\\", "/"))
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Deduplicated: keep the GC from collecting it before the row
+            # referencing it is committed
+            os.utime(self.path(name))
+            return name
+        content.seek(0)
+        return super().save(name, content, max_length)
+
+
+def content_addressed_fields():
+    """
+    Yield the ``(model, field)`` pairs stored in a ContentAddressedStorage
+    """
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, FileField) and isinstance(
+                field.storage, ContentAddressedStorage
+            ):
+                yield model, field
+
+
+def referenced_names(batch_size=2000):
+    """
+    Return the names of every stored file some row still refers to
+    """
+    from .models import Post
+
+    names = set()
+    for model, field in content_addressed_fields():
+        rows = (
+            model._default_manager.exclude(**{field.attname: ""})
+            .exclude(**{f"{field.attname}__isnull": True})
+            .values_list(field.attname, flat=True)
+        )
+        names.update(rows.iterator(chunk_size=batch_size))
+
+    # Image derivatives are referenced by URL
+    storage = Post._meta.get_field("featured_image").storage
+    base_url = storage.base_url
+    rows = Post.objects.exclude(image_derivatives={}).values_list(
+        "image_derivatives", flat=True
+    )
+    for derivatives in rows.iterator(chunk_size=batch_size):
+        for entries in derivatives.values():
+            if isinstance(entries, list):
+                names.update(
+                    url[len(base_url) :]
+                    for _, url in entries
+                    if url.startswith(base_url)
+                )
+    return names
+
+
+def walk(storage, directory=""):
+    """
+    Yield the names of all files below ``directory`` of ``storage``
+    """
+    directories, files = storage.listdir(directory)
+    for filename in files:
+        yield posixpath.join(directory, filename)
+    for subdirectory in directories:
+        yield from walk(storage, posixpath.join(directory, subdirectory))
+
+
+def collect_garbage(storage=None, grace=timedelta(days=1), dry_run=False):
+    """
+    Delete content-addressed files of ``storage`` that no row references
+    and that were not written or reused within ``grace``; return the
+    deleted (or, with ``dry_run``, deletable) names
+    """
+    storage = storage or default_storage
+    if not storage.exists(""):
+        return []
+    cutoff = timezone.now() - grace
+    referenced = referenced_names()
+    garbage = []
+    for name in walk(storage):
+        if not is_content_addressed(name) or name in referenced:
+            continue
+        if storage.get_modified_time(name) > cutoff:
+            continue
+        garbage.append(name)
+        if not dry_run:
+            storage.delete(name)
+    if garbage and not dry_run:
+        logger.info("Deleted %d unreferenced media files", len(garbage))
+    return garbage
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """
+    ``django.views.static.serve`` that lets clients cache content-addressed
+    files for a year without revalidating
+    """
+    response = static.serve(request, path, document_root, show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    return response
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes gzip and (with the ``brotli``
+    package) Brotli copies of the fingerprinted text assets, so they can be
+    served precompressed
+    """
+
+    compressible_extensions = (".css", ".js", ".svg", ".json", ".txt", ".xml", ".map")
+    # Smaller files are not worth a compressed variant
+    min_compress_size = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(
+            paths, dry_run, **options
+        ):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            for variant in self.compress(hashed_name):
+                yield hashed_name, variant, True
+
+    def compress(self, name):
+        """
+        Write the compressed variants of ``name`` that are smaller than it
+        and return their names
+        """
+        if not name.endswith(self.compressible_extensions):
+            return []
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < self.min_compress_size:
+            return []
+        variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(data, quality=11)))
+        written = []
+        for suffix, compressed in variants:
+            if len(compressed) >= len(data):
+                continue
+            path = self.path(name + suffix)
+            with open(path, "wb") as target:
+                target.write(compressed)
+            written.append(name + suffix)
+        return written
@@ -0,0 +1,13 @@
+from django import template
+
+from core.assets import asset_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset(path):
+    """
+    URL of a vendored static asset (see core.assets)
+    """
+    return asset_url(path)
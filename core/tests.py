@@ -1,11 +1,88 @@
+import base64
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
 import pytest
-from django.contrib.auth.models import User
-from django.test import Client, TestCase
-from django.urls import reverse
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.template import engines
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 from django.utils import timezone
-
+from PIL import Image
+
+from . import views
+from .assets import (
+    PACKAGES,
+    AssetError,
+    _is_vendored,
+    check_vendored_assets,
+    class_filter,
+    serve_static,
+    tree_shake_css,
+    vendor_assets,
+    verify_integrity,
+)
+from .benchmark import (
+    build_scenarios,
+    compare,
+    reload_urls,
+    route_names,
+    run_auth_benchmark,
+    run_benchmark,
+)
+from .comment_queue import claim, drain, publish, purge
+from .counters import CacheViewBuffer, LocalViewBuffer, ViewCounter, view_counter
+from .dataset import generate_dataset
 from .forms import CommentForm, ProfileForm
-from .models import Category, Comment, Post, Profile, Tag
+from .images import generate_missing_derivatives
+from .inverted_index import InvertedIndex, Snapshot
+from .markdown import RENDERER_VERSION, render_markdown, render_posts
+from .models import (
+    Category,
+    Comment,
+    PendingComment,
+    Post,
+    Profile,
+    RelatedPost,
+    Tag,
+    build_comment_tree,
+)
+from .page_cache import cache_anonymous_page, invalidate_tags
+from .pagination import CursorPaginator, InvalidCursor, encode_cursor
+from .query_budget import QueryBudgetExceeded, QueryRecorder, fingerprint
+from .related import rebuild_related_posts, update_related_posts
+from .search import (
+    DatabaseSearchBackend,
+    InMemorySearchBackend,
+    SQLiteFTSBackend,
+    get_search_backend,
+    reset_search_backend,
+)
+from .sessions import sweep_expired
+from .storage import ContentAddressedStorage, brotli, collect_garbage
+from .storage import serve as serve_media
+from .user_import import hash_passwords, import_users, insert_accounts
 
 
 class TestModels(TestCase):
@@ -19,9 +96,9 @@ class TestModels(TestCase):
         self.tag = Tag.objects.create(name="Test Tag", slug="test-tag")
 
     def test_profile_creation(self):
-        profile = Profile.objects.create(
-            user=self.user, bio="Test bio", location="Test City"
-        )
+        profile = self.user.profile
+        profile.bio, profile.location = "Test bio", "Test City"
+        profile.save()
         self.assertEqual(str(profile), f"{self.user.username}'s Profile")
         self.assertEqual(profile.bio, "Test bio")
         self.assertEqual(profile.location, "Test City")
@@ -107,7 +184,8 @@ class TestViews(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Test Post")
 
-        # Check that view count was incremented
+        # Check that view count was incremented once buffered views are flushed
+        view_counter.flush()
         self.post.refresh_from_db()
         self.assertEqual(self.post.views_count, initial_views + 1)
 
@@ -148,6 +226,2264 @@ class TestViews(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.category = Category.objects.create(name="Tech", slug="tech")
+        self.post = Post.objects.create(
+            title="Async post",
+            slug="async-post",
+            author=self.user,
+            category=self.category,
+            content="Content",
+            is_published=True,
+        )
+        Comment.objects.create(post=self.post, author=self.user, content="Hello")
+        # Cleanups run last in, first out: reload after restoring the setting
+        self.addCleanup(reload_urls)
+        async_views = override_settings(ASYNC_VIEWS=True)
+        async_views.enable()
+        self.addCleanup(async_views.disable)
+        reload_urls()
+
+    def test_read_views_are_async(self):
+        for route in ("home", "post_list", "post_detail", "category_detail"):
+            match = resolve(reverse(f"core:{route}", kwargs=self.kwargs(route)))
+            self.assertTrue(iscoroutinefunction(match.func), route)
+
+    def test_wsgi_gets_sync_views(self):
+        with override_settings(ASYNC_VIEWS=False):
+            reload_urls()
+            for route in ("home", "post_list", "post_detail", "category_detail"):
+                url = reverse(f"core:{route}", kwargs=self.kwargs(route))
+                self.assertFalse(iscoroutinefunction(resolve(url).func), route)
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def kwargs(self, route):
+        return {
+            "post_detail": {"slug": "async-post"},
+            "category_detail": {"slug": "tech"},
+        }.get(route)
+
+    async def test_views_under_async_client(self):
+        for route, text in (
+            ("home", "Async post"),
+            ("post_list", "Async post"),
+            ("post_detail", "Hello"),
+            ("category_detail", "Async post"),
+        ):
+            url = reverse(f"core:{route}", kwargs=self.kwargs(route))
+            response = await self.async_client.get(url)
+            self.assertContains(response, text)
+            # Served from the page cache the second time
+            cached = await self.async_client.get(url)
+            self.assertEqual(cached.content, response.content)
+
+    async def test_missing_objects_return_404(self):
+        for route in ("post_detail", "category_detail"):
+            url = reverse(f"core:{route}", kwargs={"slug": "missing"})
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 404)
+
+    async def test_async_paginator_matches_sync(self):
+        for i in range(4):
+            await Post.objects.acreate(
+                title=f"Post {i}",
+                slug=f"post-{i}",
+                author=self.user,
+                content="Content",
+                is_published=True,
+            )
+        paginator = CursorPaginator(Post.objects.filter(is_published=True), 2)
+        first = await paginator.aget_page()
+        second = await paginator.aget_page(first.next_cursor)
+        expected = await sync_to_async(paginator.page)(first.next_cursor)
+        self.assertEqual(list(second), list(expected))
+        self.assertEqual(second.next_cursor, expected.next_cursor)
+
+
+class TestViewCounter(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pass12345")
+        self.post = Post.objects.create(
+            title="Hot Post",
+            slug="hot-post",
+            author=self.user,
+            content="Popular content",
+            is_published=True,
+        )
+
+    def test_views_are_buffered_until_flush(self):
+        counter = ViewCounter(buffer=LocalViewBuffer(), flush_interval=3600)
+        for _ in range(5):
+            counter.record(self.post.slug)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counter.flush(), 1)
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 5)
+
+    def test_flush_skips_unpublished_posts(self):
+        Post.objects.filter(pk=self.post.pk).update(is_published=False)
+        counter = ViewCounter(buffer=LocalViewBuffer(), flush_interval=3600)
+        counter.record(self.post.slug)
+        counter.flush()
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 0)
+
+    def test_cache_buffer_coalesces_increments(self):
+        counter = ViewCounter(buffer=CacheViewBuffer(), flush_interval=3600)
+        counter.record(self.post.slug)
+        counter.record(self.post.slug, 2)
+        counter.flush()
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 3)
+        self.assertEqual(counter.flush(), 0)
+
+    def test_cache_buffers_share_dirty_slugs(self):
+        other = Post.objects.create(
+            title="Other Post",
+            slug="other-post",
+            author=self.user,
+            content="More content",
+            is_published=True,
+        )
+        # Two processes recording different slugs
+        CacheViewBuffer().add(self.post.slug)
+        CacheViewBuffer().add(other.slug, 2)
+        CacheViewBuffer().add(self.post.slug)
+        self.assertEqual(CacheViewBuffer().drain(), {self.post.slug: 2, other.slug: 2})
+        self.assertEqual(CacheViewBuffer().drain(), {})
+
+        CacheViewBuffer().add(other.slug)
+        self.assertEqual(CacheViewBuffer().drain(), {other.slug: 1})
+
+    def test_missing_posts_are_not_counted(self):
+        buffer = LocalViewBuffer()
+        # A periodic flush would drain the buffer before the assertion
+        with (
+            patch.object(view_counter, "buffer", buffer),
+            patch.object(view_counter, "_last_flush", time.monotonic()),
+        ):
+            self.client.get(reverse("core:post_detail", args=["no-such-post"]))
+            self.client.get(reverse("core:post_detail", args=[self.post.slug]))
+            self.assertEqual(buffer.drain(), {self.post.slug: 1})
+
+    def test_flush_command_needs_a_shared_buffer(self):
+        from django.core.management import call_command
+
+        with self.assertRaises(CommandError):
+            call_command("flush_view_counts", stdout=StringIO())
+
+
+class TestPageCache(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        self.category = Category.objects.create(name="Cached", slug="cached")
+        self.post = Post.objects.create(
+            title="Cached Post",
+            slug="cached-post",
+            author=self.user,
+            category=self.category,
+            content="Cached content",
+            is_published=True,
+        )
+        self.other = Post.objects.create(
+            title="Other Post",
+            slug="other-post",
+            author=self.user,
+            content="Other content",
+            is_published=True,
+        )
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in [
+            reverse("core:home"),
+            reverse("core:post_list"),
+            reverse("core:post_detail", kwargs={"slug": "cached-post"}),
+            reverse("core:category_detail", kwargs={"slug": "cached"}),
+            reverse("core:search") + "?q=Cached",
+        ]:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+
+    def test_query_string_is_part_of_the_key(self):
+        self.client.get(reverse("core:search") + "?q=Cached")
+        response = self.client.get(reverse("core:search") + "?q=Other")
+        self.assertContains(response, "Other Post")
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.get(reverse("core:home"))
+        self.client.login(username="testuser", password="testpass123")
+        response = self.client.get(reverse("core:home"))
+        self.assertContains(response, "testuser")
+
+    def test_publishing_evicts_listings(self):
+        self.client.get(reverse("core:post_list"))
+        Post.objects.create(
+            title="Fresh Post",
+            slug="fresh-post",
+            author=self.user,
+            content="Fresh content",
+            is_published=True,
+        )
+        self.assertContains(self.client.get(reverse("core:post_list")), "Fresh Post")
+
+    def test_comment_only_evicts_its_post(self):
+        detail = reverse("core:post_detail", kwargs={"slug": "cached-post"})
+        other_detail = reverse("core:post_detail", kwargs={"slug": "other-post"})
+        self.client.get(detail)
+        self.client.get(other_detail)
+
+        Comment.objects.create(
+            post=self.post, author=self.user, content="A brand new comment"
+        )
+
+        self.assertContains(self.client.get(detail), "A brand new comment")
+        with self.assertNumQueries(0):
+            self.client.get(other_detail)
+
+    def test_invalidation_during_render_is_not_cached(self):
+        renders = []
+
+        @cache_anonymous_page("posts")
+        def view(request):  # noqa: ARG001
+            renders.append(1)
+            if len(renders) == 1:
+                # A post is saved while this page is being rendered
+                invalidate_tags("posts")
+            return HttpResponse(f"render {len(renders)}")
+
+        def get():
+            request = RequestFactory().get("/racy/")
+            request.user = AnonymousUser()
+            return view(request)
+
+        self.assertEqual(get().content, b"render 1")
+        self.assertEqual(get().content, b"render 2")
+        self.assertEqual(get().content, b"render 2")
+
+    def test_renaming_the_author_evicts_their_pages(self):
+        url = reverse("core:post_detail", kwargs={"slug": "cached-post"})
+        self.client.get(url)
+        self.user.first_name, self.user.last_name = "Ada", "Lovelace"
+        self.user.save()
+        self.assertContains(self.client.get(url), "Ada Lovelace")
+
+    def test_logins_keep_author_pages(self):
+        url = reverse("core:post_detail", kwargs={"slug": "cached-post"})
+        self.client.get(url)
+        Client().login(username="testuser", password="testpass123")
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_recategorizing_evicts_old_category_page(self):
+        url = reverse("core:category_detail", kwargs={"slug": "cached"})
+        self.client.get(url)
+
+        post = Post.objects.get(pk=self.post.pk)
+        post.category = None
+        post.save()
+
+        self.assertNotContains(self.client.get(url), "Cached Post")
+
+    def test_tag_changes_evict_post_detail(self):
+        detail = reverse("core:post_detail", kwargs={"slug": "cached-post"})
+        self.client.get(detail)
+        tag = Tag.objects.create(name="fresh-tag", slug="fresh-tag")
+        self.post.tags.add(tag)
+        self.assertContains(self.client.get(detail), "fresh-tag")
+
+    def test_cache_hits_still_count_views(self):
+        detail = reverse("core:post_detail", kwargs={"slug": "cached-post"})
+        self.client.get(detail)
+        self.client.get(detail)
+        view_counter.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 2)
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.category = Category.objects.create(name="Tech", slug="tech")
+        self.post = Post.objects.create(
+            title="Conditional Post",
+            slug="conditional-post",
+            author=self.user,
+            category=self.category,
+            content="Body",
+            is_published=True,
+        )
+        self.detail = reverse("core:post_detail", kwargs={"slug": "conditional-post"})
+        self.urls = [
+            reverse("core:home"),
+            reverse("core:post_list"),
+            self.detail,
+            reverse("core:category_detail", kwargs={"slug": "tech"}),
+        ]
+
+    def test_pages_carry_validators(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response["ETag"].startswith('W/"'), url)
+            self.assertIn("Last-Modified", response)
+            self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_matching_etag_is_not_modified(self):
+        for url in self.urls:
+            etag = self.client.get(url)["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response["ETag"], etag)
+
+    def test_if_modified_since_is_not_modified(self):
+        last_modified = self.client.get(self.detail)["Last-Modified"]
+        response = self.client.get(self.detail, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_revalidating_a_cached_page_runs_no_queries(self):
+        etag = self.client.get(self.detail)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_logged_in_revalidation_skips_rendering(self):
+        self.client.login(username="writer", password="pass12345")
+        # The first page sets the CSRF cookie, which is part of the ETag
+        self.client.get(self.detail)
+        etag = self.client.get(self.detail)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("private", response["Cache-Control"])
+        # The user and the validators; the post itself is never loaded
+        self.assertEqual(len(queries), 2)
+
+    def test_validators_run_in_one_query(self):
+        self.client.login(username="writer", password="pass12345")
+        for url in self.urls:
+            etag = self.client.get(url)["ETag"]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            validators = [
+                query for query in queries if query["sql"].startswith("SELECT (SELECT")
+            ]
+            self.assertEqual(len(validators), 1, url)
+
+    def test_new_comment_changes_etag(self):
+        etag = self.client.get(self.detail)["ETag"]
+        Comment.objects.create(post=self.post, author=self.user, content="New")
+        response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertContains(response, "New")
+
+    def test_post_update_changes_listing_etag(self):
+        url = reverse("core:post_list")
+        etag = self.client.get(url)["ETag"]
+        self.post.title = "Renamed Post"
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Renamed Post")
+
+    def test_deletion_changes_etag(self):
+        url = reverse("core:post_list")
+        etag = self.client.get(url)["ETag"]
+        Post.objects.create(
+            title="Short-lived",
+            slug="short-lived",
+            author=self.user,
+            content="Body",
+            is_published=True,
+        ).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_version_setting_changes_etag(self):
+        self.client.login(username="writer", password="pass12345")
+        etag = self.client.get(self.detail)["ETag"]
+        with override_settings(ETAG_VERSION="next"):
+            response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_messages_are_never_not_modified(self):
+        self.client.login(username="writer", password="pass12345")
+        etag = self.client.get(self.detail)["ETag"]
+        with patch("core.conditional.get_messages", return_value=["Saved"]):
+            response = self.client.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestSessions(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pass12345")
+        self.post = Post.objects.create(
+            title="Session Post",
+            slug="session-post",
+            author=self.user,
+            content="Body",
+            is_published=True,
+        )
+
+    def session_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q for q in queries if "django_session" in q["sql"]]
+
+    def test_anonymous_reads_never_load_a_session(self):
+        with patch.object(SessionStore, "load") as load:
+            for url in [
+                reverse("core:home"),
+                reverse("core:post_list"),
+                reverse("core:post_detail", kwargs={"slug": "session-post"}),
+            ]:
+                response, queries = self.session_queries(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(queries, [])
+        load.assert_not_called()
+
+    def test_authenticated_requests_read_the_cache(self):
+        self.client.login(username="reader", password="pass12345")
+        response, queries = self.session_queries(reverse("core:profile"))
+        self.assertContains(response, "reader")
+        self.assertEqual(queries, [])
+
+    def test_unknown_session_cookie_is_dropped(self):
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = "x" * 32
+        response = self.client.get(reverse("core:profile"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[settings.SESSION_COOKIE_NAME].value, "")
+
+    def test_sweep_deletes_expired_rows_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(
+                session_key=f"expired{i:025d}",
+                session_data="",
+                expire_date=now - timezone.timedelta(days=1),
+            )
+        Session.objects.create(
+            session_key="live" + "0" * 28,
+            session_data="",
+            expire_date=now + timezone.timedelta(days=1),
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sweep_expired(batch_size=2), 5)
+        deletes = [q for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(
+            list(Session.objects.values_list("session_key", flat=True)),
+            ["live" + "0" * 28],
+        )
+
+    def test_sweep_command(self):
+        from django.core.management import call_command
+
+        Session.objects.create(
+            session_key="expired" + "0" * 25,
+            session_data="",
+            expire_date=timezone.now() - timezone.timedelta(days=1),
+        )
+        out = StringIO()
+        call_command("sweep_sessions", "--batch-size", "10", stdout=out)
+        self.assertIn("Deleted 1 expired sessions", out.getvalue())
+        self.assertFalse(Session.objects.exists())
+
+
+class TestPasswordHashing(TestCase):
+    def login(self, username="reader", password="pass12345"):
+        return self.client.post(
+            reverse("core:login"), {"username": username, "password": password}
+        )
+
+    def test_login_hashes_the_password_once(self):
+        User.objects.create_user(username="reader", password="pass12345")
+        hasher = get_hasher()
+        with patch.object(hasher, "encode", wraps=hasher.encode) as encode:
+            response = self.login()
+        self.assertRedirects(response, reverse("core:home"))
+        self.assertEqual(encode.call_count, 1)
+
+    def test_failed_login_hashes_once(self):
+        User.objects.create_user(username="reader", password="pass12345")
+        hasher = get_hasher()
+        with patch.object(hasher, "encode", wraps=hasher.encode) as encode:
+            response = self.login(password="wrong")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encode.call_count, 1)
+
+    def test_login_upgrades_old_hashes(self):
+        user = User.objects.create(
+            username="reader",
+            password=make_password("pass12345", hasher="pbkdf2_sha1"),
+        )
+        self.assertRedirects(self.login(), reverse("core:home"))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+
+    def test_hasher_chain_is_configurable(self):
+        user = User.objects.create_user(username="reader", password="pass12345")
+        with override_settings(
+            PASSWORD_HASHERS=[
+                "django.contrib.auth.hashers.MD5PasswordHasher",
+                "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+            ]
+        ):
+            self.assertRedirects(self.login(), reverse("core:home"))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("md5$"))
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class TestUserImport(TestCase):
+    def write(self, name, text):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(text)
+        return path
+
+    def csv_file(self, count, start=0):
+        lines = ["username,email,password,bio,location"]
+        lines += [
+            f"member{i},member{i}@example.com,secret-{i},Bio {i},Town"
+            for i in range(start, start + count)
+        ]
+        return self.write("members.csv", "\n".join(lines) + "\n")
+
+    def test_csv_creates_users_and_profiles_in_chunks(self):
+        path = self.csv_file(5)
+        with CaptureQueriesContext(connection) as queries:
+            stats, errors = import_users(path, chunk_size=2)
+        self.assertEqual(stats["created"], 5)
+        self.assertEqual(errors, [])
+        inserts = [q for q in queries if q["sql"].startswith('INSERT INTO "auth_user"')]
+        self.assertEqual(len(inserts), 3)
+        user = User.objects.get(username="member3")
+        self.assertTrue(user.check_password("secret-3"))
+        self.assertEqual(user.email, "member3@example.com")
+        self.assertEqual(user.profile.bio, "Bio 3")
+
+    def test_ndjson_accepts_prehashed_and_missing_passwords(self):
+        encoded = make_password("partner-pass")
+        path = self.write(
+            "members.ndjson",
+            json.dumps({"username": "hashed", "password_hash": encoded})
+            + "\n\n"
+            + json.dumps({"username": "nopass", "website": "https://example.com"})
+            + "\n",
+        )
+        with patch("core.user_import.hash_passwords", wraps=hash_passwords) as hasher:
+            stats, errors = import_users(path)
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(hasher.call_args.args, ([],))
+        self.assertEqual(User.objects.get(username="hashed").password, encoded)
+        nopass = User.objects.get(username="nopass")
+        self.assertFalse(nopass.has_usable_password())
+        self.assertEqual(nopass.profile.website, "https://example.com")
+
+    def test_invalid_and_duplicate_records_are_skipped(self):
+        path = self.write(
+            "members.ndjson",
+            "\n".join(
+                [
+                    json.dumps({"username": "good", "password": "x"}),
+                    "{not json",
+                    json.dumps({"username": "bad name!"}),
+                    json.dumps({"username": "good", "password": "y"}),
+                    json.dumps(
+                        {"username": "both", "password": "x", "password_hash": "y"}
+                    ),
+                    json.dumps({"username": "unknown", "password_hash": "nope$1"}),
+                    json.dumps(["username"]),
+                ]
+            ),
+        )
+        stats, errors = import_users(path)
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["duplicate"], 1)
+        self.assertEqual(stats["invalid"], 5)
+        self.assertEqual([line for line, _ in errors], [2, 3, 5, 6, 7])
+        self.assertIn("username", errors[1][1])
+        self.assertTrue(User.objects.get(username="good").check_password("x"))
+
+    def test_rerun_resumes_an_interrupted_import(self):
+        path = self.csv_file(6)
+        calls = []
+
+        def interrupt(accounts):
+            calls.append(len(accounts))
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return insert_accounts(accounts)
+
+        with (
+            patch("core.user_import.insert_accounts", side_effect=interrupt),
+            self.assertRaises(KeyboardInterrupt),
+        ):
+            import_users(path, chunk_size=2)
+        self.assertEqual(User.objects.count(), 2)
+
+        with patch("core.user_import.hash_passwords", wraps=hash_passwords) as hasher:
+            stats, _ = import_users(path, chunk_size=2)
+        self.assertEqual(stats["created"], 4)
+        self.assertEqual(stats["existing"], 2)
+        # Committed accounts are not hashed again
+        self.assertEqual(sum(len(call.args[0]) for call in hasher.call_args_list), 4)
+        self.assertEqual(Profile.objects.count(), 6)
+
+    def test_workers_hash_in_processes(self):
+        path = self.csv_file(7)
+        stats, _ = import_users(path, chunk_size=2, workers=2)
+        self.assertEqual(stats["created"], 7)
+        self.assertTrue(User.objects.get(username="member6").check_password("secret-6"))
+
+    def test_workers_do_not_need_fork(self):
+        path = self.csv_file(3)
+        spawn = multiprocessing.get_context("spawn")
+        with patch("core.user_import.multiprocessing.Pool", spawn.Pool):
+            stats, _ = import_users(path, chunk_size=2, workers=2)
+        self.assertEqual(stats["created"], 3)
+        self.assertTrue(User.objects.get(username="member2").check_password("secret-2"))
+
+    def test_command(self):
+        from django.core.management import call_command
+
+        path = self.csv_file(3)
+        out, err = StringIO(), StringIO()
+        call_command("import_users", path, "--chunk-size", "2", stdout=out, stderr=err)
+        self.assertIn("Created 3 accounts", out.getvalue())
+
+        bad = self.write("members.txt", "")
+        with self.assertRaises(CommandError):
+            call_command("import_users", bad, stdout=out)
+
+
+class TestProfiles(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="author", password="pass12345")
+        self.post = Post.objects.create(
+            title="Profiled Post",
+            slug="profiled-post",
+            author=self.user,
+            content="Body",
+            is_published=True,
+        )
+
+    def test_every_new_user_gets_a_profile(self):
+        self.assertTrue(Profile.objects.filter(user=self.user).exists())
+
+    def test_registration_creates_one_profile(self):
+        response = self.client.post(
+            reverse("core:register"),
+            {
+                "username": "newcomer",
+                "password1": "correct-Horse-7-staple",
+                "password2": "correct-Horse-7-staple",
+            },
+        )
+        self.assertRedirects(response, reverse("core:login"))
+        self.assertEqual(Profile.objects.filter(user__username="newcomer").count(), 1)
+
+    def test_admin_add_user_with_profile_fields(self):
+        admin_user = User.objects.create_superuser("admin", "a@example.com", "pass")
+        self.client.force_login(admin_user)
+        response = self.client.post(
+            reverse("admin:auth_user_add"),
+            {
+                "username": "staffed",
+                "password1": "correct-Horse-7-staple",
+                "password2": "correct-Horse-7-staple",
+                "usable_password": "true",
+                "profile-TOTAL_FORMS": "1",
+                "profile-INITIAL_FORMS": "0",
+                "profile-MIN_NUM_FORMS": "0",
+                "profile-MAX_NUM_FORMS": "1",
+                "profile-0-bio": "Added in the admin",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        profiles = Profile.objects.filter(user__username="staffed")
+        self.assertEqual([profile.bio for profile in profiles], ["Added in the admin"])
+
+    def test_post_detail_joins_the_author_profile(self):
+        Profile.objects.filter(user=self.user).update(bio="Writes about profiles")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("core:post_detail", kwargs={"slug": "profiled-post"})
+            )
+        self.assertContains(response, "Writes about profiles")
+        self.assertFalse(
+            any(q["sql"].startswith('SELECT "core_profile"') for q in queries)
+        )
+
+    def test_author_card_follows_profile_edits(self):
+        self.client.force_login(self.user)
+        url = reverse("core:post_detail", kwargs={"slug": "profiled-post"})
+        self.client.get(url)
+        profile = self.user.profile
+        profile.location = "Lisbon"
+        profile.save()
+        self.assertContains(self.client.get(url), "Lisbon")
+
+    def test_missing_profile_is_recreated(self):
+        Profile.objects.filter(user=self.user).delete()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(Profile.objects.for_user(user).user_id, user.pk)
+
+
+class TestCommentQueue(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster", password="pass12345")
+        self.post = Post.objects.create(
+            title="Queued Post",
+            slug="queued-post",
+            author=self.user,
+            content="Body",
+            is_published=True,
+        )
+        self.url = reverse("core:add_comment", kwargs={"post_slug": "queued-post"})
+
+    def enqueue(self, count, post=None):
+        return [
+            PendingComment.objects.create(
+                post=post or self.post, author=self.user, content=f"Comment {n}"
+            )
+            for n in range(count)
+        ]
+
+    def test_inline_mode_publishes_before_responding(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url,
+            {"content": "Right away"},
+            headers={"x-requested-with": "XMLHttpRequest"},
+        )
+        data = response.json()
+        self.assertTrue(data["success"])
+        self.assertEqual(data["status"], PendingComment.PUBLISHED)
+        self.assertEqual(data["comment"]["content"], "Right away")
+        self.assertEqual(
+            data["status_url"],
+            reverse("core:comment_status", args=[data["pending_id"]]),
+        )
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.comment_count, 1)
+        self.assertIsNotNone(post.last_comment_at)
+
+    def test_worker_mode_answers_with_a_pending_entry(self):
+        self.client.force_login(self.user)
+        with (
+            self.settings(COMMENT_WORKERS=2),
+            patch("core.comment_queue.schedule_drain") as schedule,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            response = self.client.post(
+                self.url, {"content": "Published a little later"}
+            )
+        self.assertRedirects(
+            response, reverse("core:post_detail", kwargs={"slug": "queued-post"})
+        )
+        schedule.assert_called_once_with()
+        pending = PendingComment.objects.get()
+        self.assertEqual(pending.status, PendingComment.PENDING)
+        self.assertFalse(Comment.objects.exists())
+
+        self.assertEqual(drain(), 1)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, PendingComment.PUBLISHED)
+        self.assertEqual(pending.comment.content, "Published a little later")
+
+    def test_batch_is_published_with_one_insert(self):
+        entries = self.enqueue(5)
+        claimed = claim(batch_size=10, worker="w1")
+        self.assertEqual(len(claimed), 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(publish(claimed), 5)
+        inserts = [
+            q for q in queries if q["sql"].startswith('INSERT INTO "core_comment"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        comments = list(Comment.objects.order_by("pk"))
+        self.assertEqual([c.content for c in comments], [e.content for e in entries])
+        self.assertTrue(all(c.path == c.build_path() for c in comments))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comment_count, 5)
+
+    def test_claimed_rows_are_not_claimed_twice(self):
+        self.enqueue(3)
+        self.assertEqual(len(claim(batch_size=2, worker="w1")), 2)
+        self.assertEqual(len(claim(batch_size=2, worker="w2")), 1)
+        self.assertEqual(claim(worker="w3"), [])
+
+    def test_stale_claims_are_taken_over(self):
+        self.enqueue(1)
+        claim(worker="crashed")
+        PendingComment.objects.update(
+            claimed_at=timezone.now() - timezone.timedelta(minutes=5)
+        )
+        self.assertEqual(len(claim(worker="w2")), 1)
+
+    def test_rows_taken_over_are_not_published_twice(self):
+        self.enqueue(2)
+        slow = claim(worker="slow")
+        PendingComment.objects.update(
+            claimed_at=timezone.now() - timezone.timedelta(minutes=5)
+        )
+        self.assertEqual(publish(claim(batch_size=1, worker="w2")), 1)
+        # One row was taken over and published; the other is still held
+        self.assertEqual(publish(slow), 1)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertFalse(
+            PendingComment.objects.exclude(status=PendingComment.PUBLISHED).exists()
+        )
+
+    def test_comment_on_unpublished_post_fails(self):
+        (entry,) = self.enqueue(1)
+        Post.objects.filter(pk=self.post.pk).update(is_published=False)
+        self.assertEqual(drain(), 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, PendingComment.FAILED)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_status_is_only_shown_to_the_author(self):
+        (entry,) = self.enqueue(1)
+        url = reverse("core:comment_status", args=[entry.pk])
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).json()["status"], "pending")
+        drain()
+        data = self.client.get(url).json()
+        self.assertEqual(data["status"], "published")
+        self.assertEqual(data["comment"]["id"], Comment.objects.get().pk)
+
+        other = User.objects.create_user(username="other", password="pass12345")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_purge_keeps_pending_and_recent_entries(self):
+        old, recent, waiting = self.enqueue(3)
+        drain(batch_size=1)
+        PendingComment.objects.create(post=self.post, author=self.user, content="New")
+        PendingComment.objects.filter(pk__in=[old.pk, waiting.pk]).update(
+            updated_at=timezone.now() - timezone.timedelta(days=2)
+        )
+        PendingComment.objects.filter(pk=waiting.pk).update(
+            status=PendingComment.PENDING
+        )
+        self.assertEqual(purge(), 1)
+        self.assertFalse(PendingComment.objects.filter(pk=old.pk).exists())
+        self.assertEqual(PendingComment.objects.count(), 3)
+
+    def test_process_comments_command(self):
+        from django.core.management import call_command
+
+        self.enqueue(3)
+        out = StringIO()
+        call_command("process_comments", "--batch-size", "2", stdout=out)
+        self.assertIn("Processed 3 comments", out.getvalue())
+        self.assertEqual(Comment.objects.count(), 3)
+
+
+class TestPostCounts(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.python = Category.objects.create(name="Python", slug="python")
+        self.django = Category.objects.create(name="Django", slug="django")
+        self.tag = Tag.objects.create(name="orm", slug="orm")
+
+    def create_post(self, slug, **kwargs):
+        defaults = {
+            "title": slug,
+            "author": self.user,
+            "category": self.python,
+            "content": "Body",
+            "is_published": True,
+        }
+        defaults.update(kwargs)
+        return Post.objects.create(slug=slug, **defaults)
+
+    def assertCounts(self, python, django, tag):
+        self.assertEqual(Category.objects.get(pk=self.python.pk).post_count, python)
+        self.assertEqual(Category.objects.get(pk=self.django.pk).post_count, django)
+        self.assertEqual(Tag.objects.get(pk=self.tag.pk).post_count, tag)
+
+    def test_publish_and_unpublish(self):
+        post = self.create_post("draft", is_published=False)
+        post.tags.add(self.tag)
+        self.assertCounts(0, 0, 0)
+
+        post = Post.objects.get(pk=post.pk)
+        post.is_published = True
+        post.save()
+        self.assertCounts(1, 0, 1)
+
+        post.is_published = False
+        post.save()
+        self.assertCounts(0, 0, 0)
+
+    def test_recategorize(self):
+        post = self.create_post("moving")
+        post = Post.objects.get(pk=post.pk)
+        post.category = self.django
+        post.save()
+        self.assertCounts(0, 1, 0)
+
+    def test_tag_changes(self):
+        post = self.create_post("tagged")
+        post.tags.add(self.tag)
+        self.assertCounts(1, 0, 1)
+        post.tags.remove(self.tag)
+        self.assertCounts(1, 0, 0)
+        self.tag.posts.add(post)
+        self.assertCounts(1, 0, 1)
+        post.tags.clear()
+        self.assertCounts(1, 0, 0)
+
+    def test_delete(self):
+        post = self.create_post("doomed")
+        post.tags.add(self.tag)
+        post.delete()
+        self.assertCounts(0, 0, 0)
+
+    def test_rebuild_command(self):
+        post = self.create_post("drifted")
+        post.tags.add(self.tag)
+        Category.objects.update(post_count=7)
+        Tag.objects.update(post_count=7)
+
+        from django.core.management import call_command
+
+        call_command("rebuild_post_counts", stdout=StringIO())
+        self.assertCounts(1, 0, 1)
+
+    def test_home_sidebar_reads_counter(self):
+        self.create_post("counted")
+        response = self.client.get(reverse("core:home"))
+        category = next(
+            c for c in response.context["categories"] if c.pk == self.python.pk
+        )
+        self.assertEqual(category.post_count, 1)
+
+
+class TestCommentStats(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        self.post = Post.objects.create(
+            title="Discussed Post",
+            slug="discussed-post",
+            author=self.user,
+            content="Talk about it",
+            is_published=True,
+        )
+
+    def test_add_comment_updates_stats(self):
+        self.client.login(username="testuser", password="testpass123")
+        self.client.post(
+            reverse("core:add_comment", kwargs={"post_slug": "discussed-post"}),
+            {"content": "This is a valid comment with enough characters."},
+        )
+        self.post.refresh_from_db()
+        comment = Comment.objects.get(post=self.post)
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.post.last_comment_at, comment.created_at)
+
+    def test_unapproved_comments_are_not_counted(self):
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, content="Pending", is_approved=False
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.assertIsNone(self.post.last_comment_at)
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.is_approved = True
+        comment.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_admin_actions_refresh_stats(self):
+        from django.contrib.admin import AdminSite
+
+        from core.admin import CommentAdmin
+
+        Comment.objects.create(post=self.post, author=self.user, content="One")
+        Comment.objects.create(post=self.post, author=self.user, content="Two")
+        admin_instance = CommentAdmin(Comment, AdminSite())
+        admin_instance.message_user = lambda *args, **kwargs: None
+
+        admin_instance.unapprove_comments(None, Comment.objects.all())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.assertIsNone(self.post.last_comment_at)
+
+        admin_instance.approve_comments(None, Comment.objects.all())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    def test_delete_comment_updates_stats(self):
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, content="Short lived"
+        )
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_post_list_shows_counts(self):
+        Comment.objects.create(post=self.post, author=self.user, content="Hello")
+        response = self.client.get(reverse("core:post_list"))
+        self.assertContains(response, "1 comment")
+
+
+class TestMarkdown(TestCase):
+    def test_renders_blocks_and_inline_markup(self):
+        html, _ = render_markdown(
+            "Some **bold**, *em* and `x < y`.\n\n"
+            "1. One\n2. Two\n   - nested\n\n"
+            "> quoted\n\n"
+            "```python\nprint('<hi>')\n```\n\n"
+            "[Docs](https://docs.djangoproject.com/?a=1&b=2)"
+        )
+        self.assertIn("<strong>bold</strong>, <em>em</em>", html)
+        self.assertIn("<code>x &lt; y</code>", html)
+        self.assertIn("<ol>\n<li>One</li>\n<li>Two<ul>\n<li>nested</li>", html)
+        self.assertIn("<blockquote><p>quoted</p></blockquote>", html)
+        self.assertIn(
+            '<pre><code class="language-python">print(&#x27;&lt;hi&gt;&#x27;)', html
+        )
+        self.assertIn('<a href="https://docs.djangoproject.com/?a=1&amp;b=2">', html)
+
+    def test_output_is_sanitized(self):
+        html, _ = render_markdown(
+            "<script>alert(1)</script>\n\n"
+            "[x](javascript:alert(1)) [y](java\tscript:alert(1))\n\n"
+            '![a](data:text/html,evil) [z](/ok "t" onclick="x")'
+        )
+        self.assertNotIn("<script", html)
+        self.assertNotIn("javascript", html.replace("&lt;script&gt;", ""))
+        self.assertNotIn('href="java', html)
+        self.assertNotIn("<img", html)
+        self.assertNotIn(' onclick="', html)
+
+    def test_headings_get_unique_anchors_and_toc(self):
+        html, toc = render_markdown("# Intro\n## Set *up*\ntext\n## Set up")
+        self.assertIn('<h2 id="set-up">Set <em>up</em></h2>', html)
+        self.assertIn('<h2 id="set-up-2">Set up</h2>', html)
+        self.assertEqual(
+            toc,
+            [
+                {"level": 1, "title": "Intro", "anchor": "intro"},
+                {"level": 2, "title": "Set up", "anchor": "set-up"},
+                {"level": 2, "title": "Set up", "anchor": "set-up-2"},
+            ],
+        )
+
+
+class TestRenderedContent(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.post = Post.objects.create(
+            title="Markdown",
+            slug="markdown",
+            author=self.user,
+            content="## First\n\nHello **world**\n\n## Second\n\nBye",
+            is_published=True,
+        )
+
+    def test_html_is_stored_on_save(self):
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertIn("<strong>world</strong>", post.content_html)
+        self.assertEqual(post.content_html_version, RENDERER_VERSION)
+        self.assertEqual([entry["anchor"] for entry in post.toc], ["first", "second"])
+
+        post.content = "Changed"
+        post.save(update_fields=["content"])
+        post.refresh_from_db()
+        self.assertEqual(post.content_html, "<p>Changed</p>")
+        self.assertEqual(post.toc, [])
+
+    def test_detail_page_outputs_stored_html(self):
+        Post.objects.filter(pk=self.post.pk).update(
+            content_html="<p>Stored</p>", toc=[]
+        )
+        url = reverse("core:post_detail", kwargs={"slug": "markdown"})
+        self.assertContains(self.client.get(url), "<p>Stored</p>", html=True)
+
+    def test_outdated_html_is_rendered_on_the_fly(self):
+        Post.objects.filter(pk=self.post.pk).update(
+            content_html="", content_html_version=0
+        )
+        url = reverse("core:post_detail", kwargs={"slug": "markdown"})
+        response = self.client.get(url)
+        # Outdated rows are rendered on the fly until render_posts runs
+        self.assertContains(response, '<h2 id="second">Second</h2>', html=True)
+        self.assertContains(response, 'href="#first"')
+
+    def test_render_posts_updates_outdated_rows(self):
+        Post.objects.filter(pk=self.post.pk).update(
+            content_html="", toc=[], content_html_version=0
+        )
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("render_posts", stdout=out)
+        self.assertIn("Rendered 1 posts", out.getvalue())
+        self.post.refresh_from_db()
+        self.assertIn('<h2 id="first">', self.post.content_html)
+        self.assertEqual(len(self.post.toc), 2)
+        self.assertEqual(render_posts(), 0)
+        self.assertEqual(render_posts(full=True), 1)
+
+
+class TestListingCards(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="writer", password="pass12345", first_name="Ada"
+        )
+        self.category = Category.objects.create(name="News", slug="news")
+        self.post = Post.objects.create(
+            title="Cards",
+            slug="cards",
+            author=self.user,
+            category=self.category,
+            content="# Heading\n\nSome *long* body text",
+            is_published=True,
+        )
+        self.post.tags.add(
+            Tag.objects.create(name="Zeta", slug="zeta"),
+            Tag.objects.create(name="Alpha", slug="alpha"),
+        )
+
+    def test_summary_is_stored_on_save(self):
+        self.assertEqual(self.post.summary, "Heading Some long body text")
+        self.post.excerpt = "Short   version"
+        self.post.save(update_fields=["excerpt"])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.summary, "Short version")
+
+    def test_cards_never_select_post_bodies(self):
+        with CaptureQueriesContext(connection) as queries:
+            cards = list(Post.objects.cards())
+        self.assertEqual(len(queries), 2)
+        for column in ("content", "content_html", "toc"):
+            self.assertNotIn(f'"core_post"."{column}"', queries[0]["sql"])
+
+        (card,) = cards
+        self.assertEqual(card, self.post)
+        self.assertFalse(hasattr(card, "__dict__"))
+        self.assertEqual(card.summary, self.post.summary)
+        self.assertEqual(card.author.get_full_name(), "Ada")
+        self.assertEqual(card.category.slug, "news")
+        self.assertEqual([tag.name for tag in card.tags.all()], ["Alpha", "Zeta"])
+        self.assertFalse(card.featured_image)
+        self.assertEqual(card.get_absolute_url(), self.post.get_absolute_url())
+
+    def test_cards_survive_chained_querysets(self):
+        cards = Post.objects.cards(tags=False).filter(pk=self.post.pk)
+        with CaptureQueriesContext(connection) as queries:
+            (card,) = cards.order_by("-pk")[:1]
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(card.tags.exists())
+
+    def test_listing_pages_render_cards(self):
+        for url in (
+            reverse("core:home"),
+            reverse("core:post_list"),
+            reverse("core:category_detail", kwargs={"slug": "news"}),
+        ):
+            response = self.client.get(url)
+            self.assertContains(response, "Some long body text")
+            self.assertContains(response, self.post.get_absolute_url())
+
+
+class TestImageDerivatives(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(
+            MEDIA_ROOT=directory.name,
+            IMAGE_DERIVATIVE_WIDTHS=[320, 640, 960],
+            IMAGE_DERIVATIVE_WORKERS=0,
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+
+    def upload(self, size=(800, 400), mode="RGBA"):
+        buffer = BytesIO()
+        Image.new(mode, size, "red").save(buffer, "PNG")
+        return SimpleUploadedFile("photo.png", buffer.getvalue())
+
+    def create_post(self, **kwargs):
+        return Post.objects.create(
+            title="Photo",
+            slug="photo",
+            author=self.user,
+            content="Body",
+            is_published=True,
+            featured_image=self.upload(),
+            **kwargs,
+        )
+
+    def test_derivatives_are_generated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = self.create_post()
+        post.refresh_from_db()
+        derivatives = post.image_derivatives
+        self.assertEqual(derivatives["source"], post.featured_image.name)
+        self.assertEqual((derivatives["width"], derivatives["height"]), (800, 400))
+        # Never enlarged past the original width
+        self.assertEqual([width for width, _ in derivatives["webp"]], [320, 640, 800])
+        storage = post.featured_image.storage
+        smallest = derivatives["jpeg"][0][1].removeprefix(storage.base_url)
+        with storage.open(smallest) as image_file:
+            image = Image.open(image_file)
+            self.assertEqual((image.format, image.size), ("JPEG", (320, 160)))
+        self.assertIn("/derivatives/", smallest)
+
+        response = self.client.get(post.get_absolute_url())
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, f"{derivatives['jpeg'][-1][1]} 800w")
+        card = Post.objects.cards().get(pk=post.pk)
+        self.assertEqual(card.responsive_image, post.responsive_image)
+
+    def test_original_is_served_until_derivatives_match(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            post = self.create_post()
+        self.assertEqual(len(callbacks), 1)
+        self.assertIsNone(post.responsive_image)
+        response = self.client.get(reverse("core:post_list"))
+        self.assertContains(response, f'src="{post.featured_image.url}"')
+        self.assertNotContains(response, "srcset")
+
+    def test_jobs_go_to_the_worker_pool(self):
+        with (
+            override_settings(IMAGE_DERIVATIVE_WORKERS=2),
+            patch("core.images.get_executor") as get_executor,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            post = self.create_post()
+        get_executor.return_value.submit.assert_called_once()
+        self.assertEqual(
+            get_executor.return_value.submit.call_args.args[1:],
+            (post.pk, post.featured_image.name),
+        )
+
+    def test_command_fills_in_missing_derivatives(self):
+        from django.core.management import call_command
+
+        with self.captureOnCommitCallbacks(execute=False):
+            post = self.create_post()
+        out = StringIO()
+        call_command("generate_image_derivatives", "--workers=0", stdout=out)
+        self.assertIn("Generated derivatives for 1 posts", out.getvalue())
+        self.assertIsNotNone(Post.objects.get(pk=post.pk).responsive_image)
+        self.assertEqual(generate_missing_derivatives(workers=0), (0, 0))
+
+
+class TestContentAddressedStorage(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        media = override_settings(MEDIA_ROOT=self.root, IMAGE_DERIVATIVE_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = ContentAddressedStorage()
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+
+    def make_old(self, name):
+        old = time.time() - 7 * 24 * 60 * 60
+        os.utime(self.storage.path(name), (old, old))
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.storage.save("posts/a.PNG", ContentFile(b"same bytes"))
+        second = self.storage.save("posts/b.png", ContentFile(b"same bytes"))
+        other = self.storage.save("posts/a.png", ContentFile(b"other bytes"))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        digest = hashlib.sha256(b"same bytes").hexdigest()
+        self.assertEqual(first, f"posts/{digest[:2]}/{digest}.png")
+        self.assertEqual(len(self.storage.listdir(f"posts/{digest[:2]}")[1]), 1)
+
+    def test_reuse_refreshes_modification_time(self):
+        name = self.storage.save("posts/a.png", ContentFile(b"bytes"))
+        self.make_old(name)
+        self.storage.save("posts/b.png", ContentFile(b"bytes"))
+        age = timezone.now() - self.storage.get_modified_time(name)
+        self.assertLess(age.total_seconds(), 60)
+
+    def test_garbage_collection_keeps_referenced_files(self):
+        profile = self.user.profile
+        profile.avatar = SimpleUploadedFile("me.png", b"avatar")
+        profile.save()
+        orphan = self.storage.save("posts/gone.png", ContentFile(b"orphan"))
+        recent = self.storage.save("posts/new.png", ContentFile(b"uploading"))
+        legacy = self.storage._save("posts/legacy.png", ContentFile(b"old style"))
+        derivative = self.storage.save("posts/d.webp", ContentFile(b"derivative"))
+        Post.objects.create(
+            title="Post",
+            slug="post",
+            author=self.user,
+            content="Body",
+            image_derivatives={
+                "webp": [[320, self.storage.url(derivative)]],
+                "jpeg": [],
+            },
+        )
+        for name in (profile.avatar.name, orphan, legacy, derivative):
+            self.make_old(name)
+
+        self.assertEqual(collect_garbage(self.storage, dry_run=True), [orphan])
+        self.assertTrue(self.storage.exists(orphan))
+        self.assertEqual(collect_garbage(self.storage), [orphan])
+        self.assertFalse(self.storage.exists(orphan))
+        for name in (profile.avatar.name, recent, legacy, derivative):
+            self.assertTrue(self.storage.exists(name))
+
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("collect_media_garbage", "--grace-hours=0", stdout=out)
+        self.assertIn("Deleted 1 unreferenced files", out.getvalue())
+        self.assertFalse(self.storage.exists(recent))
+
+    def test_content_addressed_files_are_immutable(self):
+        hashed = self.storage.save("posts/a.png", ContentFile(b"bytes"))
+        legacy = self.storage._save("posts/legacy.png", ContentFile(b"bytes"))
+        request = RequestFactory().get("/media/")
+        response = serve_media(request, hashed, document_root=self.root)
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+        response = serve_media(request, legacy, document_root=self.root)
+        self.assertFalse(response.has_header("Cache-Control"))
+
+
+class TestStaticAssets(TestCase):
+    CSS = (
+        "/*! Lib v1 */.btn{color:red}.unused{color:blue}.btn:not(.gone),.x .unused"
+        "{a:b}@media (min-width:1px){.unused{a:b}.card{a:b}}@media print{.unused"
+        '{a:b}}@font-face{font-family:A;src:url(../webfonts/a.woff2) format("woff2")'
+        ',url(../webfonts/a.ttf) format("truetype")}@font-face{font-family:B;'
+        'src:url(../webfonts/b.woff2)}.alert-success{a:b}:root{--x:1}a{content:"}"}'
+        "\n/*# sourceMappingURL=lib.css.map */"
+    )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as output:
+            output.write(content.encode() if isinstance(content, str) else content)
+        return path
+
+    def test_tree_shaking_drops_unused_rules_and_fonts(self):
+        css = tree_shake_css(
+            self.CSS,
+            class_filter({"btn", "card"}),
+            keep_url=lambda url: url.endswith("a.woff2"),
+        )
+        self.assertEqual(
+            css,
+            "/*! Lib v1 */\n.btn{color:red}.btn:not(.gone){a:b}"
+            "@media (min-width:1px){.card{a:b}}"
+            '@font-face{font-family:A;src:url(../webfonts/a.woff2) format("woff2")}'
+            '.alert-success{a:b}:root{--x:1}a{content:"}"}',
+        )
+
+    def test_vendor_assets_writes_shaken_files(self):
+        self.write("templates/page.html", '<i class="fas fa-blog btn"></i>')
+        packages = {
+            "lib": (
+                "1.0.0",
+                {
+                    "dist/lib.css": "vendor/lib/css/lib.css",
+                    "dist/lib.js": "vendor/lib/js/lib.js",
+                    "webfonts/a.woff2": "vendor/lib/webfonts/a.woff2",
+                },
+            )
+        }
+        contents = {
+            "dist/lib.css": self.CSS.encode(),
+            "dist/lib.js": b'el.classList.add("card")\n//# sourceMappingURL=lib.js.map',
+            "webfonts/a.woff2": b"font",
+        }
+        written = vendor_assets(
+            self.root, packages, download=lambda name, version: contents
+        )
+        self.assertEqual(len(written), 3)
+        static_dir = os.path.join(self.root, "static", "vendor", "lib")
+        with open(os.path.join(static_dir, "css", "lib.css")) as css:
+            css = css.read()
+        # "card" is used by the script, fonts that are not vendored are dropped
+        self.assertIn("@media (min-width:1px){.card{a:b}}", css)
+        self.assertNotIn("unused", css)
+        self.assertNotIn("a.ttf", css)
+        self.assertNotIn("font-family:B", css)
+        with open(os.path.join(static_dir, "js", "lib.js")) as js:
+            self.assertNotIn("sourceMappingURL", js.read())
+
+    def test_integrity_is_verified(self):
+        digest = base64.b64encode(hashlib.sha512(b"data").digest()).decode()
+        verify_integrity(b"data", f"sha512-{digest}")
+        with self.assertRaises(AssetError):
+            verify_integrity(b"tampered", f"sha512-{digest}")
+
+    def test_collectstatic_writes_compressed_variants(self):
+        source = os.path.join(self.root, "source")
+        css = ".btn{background:url(../img/dot.png)}" + ".card{color:red}" * 40
+        self.write("source/css/app.css", css)
+        self.write("source/img/dot.png", b"png")
+        with override_settings(
+            STATIC_ROOT=os.path.join(self.root, "collected"),
+            STATICFILES_DIRS=[source],
+            STORAGES={
+                **settings.STORAGES,
+                "staticfiles": {
+                    "BACKEND": "core.storage.CompressedManifestStaticFilesStorage"
+                },
+            },
+        ):
+            from django.core.management import call_command
+
+            call_command("collectstatic", interactive=False, verbosity=0)
+            hashed = staticfiles_storage.stored_name("css/app.css")
+            self.assertRegex(hashed, r"^css/app\.[0-9a-f]{12}\.css$")
+            with staticfiles_storage.open(hashed + ".gz") as compressed:
+                content = gzip.decompress(compressed.read()).decode()
+            self.assertIn(staticfiles_storage.stored_name("img/dot.png"), content)
+            self.assertEqual(
+                staticfiles_storage.exists(hashed + ".br"), brotli is not None
+            )
+            # Too small or not text: no variants
+            png = staticfiles_storage.stored_name("img/dot.png")
+            self.assertFalse(staticfiles_storage.exists(png + ".gz"))
+
+    def test_serve_static_negotiates_precompressed_files(self):
+        self.write("app.0123456789ab.css", ".a{}")
+        self.write("app.0123456789ab.css.gz", gzip.compress(b".a{}"))
+        self.write("robots.txt", "")
+        factory = RequestFactory()
+
+        request = factory.get("/", HTTP_ACCEPT_ENCODING="br;q=0, gzip")
+        response = serve_static(request, "app.0123456789ab.css", self.root)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+
+        response = serve_static(factory.get("/"), "app.0123456789ab.css", self.root)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        response = serve_static(factory.get("/"), "robots.txt", self.root)
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+
+    def test_asset_tag_falls_back_to_cdn_until_vendored(self):
+        path = "vendor/bootstrap/css/bootstrap.min.css"
+        template = engines["django"].from_string(
+            "{% load assets %}{% asset '" + path + "' %}"
+        )
+        _is_vendored.cache_clear()
+        self.addCleanup(_is_vendored.cache_clear)
+        with override_settings(STATICFILES_DIRS=[self.root]):
+            self.assertEqual(
+                template.render(),
+                "https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/"
+                "bootstrap.min.css",
+            )
+            self.write(path, ".btn{}")
+            _is_vendored.cache_clear()
+            self.assertEqual(template.render(), f"/static/{path}")
+
+    def test_deploy_check_reports_missing_assets(self):
+        with override_settings(STATICFILES_DIRS=[self.root]):
+            (warning,) = check_vendored_assets(None)
+            self.assertEqual(warning.id, "core.W001")
+            self.assertIn("4 front-end assets", warning.msg)
+            for _, files in PACKAGES.values():
+                for target in files.values():
+                    self.write(target, "")
+            self.assertEqual(check_vendored_assets(None), [])
+
+
+class TestCommentThreads(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="pass12345")
+        self.post = Post.objects.create(
+            title="Threaded Post",
+            slug="threaded-post",
+            author=self.user,
+            content="Discuss",
+            is_published=True,
+        )
+
+    def reply(self, parent=None, **kwargs):
+        return Comment.objects.create(
+            post=self.post,
+            author=self.user,
+            content=f"Reply to {parent.pk if parent else 'post'}",
+            parent=parent,
+            **kwargs,
+        )
+
+    def test_paths_follow_the_thread(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        self.assertEqual(root.path, str(root.pk).zfill(10))
+        self.assertEqual(grandchild.path, f"{child.path}/{grandchild.pk:010d}")
+        self.assertEqual(grandchild.depth, 2)
+        second_root = self.reply()
+        self.assertEqual(
+            list(Comment.objects.thread()), [root, child, grandchild, second_root]
+        )
+
+    def test_moving_a_comment_moves_its_subtree(self):
+        first, second = self.reply(), self.reply()
+        child = self.reply(first)
+        grandchild = self.reply(child)
+        child.parent = second
+        child.save()
+        grandchild.refresh_from_db()
+        self.assertTrue(grandchild.path.startswith(f"{second.path}/{child.pk:010d}/"))
+
+    def test_tree_hides_replies_to_unapproved_comments(self):
+        root = self.reply()
+        hidden = self.reply(root, is_approved=False)
+        self.reply(hidden)
+        visible = self.reply(root)
+        roots = build_comment_tree(self.post.comments.thread())
+        self.assertEqual(roots, [root])
+        self.assertEqual(roots[0].children, [visible])
+
+    def test_detail_renders_any_depth_in_one_query(self):
+        parent = self.reply()
+        for _ in range(6):
+            parent = self.reply(parent)
+        url = reverse("core:post_detail", kwargs={"slug": "threaded-post"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, f'id="comment-{parent.pk}"')
+        # The conditional GET validators read comments through subqueries
+        comment_queries = [
+            query
+            for query in queries
+            if 'FROM "core_comment"' in query["sql"]
+            and not query["sql"].startswith("SELECT (SELECT")
+        ]
+        self.assertEqual(len(comment_queries), 1)
+
+
+class TestQueryBudget(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        Profile.objects.filter(user=self.user).update(bio="Writes things")
+        self.category = Category.objects.create(name="Tech", slug="tech")
+        tags = [Tag.objects.create(name=f"Tag {i}", slug=f"tag-{i}") for i in range(3)]
+        for i in range(8):
+            post = Post.objects.create(
+                title=f"Post {i}",
+                slug=f"post-{i}",
+                author=self.user,
+                category=self.category,
+                content="Content",
+                is_published=True,
+            )
+            post.tags.set(tags)
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 21"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s) LIMIT 5"),
+        )
+        self.assertEqual(fingerprint("WHERE name = 'a''b'"), "WHERE name = ?")
+
+    def test_listing_pages_stay_within_budget(self):
+        # Tags and author profiles used to be loaded once per post
+        self.client.get(reverse("core:category_detail", kwargs={"slug": "tech"}))
+        self.client.get(reverse("core:post_detail", kwargs={"slug": "post-0"}))
+        self.client.get(reverse("core:post_list"))
+
+    def test_violation_is_logged_with_template_lines(self):
+        with (
+            override_settings(QUERY_BUDGET_MODE="log"),
+            patch.dict("core.query_budget._budgets", {"core:home": 1}),
+            self.assertLogs("core.query_budget", "WARNING") as logs,
+        ):
+            response = self.client.get(reverse("core:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("core:home ran", logs.output[0])
+        self.assertIn("(budget 1)", logs.output[0])
+
+    def test_duplicates_report_template_lines(self):
+        template = engines["django"].from_string(
+            "{% for post in posts %}\n{{ post.author.username }}{% endfor %}"
+        )
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            template.render({"posts": list(Post.objects.all())})
+        ((sql, count, lines),) = recorder.duplicates()
+        self.assertEqual(count, 8)
+        self.assertIn('FROM "auth_user"', sql)
+        self.assertEqual(lines, ["<unknown source>:2"])
+
+    def test_requests_within_budget_skip_the_stack_walk(self):
+        with patch("core.query_budget._template_line") as template_line:
+            self.client.get(reverse("core:home"))
+        template_line.assert_not_called()
+
+        with (
+            override_settings(QUERY_BUDGET_MODE="log"),
+            patch.dict("core.query_budget._budgets", {"core:home": 1}),
+            patch("core.query_budget._template_line", return_value=None) as line,
+            self.assertLogs("core.query_budget", "WARNING"),
+        ):
+            self.client.get(reverse("core:post_list"))
+            self.assertEqual(line.call_count, 0)
+            cache.clear()
+            self.client.get(reverse("core:home"))
+        self.assertGreater(line.call_count, 0)
+
+    def test_violation_raises_in_tests(self):
+        with (
+            patch.dict("core.query_budget._budgets", {"core:home": 1}),
+            self.assertRaises(QueryBudgetExceeded),
+        ):
+            self.client.get(reverse("core:home"))
+
+
+class TestServerTiming(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        Post.objects.create(
+            title="Timed post",
+            slug="timed-post",
+            author=self.user,
+            content="Content",
+            is_published=True,
+        )
+
+    def metrics(self, response):
+        metrics = {}
+        for entry in response["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            metrics[name] = dict(param.split("=", 1) for param in params)
+        return metrics
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_header_and_log_line(self):
+        url = reverse("core:post_detail", kwargs={"slug": "timed-post"})
+        with self.assertLogs("core.server_timing", "INFO") as logs:
+            response = self.client.get(url)
+        metrics = self.metrics(response)
+        self.assertEqual(set(metrics), {"db", "tpl", "cache", "total"})
+        self.assertGreater(float(metrics["tpl"]["dur"]), 0)
+        self.assertGreaterEqual(
+            float(metrics["total"]["dur"]), float(metrics["tpl"]["dur"])
+        )
+        self.assertNotEqual(metrics["db"]["desc"], '"0 queries"')
+
+        record = logs.records[0]
+        self.assertIn("view=core:post_detail method=GET status=200", logs.output[0])
+        self.assertEqual(record.server_timing["view"], "core:post_detail")
+        self.assertGreater(record.server_timing["queries"], 0)
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_counts_cache_hits_and_misses(self):
+        url = reverse("core:post_detail", kwargs={"slug": "timed-post"})
+        with self.assertLogs("core.server_timing", "INFO") as logs:
+            self.client.get(url)
+            response = self.client.get(url)
+        first, second = (record.server_timing for record in logs.records)
+        self.assertGreater(first["cache_misses"], 0)
+        # The second request is served from the page cache
+        self.assertGreater(second["cache_hits"], 0)
+        self.assertEqual(second["queries"], 0)
+        self.assertEqual(second["template_ms"], 0)
+        self.assertIn('desc="0 queries"', response["Server-Timing"])
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_can_be_disabled(self):
+        with self.assertLogs("core.server_timing", "INFO"):
+            response = self.client.get(reverse("core:home"))
+        self.assertNotIn("Server-Timing", response)
+
+
+class TestRelatedPosts(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.python = Tag.objects.create(name="Python", slug="python")
+        self.django = Tag.objects.create(name="Django", slug="django")
+        self.base = self.create(
+            "base", "Django querysets are lazy and cache results", [self.python]
+        )
+        self.close = self.create(
+            "close",
+            "Lazy querysets cache results in Django",
+            [self.python, self.django],
+        )
+        self.loose = self.create("loose", "Python packaging basics", [self.python])
+        self.unrelated = self.create("unrelated", "Gardening during spring", [])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "corpus.npz")
+        corpus_path = override_settings(RELATED_POSTS_CORPUS_PATH=path)
+        corpus_path.enable()
+        self.addCleanup(corpus_path.disable)
+
+    def create(self, slug, content, tags, **kwargs):
+        kwargs.setdefault("is_published", True)
+        post = Post.objects.create(
+            title=slug.title(), slug=slug, author=self.user, content=content, **kwargs
+        )
+        post.tags.set(tags)
+        return post
+
+    def related(self, post):
+        return list(post.related_entries.values_list("related__slug", flat=True))
+
+    def test_rebuild_ranks_by_tags_and_text(self):
+        self.assertEqual(rebuild_related_posts(), 4)
+        self.assertEqual(self.related(self.base), ["close", "loose"])
+        self.assertEqual(self.related(self.unrelated), [])
+
+    def test_detail_reads_precomputed_entries(self):
+        rebuild_related_posts()
+        response = self.client.get(reverse("core:post_detail", kwargs={"slug": "base"}))
+        self.assertEqual(response.context["related_posts"], [self.close, self.loose])
+        # Only what the sidebar shows, not the post bodies
+        for related in response.context["related_posts"]:
+            self.assertIn("content", related.get_deferred_fields())
+
+    def test_incremental_update(self):
+        rebuild_related_posts(k=1)
+        self.assertEqual(self.related(self.loose), ["base"])
+
+        twin = self.create("twin", "Python packaging basics explained", [self.python])
+        self.assertEqual(update_related_posts(k=1), 2)
+        self.assertEqual(self.related(self.loose), ["twin"])
+        self.assertEqual(self.related(twin), ["loose"])
+
+        twin.is_published = False
+        twin.save()
+        update_related_posts(k=1)
+        self.assertEqual(self.related(self.loose), ["base"])
+        self.assertEqual(self.related(twin), [])
+
+    def test_deleted_posts_are_dropped(self):
+        rebuild_related_posts(k=1)
+        self.assertEqual(self.related(self.base), ["close"])
+
+        self.close.delete()
+        self.assertEqual(update_related_posts(k=1), 2)
+        self.assertEqual(self.related(self.base), ["loose"])
+        self.assertFalse(RelatedPost.objects.filter(post_id=self.close.pk).exists())
+
+    def test_tag_changes_are_picked_up(self):
+        rebuild_related_posts(k=1)
+        self.loose.tags.add(self.django)
+        update_related_posts(k=1)
+        self.assertEqual(self.related(self.loose), ["close"])
+
+        self.django.delete()
+        update_related_posts(k=1)
+        self.assertEqual(self.related(self.loose), ["base"])
+
+    def test_missing_corpus_falls_back_to_a_rebuild(self):
+        rebuild_related_posts(k=1)
+        os.remove(settings.RELATED_POSTS_CORPUS_PATH)
+        self.create("twin", "Python packaging basics explained", [self.python])
+        self.assertEqual(update_related_posts(k=1), 5)
+        self.assertEqual(self.related(self.loose), ["twin"])
+
+    def test_command(self):
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("update_related_posts", "--full", stdout=out)
+        self.assertIn("Updated related posts for 4 posts", out.getvalue())
+
+
+class TestDatasetGenerator(TestCase):
+    sizes = {"users": 12, "categories": 3, "tags": 20, "posts": 45, "comments": 300}
+
+    def generate(self, **kwargs):
+        generate_dataset(
+            **self.sizes, seed=7, chunk_size=10, words_per_post=30, **kwargs
+        )
+        return (
+            list(Post.objects.order_by("pk").values_list("slug", "author_id")),
+            list(Post.tags.through.objects.order_by("pk").values_list("tag_id")),
+            list(Comment.objects.order_by("pk").values_list("path", "author_id")),
+        )
+
+    def test_generates_requested_sizes(self):
+        self.generate()
+        self.assertEqual(User.objects.count(), 12)
+        self.assertEqual(Profile.objects.count(), 12)
+        self.assertEqual(Tag.objects.count(), 20)
+        self.assertEqual(Post.objects.count(), 45)
+        self.assertEqual(Comment.objects.count(), 300)
+
+    def test_threads_and_counters_are_consistent(self):
+        self.generate()
+        for comment in Comment.objects.exclude(parent=None).select_related("parent"):
+            self.assertTrue(comment.path.startswith(comment.parent.path + "/"))
+            self.assertEqual(comment.post_id, comment.parent.post_id)
+            self.assertGreaterEqual(comment.created_at, comment.parent.created_at)
+        post = Post.objects.order_by("-comment_count").first()
+        self.assertEqual(
+            post.comment_count, post.comments.filter(is_approved=True).count()
+        )
+        tag = Tag.objects.order_by("pk").first()
+        self.assertEqual(tag.post_count, tag.posts.filter(is_published=True).count())
+
+    def test_output_is_deterministic(self):
+        first = self.generate(index=False)
+        for model in (Comment, Post, Tag, Category, Profile, User):
+            model.objects.all().delete()
+        self.assertEqual(self.generate(index=False, workers=2), first)
+
+
+class TestBenchmark(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        category = Category.objects.create(name="Tech", slug="tech")
+        Post.objects.create(
+            title="Benchmarking Django views",
+            slug="benchmarking",
+            author=self.user,
+            category=category,
+            content="Content",
+            is_published=True,
+        )
+
+    def test_every_route_has_a_scenario(self):
+        self.assertEqual(set(build_scenarios()), set(route_names()))
+
+    def test_runs_every_route_through_wsgi_and_asgi(self):
+        results = run_benchmark(requests_per_route=2, auth_ratio=0.5)
+        self.assertEqual(set(results), {"wsgi", "asgi"})
+        for routes in results.values():
+            self.assertEqual(set(routes), set(route_names()))
+            for result in routes.values():
+                self.assertEqual(result["requests"], 2)
+                self.assertEqual(result["errors"], 0)
+                self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            # Logged-in requests always reach the view and its queries
+            self.assertGreater(routes["core:profile"]["queries"], 0)
+        self.assertEqual(Comment.objects.filter(author=self.user).count(), 6)
+
+    def test_asgi_runs_are_served_by_the_async_views(self):
+        served = []
+        async_home = views.async_home
+
+        async def home(request):
+            served.append(request.path)
+            return await async_home(request)
+
+        self.addCleanup(reload_urls)
+        with patch("core.views.async_home", home):
+            run_benchmark(
+                interfaces=("wsgi", "asgi"),
+                routes=["core:home"],
+                requests_per_route=2,
+                warmup=0,
+            )
+        self.assertEqual(served, ["/", "/"])
+        # The URLconf is back to the views of the settings
+        self.assertFalse(iscoroutinefunction(resolve("/").func))
+
+    @override_settings(
+        PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+    )
+    def test_auth_benchmark_logs_in_and_registers(self):
+        results = run_auth_benchmark(requests=2)
+        self.assertEqual(set(results), {"wsgi", "asgi"})
+        for routes in results.values():
+            self.assertEqual(set(routes), {"core:login", "core:register"})
+            for result in routes.values():
+                self.assertEqual(result["errors"], 0)
+                self.assertEqual(result["hasher"], "md5")
+                self.assertGreater(result["cpu_throughput"], 0)
+        # Two measured and one warm-up registration per interface
+        self.assertEqual(
+            User.objects.filter(username__startswith="benchmark-0-").count(), 6
+        )
+
+    def test_compare_reports_regressions_beyond_threshold(self):
+        base = {"p95_ms": 10.0, "queries": 4.0, "errors": 0}
+        baseline = {"wsgi": {"core:home": base}}
+        within = dict(base, p95_ms=12.0, queries=4.4)
+        self.assertEqual(compare({"wsgi": {"core:home": within}}, baseline), [])
+        slower = dict(base, p95_ms=13.0, queries=6.0)
+        regressions = compare({"wsgi": {"core:home": slower}}, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("p95 13.00ms", regressions[0])
+        # Routes missing from the baseline are not compared
+        self.assertEqual(compare({"asgi": {"core:home": slower}}, baseline), [])
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.category = Category.objects.create(name="Paged", slug="paged")
+        now = timezone.now()
+        for i in range(25):
+            Post.objects.create(
+                title=f"Paged Post {i}",
+                slug=f"paged-post-{i}",
+                author=self.user,
+                category=self.category,
+                content="Body",
+                is_published=True,
+                # Pairs of posts share a timestamp to exercise the pk tiebreak
+                published_at=now - timezone.timedelta(minutes=i // 2),
+            )
+        self.expected = list(
+            Post.objects.filter(is_published=True).order_by("-published_at", "-pk")
+        )
+
+    def paginator(self):
+        return CursorPaginator(Post.objects.filter(is_published=True), 10)
+
+    def test_walk_forward_and_back(self):
+        paginator = self.paginator()
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([post for page in pages for post in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+
+        previous = paginator.page(pages[2].previous_cursor)
+        self.assertEqual(list(previous), list(pages[1]))
+        first = paginator.page(previous.previous_cursor)
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+
+    def test_deep_pages_do_not_count(self):
+        paginator = self.paginator()
+        page = paginator.page(paginator.page().next_cursor)
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(page.next_cursor)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("COUNT", queries[0]["sql"])
+        self.assertNotIn("OFFSET", queries[0]["sql"])
+
+    def test_invalid_cursor(self):
+        paginator = self.paginator()
+        with self.assertRaises(InvalidCursor):
+            paginator.page("not-a-cursor")
+        self.assertEqual(list(paginator.get_page("not-a-cursor")), self.expected[:10])
+
+    def test_null_cursor_values(self):
+        for payload in ({"p": [None, 5], "r": False}, {"p": [None, 5], "r": True}):
+            cursor = encode_cursor(payload)
+            for url in (
+                reverse("core:post_list"),
+                reverse("core:category_detail", kwargs={"slug": "paged"}),
+            ):
+                self.assertEqual(
+                    self.client.get(url, {"cursor": cursor}).status_code, 200
+                )
+        with self.assertRaises(InvalidCursor):
+            self.paginator().page(encode_cursor({"p": [None, None], "r": False}))
+
+    def test_walk_over_null_sort_keys(self):
+        # e.g. after a queryset update() that bypassed Post.save()
+        Post.objects.filter(slug__in=["paged-post-3", "paged-post-8"]).update(
+            published_at=None
+        )
+        expected = list(
+            Post.objects.filter(is_published=True).order_by("-published_at", "-pk")
+        )
+        paginator = CursorPaginator(Post.objects.filter(is_published=True), 4)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([post for page in pages for post in page], expected)
+
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.page(backwards[-1].previous_cursor))
+        self.assertEqual(
+            [list(page) for page in reversed(backwards)], [list(page) for page in pages]
+        )
+
+    def test_post_list_links_to_next_page(self):
+        response = self.client.get(reverse("core:post_list"))
+        page = response.context["page_obj"]
+        self.assertContains(response, f"?cursor={page.next_cursor}")
+
+        response = self.client.get(
+            reverse("core:post_list"), {"cursor": page.next_cursor}
+        )
+        self.assertEqual(list(response.context["posts"]), self.expected[10:20])
+
+    def test_search_keeps_query_in_links(self):
+        response = self.client.get(reverse("core:search"), {"q": "Paged"})
+        self.assertContains(response, "q=Paged&amp;cursor=")
+        self.assertIsNone(response.context["total_results"])
+
+    def test_category_page_uses_materialized_count(self):
+        response = self.client.get(
+            reverse("core:category_detail", kwargs={"slug": "paged"})
+        )
+        self.assertContains(response, "25 posts")
+
+
+class TestSearchBackends(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.body_match = Post.objects.create(
+            title="Deployment notes",
+            slug="deployment-notes",
+            author=self.user,
+            content="We also touch on caching strategies here.",
+            is_published=True,
+        )
+        self.title_match = Post.objects.create(
+            title="Caching strategies",
+            slug="caching-strategies",
+            author=self.user,
+            content="All about it.",
+            is_published=True,
+        )
+        self.draft = Post.objects.create(
+            title="Caching draft",
+            slug="caching-draft",
+            author=self.user,
+            content="Not yet.",
+            is_published=False,
+        )
+
+    def test_sqlite_uses_fts(self):
+        self.assertIsInstance(get_search_backend(), SQLiteFTSBackend)
+
+    def test_results_are_ranked_and_published_only(self):
+        results = SQLiteFTSBackend().search("caching", 10)
+        self.assertEqual(results, [self.title_match, self.body_match])
+
+    def test_index_follows_saves_and_deletes(self):
+        backend = SQLiteFTSBackend()
+        self.title_match.title = "Queueing strategies"
+        self.title_match.save()
+        self.assertEqual(backend.search("queueing", 10), [self.title_match])
+
+        self.draft.is_published = True
+        self.draft.save()
+        self.assertIn(self.draft, backend.search("draft", 10))
+
+        self.body_match.delete()
+        self.assertEqual(backend.search("deployment", 10), [])
+
+    def test_query_syntax_is_escaped(self):
+        backend = SQLiteFTSBackend()
+        self.assertEqual(
+            backend.search('caching" (*', 10), backend.search("caching", 10)
+        )
+        self.assertEqual(backend.search("***", 10), [])
+
+    def test_rebuild_command(self):
+        from django.core.management import call_command
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM core_post_fts")
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(SQLiteFTSBackend().search("caching", 10)), 2)
+
+    def test_database_backend_matches_substrings(self):
+        results = DatabaseSearchBackend().search("strateg", 10)
+        self.assertCountEqual(results, [self.title_match, self.body_match])
+
+    def test_search_view_renders_ranked_results(self):
+        response = self.client.get(reverse("core:search"), {"q": "caching"})
+        self.assertEqual(
+            list(response.context["posts"]), [self.title_match, self.body_match]
+        )
+        self.assertEqual(response.context["total_results"], 2)
+
+
+class TestInvertedIndex(TestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, {"title": "Deployment notes", "content": "caching here"})
+        self.index.add(2, {"title": "Caching strategies", "content": "All about it"})
+        self.index.add(
+            3,
+            {"title": "Gardening", "tags": "caching", "content": "soil and seeds"},
+        )
+
+    def test_bm25_prefers_title_matches(self):
+        self.assertEqual(self.index.search("caching", 10)[0], 2)
+        self.assertEqual(self.index.search("caching", 1, offset=1), [3])
+        self.assertEqual(self.index.search("nothing", 10), [])
+
+    def test_incremental_updates(self):
+        self.index.add(2, {"title": "Queueing strategies"})
+        self.index.remove(3)
+        self.assertEqual(self.index.search("caching", 10), [1])
+        self.assertEqual(self.index.search("queueing", 10), [2])
+        self.assertEqual(len(self.index), 2)
+
+    def test_snapshot_lookups_use_the_mapped_arrays(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.bin")
+            self.index.add(10, {"title": "Ünïcode naïve café"})
+            self.index.save(path)
+            snapshot = Snapshot(path)
+            self.assertEqual(list(snapshot.post_ids), [1, 2, 3, 10])
+            self.assertEqual(snapshot.docno(3), 2)
+            self.assertIsNone(snapshot.docno(4))
+            self.assertEqual(len(snapshot.postings("café")[0]), 1)
+            self.assertEqual(snapshot.postings("coffee"), ((), ()))
+
+            loaded = InvertedIndex(snapshot)
+            self.assertEqual(len(loaded), 4)
+            self.assertIn(10, loaded)
+            self.assertEqual(loaded._delta_docs, {})
+            self.assertEqual(loaded.search("naïve", 10), [10])
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.bin")
+            self.index.remove(1)
+            self.assertEqual(self.index.save(path), 2)
+
+            loaded = InvertedIndex.load(path)
+            self.assertEqual(
+                loaded.search("caching", 10), self.index.search("caching", 10)
+            )
+            loaded.add(4, {"title": "Caching caching"})
+            loaded.remove(2)
+            self.assertEqual(loaded.search("caching", 10), [4, 3])
+
+
+class TestInMemorySearchBackend(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "index.bin")
+        self.user = User.objects.create_user(username="writer", password="pass12345")
+        self.post = Post.objects.create(
+            title="Caching strategies",
+            slug="caching-strategies",
+            author=self.user,
+            content="All about it.",
+            is_published=True,
+        )
+
+    def test_signals_keep_index_current(self):
+        with override_settings(
+            SEARCH_BACKEND="core.search.InMemorySearchBackend",
+            SEARCH_INDEX_PATH=self.path,
+        ):
+            reset_search_backend()
+            self.addCleanup(reset_search_backend)
+            backend = get_search_backend()
+            backend.rebuild()
+            self.assertEqual(backend.search("caching", 10), [self.post])
+
+            tag = Tag.objects.create(name="Performance", slug="performance")
+            self.post.tags.add(tag)
+            self.assertEqual(backend.search("performance", 10), [self.post])
+
+            self.post.is_published = False
+            self.post.save()
+            self.assertEqual(backend.search("caching", 10), [])
+
+    def test_rebuild_writes_snapshot(self):
+        backend = InMemorySearchBackend(self.path)
+        self.assertEqual(backend.rebuild(), 1)
+        self.assertTrue(os.path.exists(self.path))
+
+        warmed = InMemorySearchBackend(self.path)
+        warmed.warm()
+        with self.assertNumQueries(1):
+            self.assertEqual(warmed.search("caching", 10), [self.post])
+
+    def test_other_processes_replay_changes(self):
+        with override_settings(
+            SEARCH_BACKEND="core.search.InMemorySearchBackend",
+            SEARCH_INDEX_PATH=self.path,
+        ):
+            reset_search_backend()
+            self.addCleanup(reset_search_backend)
+            get_search_backend().rebuild()
+            # Another worker mapping the same snapshot
+            other = InMemorySearchBackend(self.path)
+            self.assertEqual(other.search("caching", 10), [self.post])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post.title = "Queueing strategies"
+                self.post.save()
+            self.assertEqual(other.search("queueing", 10), [self.post])
+            self.assertEqual(other.search("caching", 10), [])
+
+            # A snapshot written now already contains the change
+            get_search_backend().rebuild()
+            fresh = InMemorySearchBackend(self.path)
+            with self.assertNumQueries(1):
+                self.assertEqual(fresh.search("queueing", 10), [self.post])
+
+    def test_requests_never_build_the_index(self):
+        from django.core.management import call_command
+
+        backend = InMemorySearchBackend(self.path)
+        # Served by the database until the command writes a snapshot
+        with self.assertLogs("core.search", "WARNING"):
+            self.assertEqual(backend.search("caching", 10), [self.post])
+        self.assertEqual(backend.search("caching", 10), [self.post])
+        self.assertFalse(os.path.exists(self.path))
+
+        with override_settings(
+            SEARCH_BACKEND="core.search.InMemorySearchBackend",
+            SEARCH_INDEX_PATH=self.path,
+        ):
+            reset_search_backend()
+            self.addCleanup(reset_search_backend)
+            call_command("rebuild_search_index", stdout=StringIO())
+        other = InMemorySearchBackend(self.path)
+        with self.assertNumQueries(1):
+            self.assertEqual(other.search("caching", 10), [self.post])
+
+    def test_search_view_uses_setting(self):
+        with override_settings(
+            SEARCH_BACKEND="core.search.InMemorySearchBackend",
+            SEARCH_INDEX_PATH=self.path,
+        ):
+            reset_search_backend()
+            self.addCleanup(reset_search_backend)
+            response = self.client.get(reverse("core:search"), {"q": "strategies"})
+            self.assertIsInstance(get_search_backend(), InMemorySearchBackend)
+        self.assertEqual(list(response.context["posts"]), [self.post])
+
+
 class TestForms(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -168,7 +2504,7 @@ class TestForms(TestCase):
         )
 
     def test_profile_form_valid(self):
-        profile = Profile.objects.create(user=self.user)
+        profile = self.user.profile
         form_data = {
             "bio": "Updated bio",
             "location": "Updated location",
@@ -290,6 +2626,7 @@ class TestAdminFunctionality(TestCase):
 
         admin_site = AdminSite()
         admin_instance = CategoryAdmin(Category, admin_site)
+        self.category.refresh_from_db()
         result = admin_instance.post_count(self.category)
         self.assertEqual(result, 1)
 
@@ -302,6 +2639,7 @@ class TestAdminFunctionality(TestCase):
         self.post.tags.add(tag)
         admin_site = AdminSite()
         admin_instance = TagAdmin(Tag, admin_site)
+        tag.refresh_from_db()
         result = admin_instance.post_count(tag)
         self.assertEqual(result, 1)
 
@@ -342,7 +2680,7 @@ class TestFormValidation(TestCase):
         )
 
     def test_profile_form_initialization(self):
-        profile = Profile.objects.create(user=self.user)
+        profile = self.user.profile
         self.user.first_name = "John"
         self.user.last_name = "Doe"
         self.user.email = "john@example.com"
@@ -354,7 +2692,7 @@ class TestFormValidation(TestCase):
         self.assertEqual(form.fields["email"].initial, "john@example.com")
 
     def test_profile_form_save(self):
-        profile = Profile.objects.create(user=self.user)
+        profile = self.user.profile
         form_data = {
             "bio": "Updated bio",
             "location": "New York",
@@ -386,7 +2724,7 @@ class TestModelMethods(TestCase):
         )
 
     def test_profile_get_absolute_url(self):
-        profile = Profile.objects.create(user=self.user)
+        profile = self.user.profile
         with self.assertRaises(Exception):  # noqa: B017
             # This will raise NoReverseMatch since profile_detail URL doesn't exist
             profile.get_absolute_url()
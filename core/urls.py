@@ -1,23 +1,59 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
+from .query_budget import declare_budgets
 
 app_name = "core"
 
+# Async read views under ASGI, sync ones under WSGI (see core.views)
+if getattr(settings, "ASYNC_VIEWS", False):
+    home = views.async_home
+    PostListView = views.AsyncPostListView
+    PostDetailView = views.AsyncPostDetailView
+    CategoryDetailView = views.AsyncCategoryDetailView
+else:
+    home = views.home
+    PostListView = views.PostListView
+    PostDetailView = views.PostDetailView
+    CategoryDetailView = views.CategoryDetailView
+
 urlpatterns = [
-    path("", views.home, name="home"),
-    path("posts/", views.PostListView.as_view(), name="post_list"),
-    path("post/<slug:slug>/", views.PostDetailView.as_view(), name="post_detail"),
+    path("", home, name="home"),
+    path("posts/", PostListView.as_view(), name="post_list"),
+    path("post/<slug:slug>/", PostDetailView.as_view(), name="post_detail"),
     path(
         "category/<slug:slug>/",
-        views.CategoryDetailView.as_view(),
+        CategoryDetailView.as_view(),
         name="category_detail",
     ),
     path("search/", views.search_posts, name="search"),
     path("comment/<slug:post_slug>/", views.add_comment, name="add_comment"),
+    path("comment/status/<int:pk>/", views.comment_status, name="comment_status"),
     path("profile/", views.profile_view, name="profile"),
     path("profile/edit/", views.edit_profile, name="edit_profile"),
     path("register/", views.register_view, name="register"),
     path("login/", views.login_view, name="login"),
     path("logout/", views.logout_view, name="logout"),
 ]
+
+# Maximum SQL queries per request, including session and user lookups and an
+# occasional view count flush and the conditional GET validators. Enforced in
+# tests, logged in production.
+declare_budgets(
+    app_name,
+    {
+        "home": 8,
+        "post_list": 6,
+        "post_detail": 10,
+        "category_detail": 7,
+        "search": 5,
+        "add_comment": 10,
+        "comment_status": 4,
+        "profile": 8,
+        "edit_profile": 8,
+        "register": 10,
+        "login": 12,
+        "logout": 6,
+    },
+)
@@ -0,0 +1,284 @@
+"""
+Bulk import of user accounts and their profiles.
+
+``import_users()`` (``manage.py import_users``) streams a CSV file with a
+header row or an NDJSON file with one object per line, and creates ``User``
+and ``Profile`` rows with ``bulk_create``, one transaction per chunk.
+Records have a ``username`` and optionally ``email``, ``first_name``,
+``last_name``, the profile fields ``bio``, ``location``, ``website`` and
+``phone``, and either a plaintext ``password`` or a ``password_hash``
+already encoded by one of ``PASSWORD_HASHERS``; accounts with neither get an
+unusable password. Invalid records are reported and skipped.
+
+Hashing plaintext passwords dominates the run, so with ``workers > 1`` the
+chunks are hashed in a pool of worker processes while this process keeps
+reading, checking and inserting; only this process touches the database.
+Usernames that already exist are skipped before anything is hashed, so an
+interrupted import resumes by running it again on the same file, at the
+cost of one lookup per chunk that was already committed.
+"""
+
+import csv
+import json
+import multiprocessing
+import os
+from collections import deque
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+from django.contrib.auth.models import User, UserManager
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+
+from .models import Profile
+
+PROFILE_FIELDS = ("bio", "location", "website", "phone")
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+CHUNK_SIZE = 1000
+
+
+class UserImportError(Exception):
+    pass
+
+
+class ImportedAccount:
+    """
+    A validated record: ``password`` is plaintext to hash, or None when
+    ``encoded`` already holds the stored value
+    """
+
+    __slots__ = ("line", "user", "profile", "password", "encoded")
+
+    def __init__(self, line, user, profile, password, encoded):
+        self.line = line
+        self.user = user
+        self.profile = profile
+        self.password = password
+        self.encoded = encoded
+
+
+def detect_format(path):
+    format_ = FORMATS.get(os.path.splitext(path)[1].lower())
+    if format_ is None:
+        raise UserImportError(
+            f"Cannot tell the format of {path}; use .csv, .ndjson or .jsonl"
+        )
+    return format_
+
+
+def read_records(handle, format_):
+    """
+    Yield ``(line number, record)`` pairs from an open text file; records
+    that cannot be decoded are yielded as the exception
+    """
+    if format_ == "csv":
+        reader = csv.DictReader(handle)
+        if reader.fieldnames is None or "username" not in reader.fieldnames:
+            raise UserImportError("The CSV header has no username column")
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(handle, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            record = error
+        yield number, record
+
+
+def describe(error):
+    if hasattr(error, "error_dict"):
+        return "; ".join(
+            f"{field}: {' '.join(messages)}"
+            for field, messages in error.message_dict.items()
+        )
+    return " ".join(error.messages)
+
+
+def _text(record, name):
+    value = record.get(name)
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def parse_record(line, record):
+    """
+    Validate ``record`` and return an ImportedAccount; raise
+    ValidationError when it cannot be imported
+    """
+    if isinstance(record, Exception):
+        raise ValidationError(f"Not valid JSON: {record}")
+    if not isinstance(record, dict):
+        raise ValidationError("Expected an object")
+
+    user = User(
+        username=User.normalize_username(_text(record, "username")),
+        email=UserManager.normalize_email(_text(record, "email")),
+        first_name=_text(record, "first_name"),
+        last_name=_text(record, "last_name"),
+    )
+    user.clean_fields(exclude=["password", "last_login", "date_joined"])
+    profile = {name: _text(record, name) for name in PROFILE_FIELDS}
+    Profile(**profile).clean_fields(exclude=["user", "avatar"])
+
+    password, encoded = _text(record, "password"), _text(record, "password_hash")
+    if password and encoded:
+        raise ValidationError("Give either password or password_hash, not both")
+    if encoded:
+        try:
+            identify_hasher(encoded)
+        except ValueError:
+            raise ValidationError("password_hash uses no configured hasher") from None
+        return ImportedAccount(line, user, profile, None, encoded)
+    if not password:
+        return ImportedAccount(line, user, profile, None, make_password(None))
+    return ImportedAccount(line, user, profile, password, None)
+
+
+def hash_passwords(passwords, hasher="default"):
+    """
+    Encode plaintext ``passwords`` with ``hasher`` (the preferred one by
+    default); runs in the worker processes
+    """
+    return [make_password(password, hasher=hasher) for password in passwords]
+
+
+def existing_usernames(usernames):
+    return set(
+        User.objects.filter(username__in=usernames).values_list("username", flat=True)
+    )
+
+
+def insert_accounts(accounts):
+    """
+    Create the users and profiles of ``accounts`` (hashed) in one
+    transaction and return how many were created
+    """
+    users = [account.user for account in accounts]
+    for user, account in zip(users, accounts):
+        user.password = account.encoded
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            ids = dict(
+                User.objects.filter(
+                    username__in=[user.username for user in users]
+                ).values_list("username", "pk")
+            )
+            for user in users:
+                user.pk = ids[user.username]
+        Profile.objects.bulk_create(
+            [
+                Profile(user_id=user.pk, **account.profile)
+                for user, account in zip(users, accounts)
+            ]
+        )
+    return len(users)
+
+
+class Importer:
+    """
+    State of one import run
+    """
+
+    def __init__(self, chunk_size, workers, log):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.log = log
+        self.stats = {"created": 0, "existing": 0, "duplicate": 0, "invalid": 0}
+        self.errors = []
+        # Usernames queued in this run, so repeats in the file are caught
+        # before their first occurrence has been committed
+        self.queued = set()
+
+    def prepare(self, records):
+        """
+        Validate a chunk of records and return the accounts to create
+        """
+        accounts = []
+        for line, record in records:
+            try:
+                account = parse_record(line, record)
+            except ValidationError as error:
+                self.stats["invalid"] += 1
+                self.errors.append((line, describe(error)))
+                continue
+            if account.user.username in self.queued:
+                self.stats["duplicate"] += 1
+                continue
+            self.queued.add(account.user.username)
+            accounts.append(account)
+        existing = existing_usernames([account.user.username for account in accounts])
+        self.stats["existing"] += len(existing)
+        return [
+            account for account in accounts if account.user.username not in existing
+        ]
+
+    def finish(self, accounts, hashes):
+        plain = (account for account in accounts if account.password is not None)
+        for account, encoded in zip(plain, hashes):
+            account.encoded = encoded
+            account.password = None
+        try:
+            created = insert_accounts(accounts)
+        except IntegrityError:
+            # Someone registered one of these usernames meanwhile
+            existing = existing_usernames(
+                [account.user.username for account in accounts]
+            )
+            self.stats["existing"] += len(existing)
+            accounts = [
+                account for account in accounts if account.user.username not in existing
+            ]
+            created = insert_accounts(accounts)
+        self.stats["created"] += created
+        self.log(f"Created {self.stats['created']} accounts")
+
+    def run(self, records):
+        chunks = iter(lambda: list(islice(records, self.chunk_size)), [])
+        if self.workers <= 1:
+            for chunk in chunks:
+                accounts = self.prepare(chunk)
+                self.finish(
+                    accounts,
+                    hash_passwords(
+                        [a.password for a in accounts if a.password is not None]
+                    ),
+                )
+            return
+
+        # Only picklable values cross to the workers, so any start method
+        # works. Spawned interpreters set Django up from DJANGO_SETTINGS_MODULE
+        # before hashing, and get this process's hasher rather than their own
+        hasher = get_hasher()
+        with multiprocessing.Pool(self.workers, initializer=django.setup) as pool:
+            pending = deque()
+            for chunk in chunks:
+                accounts = self.prepare(chunk)
+                passwords = [a.password for a in accounts if a.password is not None]
+                pending.append(
+                    (accounts, pool.apply_async(hash_passwords, (passwords, hasher)))
+                )
+                # Keep every worker busy without reading the whole file
+                if len(pending) > self.workers:
+                    accounts, result = pending.popleft()
+                    self.finish(accounts, result.get())
+            while pending:
+                accounts, result = pending.popleft()
+                self.finish(accounts, result.get())
+
+
+def import_users(path, format_=None, chunk_size=CHUNK_SIZE, workers=1, log=None):
+    """
+    Import the accounts in the file at ``path`` and return ``(stats,
+    errors)``: counts of created, existing, duplicate and invalid records,
+    and ``(line, message)`` for every invalid one
+    """
+    importer = Importer(chunk_size, workers, log or (lambda message: None))
+    with open(path, newline="", encoding="utf-8") as handle:
+        importer.run(read_records(handle, format_ or detect_format(path)))
+    return importer.stats, importer.errors
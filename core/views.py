@@ -1,44 +1,140 @@
+from asgiref.sync import sync_to_async
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
-from django.core.paginator import Paginator
-from django.db.models import Count, Q
+from django.db import transaction
+from django.db.models import Count
 from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, redirect, render
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_http_methods
 from django.views.generic import DetailView, ListView
 
+from .comment_queue import enqueue_comment
+from .conditional import conditional_page, newest
+from .counters import view_counter
 from .forms import CommentForm, ProfileForm
-from .models import Category, Post, Profile
+from .models import (
+    Category,
+    Comment,
+    PendingComment,
+    Post,
+    Profile,
+    Tag,
+    build_comment_tree,
+)
+from .page_cache import add_page_tags, cache_anonymous_page
+from .pagination import CursorPaginator, RankedPaginator
+from .search import get_search_backend
+
+# All the sidebar shows of a related post
+RELATED_CARD_FIELDS = (
+    "related__slug",
+    "related__title",
+    "related__published_at",
+    "related__views_count",
+)
+
+
+async def evaluate(queryset):
+    """
+    Fetch ``queryset`` through the async ORM
+    """
+    return [obj async for obj in queryset]
+
+
+async def render_async(request, template_name, context):
+    # Templates may still read request.user or lazy relations, which the
+    # ORM only allows outside the event loop
+    return await sync_to_async(render)(request, template_name, context)
+
+
+# Validators for conditional GETs: what each page shows, reduced to single
+# values (see core.conditional)
+
+
+def listing_validators(request, *args, **kwargs):  # noqa: ARG001
+    return [
+        newest(Post.objects.filter(is_published=True)),
+        newest(Comment.objects.all()),
+        newest(Category.objects.all()),
+        newest(Tag.objects.all()),
+    ]
+
+
+def post_validators(request, slug):  # noqa: ARG001
+    post = Post.objects.filter(slug=slug)
+    return [
+        newest(post),
+        post.values_list("comment_count")[:1],
+        newest(Comment.objects.filter(post__slug=slug)),
+        newest(Category.objects.filter(posts__slug=slug)),
+        newest(Profile.objects.filter(user__posts__slug=slug)),
+        newest(Tag.objects.filter(posts__slug=slug)),
+        # Removing a tag leaves every updated_at alone
+        Post.tags.through.objects.filter(post__slug=slug)
+        .order_by()
+        .values("post_id")
+        .annotate(count=Count("pk"))
+        .values_list("count"),
+    ]
+
+
+def counts_view(request, response):
+    # Counted after dispatch rather than in get() so page cache hits and 304s
+    # are counted too, but only for posts that exist
+    return request.method == "GET" and response.status_code in (200, 304)
+
+
+# The read views below come in pairs: sync ones served under WSGI, and async
+# ones (ASYNC_VIEWS, on under myproject/asgi.py) that keep ASGI requests off
+# the thread pool. Either kind under the other interface costs a thread hop.
+
+
+def home_querysets():
+    published = Post.objects.filter(is_published=True)
+    return {
+        "featured_posts": published.cards(tags=False)[:6],
+        "recent_posts": published.cards(tags=False)[:5],
+        "active_posts": (
+            published.filter(last_comment_at__isnull=False)
+            .order_by("-last_comment_at")
+            .cards(tags=False)[:5]
+        ),
+        "categories": Category.objects.filter(is_active=True),
+    }
 
 
+@cache_anonymous_page("posts", "categories", "comments")
+@conditional_page(listing_validators, "posts", "categories", "comments")
 def home(request):
     """
     Homepage view with featured posts
     """
-    featured_posts = (
-        Post.objects.filter(is_published=True)
-        .select_related("author", "category")
-        .prefetch_related("tags")[:6]
-    )
+    context = {name: list(queryset) for name, queryset in home_querysets().items()}
+    return render(request, "core/home.html", context)
 
-    recent_posts = Post.objects.filter(is_published=True).select_related(
-        "author", "category"
-    )[:5]
-
-    categories = Category.objects.filter(is_active=True).annotate(
-        post_count=Count("posts")
-    )
 
+@cache_anonymous_page("posts", "categories", "comments")
+@conditional_page(listing_validators, "posts", "categories", "comments")
+async def async_home(request):
+    """
+    ``home`` through the async ORM
+    """
+    # Awaited one by one: the async ORM runs all queries of a request on the
+    # same thread, so gathering them would not overlap anything
     context = {
-        "featured_posts": featured_posts,
-        "recent_posts": recent_posts,
-        "categories": categories,
+        name: await evaluate(queryset) for name, queryset in home_querysets().items()
     }
-    return render(request, "core/home.html", context)
+    return await render_async(request, "core/home.html", context)
 
 
+@method_decorator(cache_anonymous_page("posts", "comments"), name="get")
+@method_decorator(
+    conditional_page(listing_validators, "posts", "comments", "tags"), name="get"
+)
 class PostListView(ListView):
     """
     Class-based view for listing posts with pagination
@@ -50,13 +146,40 @@ class PostListView(ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return (
-            Post.objects.filter(is_published=True)
-            .select_related("author", "category")
-            .prefetch_related("tags")
-        )
-
-
+        return Post.objects.filter(is_published=True).cards()
+
+    def get_page_context(self, paginator, page):
+        self.object_list = page.object_list
+        return {
+            "view": self,
+            "paginator": paginator,
+            "page_obj": page,
+            "is_paginated": page.has_other_pages(),
+            "object_list": page.object_list,
+            "posts": page.object_list,
+        }
+
+    def get(self, request, *args, **kwargs):
+        paginator = CursorPaginator(self.get_queryset(), self.paginate_by)
+        page = paginator.get_page(request.GET.get("cursor"))
+        context = self.get_page_context(paginator, page)
+        return render(request, self.template_name, context)
+
+
+@method_decorator(cache_anonymous_page("posts", "comments"), name="get")
+@method_decorator(
+    conditional_page(listing_validators, "posts", "comments", "tags"), name="get"
+)
+class AsyncPostListView(PostListView):
+    async def get(self, request, *args, **kwargs):
+        paginator = CursorPaginator(self.get_queryset(), self.paginate_by)
+        page = await paginator.aget_page(request.GET.get("cursor"))
+        context = self.get_page_context(paginator, page)
+        return await render_async(request, self.template_name, context)
+
+
+@method_decorator(cache_anonymous_page(), name="get")
+@method_decorator(conditional_page(post_validators), name="get")
 class PostDetailView(DetailView):
     """
     Class-based view for displaying a single post
@@ -66,31 +189,82 @@ class PostDetailView(DetailView):
     template_name = "core/post_detail.html"
     context_object_name = "post"
 
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if counts_view(request, response):
+            view_counter.record(kwargs["slug"])
+        return response
+
     def get_queryset(self):
-        return Post.objects.filter(is_published=True).select_related(
-            "author", "category"
+        return (
+            Post.objects.filter(is_published=True)
+            .select_related("author__profile", "category")
+            .prefetch_related("tags")
+        )
+
+    def get_related_entries(self, post):
+        # Precomputed by manage.py update_related_posts
+        return (
+            post.related_entries.filter(related__is_published=True)
+            .select_related("related")
+            .only(*RELATED_CARD_FIELDS)
         )
 
-    def get_object(self, queryset=None):
-        post = super().get_object(queryset)
-        post.views_count += 1
-        post.save(update_fields=["views_count"])
-        return post
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["comments"] = (
-            self.object.comments.filter(is_approved=True, parent=None)
-            .select_related("author")
-            .prefetch_related("replies")
+    def get_post_context(self, request, post, comments, related_entries):
+        self.object = post
+        add_page_tags(
+            request,
+            f"post:{post.pk}",
+            f"category:{post.category_id}",
+            f"user:{post.author_id}",
+            *(f"tag:{tag.pk}" for tag in post.tags.all()),
+        )
+        return {
+            "view": self,
+            "object": post,
+            "post": post,
+            # The whole thread in one query, nested in memory
+            "comments": build_comment_tree(comments),
+            "comment_form": CommentForm(),
+            "related_posts": [entry.related for entry in related_entries],
+        }
+
+    def get(self, request, *args, **kwargs):
+        post = get_object_or_404(self.get_queryset(), slug=kwargs["slug"])
+        context = self.get_post_context(
+            request,
+            post,
+            list(post.comments.thread()),
+            list(self.get_related_entries(post)),
         )
-        context["comment_form"] = CommentForm()
-        context["related_posts"] = Post.objects.filter(
-            category=self.object.category, is_published=True
-        ).exclude(pk=self.object.pk)[:3]
-        return context
+        return render(request, self.template_name, context)
+
+
+@method_decorator(cache_anonymous_page(), name="get")
+@method_decorator(conditional_page(post_validators), name="get")
+class AsyncPostDetailView(PostDetailView):
+    async def dispatch(self, request, *args, **kwargs):
+        response = await super(PostDetailView, self).dispatch(request, *args, **kwargs)
+        if counts_view(request, response):
+            await sync_to_async(view_counter.record)(kwargs["slug"])
+        return response
+
+    async def get(self, request, *args, **kwargs):
+        post = await aget_object_or_404(self.get_queryset(), slug=kwargs["slug"])
+        context = self.get_post_context(
+            request,
+            post,
+            await evaluate(post.comments.thread()),
+            await evaluate(self.get_related_entries(post)),
+        )
+        return await render_async(request, self.template_name, context)
 
 
+@method_decorator(cache_anonymous_page("tags", "comments"), name="get")
+@method_decorator(
+    conditional_page(listing_validators, "posts", "comments", "tags", "categories"),
+    name="get",
+)
 class CategoryDetailView(DetailView):
     """
     View for displaying posts in a specific category
@@ -100,45 +274,64 @@ class CategoryDetailView(DetailView):
     template_name = "core/category_detail.html"
     context_object_name = "category"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        posts = Post.objects.filter(
-            category=self.object, is_published=True
-        ).select_related("author", "category")
-
-        paginator = Paginator(posts, 10)
-        page_number = self.request.GET.get("page")
-        context["posts"] = paginator.get_page(page_number)
-        return context
-
-
+    def get_posts(self, category):
+        return Post.objects.filter(category=category, is_published=True).cards()
+
+    def get_category_context(self, request, category, posts):
+        self.object = category
+        add_page_tags(request, f"category:{category.pk}")
+        return {
+            "view": self,
+            "object": category,
+            "category": category,
+            "posts": posts,
+        }
+
+    def get(self, request, *args, **kwargs):
+        category = get_object_or_404(Category, slug=kwargs["slug"])
+        paginator = CursorPaginator(self.get_posts(category), 10)
+        posts = paginator.get_page(request.GET.get("cursor"))
+        context = self.get_category_context(request, category, posts)
+        return render(request, self.template_name, context)
+
+
+@method_decorator(cache_anonymous_page("tags", "comments"), name="get")
+@method_decorator(
+    conditional_page(listing_validators, "posts", "comments", "tags", "categories"),
+    name="get",
+)
+class AsyncCategoryDetailView(CategoryDetailView):
+    async def get(self, request, *args, **kwargs):
+        category = await aget_object_or_404(Category, slug=kwargs["slug"])
+        paginator = CursorPaginator(self.get_posts(category), 10)
+        posts = await paginator.aget_page(request.GET.get("cursor"))
+        context = self.get_category_context(request, category, posts)
+        return await render_async(request, self.template_name, context)
+
+
+@cache_anonymous_page("posts", "comments")
 def search_posts(request):
     """
     Search functionality for posts
     """
-    query = request.GET.get("q", "")
-    posts = Post.objects.none()
-
-    if query:
-        posts = (
-            Post.objects.filter(
-                Q(title__icontains=query)
-                | Q(content__icontains=query)
-                | Q(excerpt__icontains=query),
-                is_published=True,
-            )
-            .select_related("author", "category")
-            .distinct()
-        )
+    query = request.GET.get("q", "").strip()
+
+    def fetch(limit, offset):
+        if not query:
+            return []
+        return get_search_backend().search(query, limit, offset)
+
+    posts_page = RankedPaginator(fetch, 10).get_page(request.GET.get("cursor"))
 
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get("page")
-    posts_page = paginator.get_page(page_number)
+    # Only report a total when it is known without a COUNT(*)
+    total_results = None
+    if not posts_page.has_other_pages():
+        total_results = len(posts_page)
 
     context = {
         "posts": posts_page,
         "query": query,
-        "total_results": posts.count() if query else 0,
+        "total_results": total_results,
     }
     return render(request, "core/search_results.html", context)
 
@@ -153,25 +346,31 @@ def add_comment(request, post_slug):
     form = CommentForm(request.POST)
 
     if form.is_valid():
-        comment = form.save(commit=False)
-        comment.post = post
-        comment.author = request.user
-        comment.save()
+        # Published by core.comment_queue, right away or in a worker
+        pending = enqueue_comment(post, request.user, form.cleaned_data["content"])
 
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             return JsonResponse(
                 {
                     "success": True,
+                    "pending_id": pending.pk,
+                    "status": pending.status,
+                    "status_url": reverse("core:comment_status", args=[pending.pk]),
                     "comment": {
-                        "author": comment.author.username,
-                        "content": comment.content,
-                        "created_at": comment.created_at.strftime(
+                        "author": request.user.username,
+                        "content": pending.content,
+                        "created_at": pending.created_at.strftime(
                             "%B %d, %Y at %I:%M %p"
                         ),
                     },
                 }
             )
-        messages.success(request, "Your comment has been added!")
+        if pending.status == PendingComment.PUBLISHED:
+            messages.success(request, "Your comment has been added!")
+        else:
+            messages.success(
+                request, "Your comment has been submitted and will appear shortly."
+            )
     else:
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             return JsonResponse({"success": False, "errors": form.errors})
@@ -180,6 +379,30 @@ def add_comment(request, post_slug):
     return redirect("core:post_detail", slug=post_slug)
 
 
+@login_required
+@require_http_methods(["GET"])
+def comment_status(request, pk):
+    """
+    Publishing status of a comment submitted with add_comment (AJAX polling)
+    """
+    pending = get_object_or_404(
+        PendingComment.objects.select_related("comment__post"),
+        pk=pk,
+        author=request.user,
+    )
+    data = {"pending_id": pending.pk, "status": pending.status}
+    if pending.status == PendingComment.FAILED:
+        data.update(success=False, errors={"__all__": [pending.error]})
+    else:
+        data["success"] = True
+    if pending.comment is not None:
+        data["comment"] = {
+            "id": pending.comment.pk,
+            "url": pending.comment.get_absolute_url(),
+        }
+    return JsonResponse(data)
+
+
 def register_view(request):
     """
     User registration view
@@ -187,8 +410,9 @@ def register_view(request):
     if request.method == "POST":
         form: UserCreationForm = UserCreationForm(request.POST)
         if form.is_valid():
-            user = form.save()
-            Profile.objects.create(user=user)
+            # The user's profile is created by a post_save signal
+            with transaction.atomic():
+                form.save()
             username = form.cleaned_data.get("username")
             messages.success(request, f"Account created for {username}!")
             return redirect("core:login")
@@ -203,16 +427,13 @@ def login_view(request):
     """
     if request.method == "POST":
         form = AuthenticationForm(request, data=request.POST)
+        # Validating the form authenticates (and, if the hasher changed,
+        # rehashes the password); hashing again here would double the cost
         if form.is_valid():
-            username = form.cleaned_data.get("username")
-            password = form.cleaned_data.get("password")
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                messages.info(request, f"You are now logged in as {username}.")
-                return redirect("core:home")
-            else:
-                messages.error(request, "Invalid username or password.")
+            user = form.get_user()
+            login(request, user)
+            messages.info(request, f"You are now logged in as {user.get_username()}.")
+            return redirect("core:home")
         else:
             messages.error(request, "Invalid username or password.")
     else:
@@ -234,7 +455,7 @@ def profile_view(request):
     """
     User profile view
     """
-    profile, created = Profile.objects.get_or_create(user=request.user)
+    profile = Profile.objects.for_user(request.user)
     user_posts = Post.objects.filter(author=request.user).select_related("category")
 
     context = {
@@ -249,7 +470,7 @@ def edit_profile(request):
     """
     Edit user profile view
     """
-    profile, created = Profile.objects.get_or_create(user=request.user)
+    profile = Profile.objects.for_user(request.user)
 
     if request.method == "POST":
         form = ProfileForm(request.POST, request.FILES, instance=profile)
@@ -1,6 +1,14 @@
 #!/usr/bin/env python
-"""Script to create sample data for Django blog application."""
+"""Script to create sample data for Django blog application.
 
+Without arguments it creates a small curated data set. With any size option
+it generates a seeded synthetic data set instead, e.g.::
+
+    python create_sample_data.py --users 100000 --tags 50000 \\
+        --posts 1000000 --comments 10000000 --workers 8
+"""
+
+import argparse
 import os
 from datetime import timedelta
 from typing import Any, Dict, List
@@ -30,8 +38,7 @@ def create_sample_data() -> None:
             first_name="John",
             last_name="Doe",
         )
-        Profile.objects.create(
-            user=john,
+        Profile.objects.filter(user=john).update(
             bio="A passionate writer and Django enthusiast. Love sharing knowledge about web development.",
             location="New York, USA",
             website="https://johndoe.dev",
@@ -46,8 +53,7 @@ def create_sample_data() -> None:
             first_name="Jane",
             last_name="Smith",
         )
-        Profile.objects.create(
-            user=jane,
+        Profile.objects.filter(user=jane).update(
             bio="Software engineer and tech blogger. Interested in AI and machine learning.",
             location="San Francisco, CA",
             website="https://janesmith.tech",
@@ -57,7 +63,8 @@ def create_sample_data() -> None:
     # Get users
     john = User.objects.get(username="john_doe")
     jane = User.objects.get(username="jane_smith")
-    admin = User.objects.get(username="admin")
+    # Comments are attributed to a superuser when there is one
+    admin = User.objects.filter(is_superuser=True).first() or jane
 
     # Create categories
     categories_data = [
@@ -659,5 +666,47 @@ The web development landscape is exciting and rapidly changing. Stay curious, ke
     print(f"Created {Comment.objects.count()} comments")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sizes = parser.add_argument_group("synthetic data set sizes")
+    for name in ("users", "categories", "tags", "posts", "comments"):
+        sizes.add_argument(f"--{name}", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="processes generating rows"
+    )
+    parser.add_argument("--chunk-size", type=int, default=2000, help="posts per chunk")
+    parser.add_argument(
+        "--no-index", action="store_true", help="skip rebuilding the search index"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    sizes = {
+        name: getattr(args, name)
+        for name in ("users", "categories", "tags", "posts", "comments")
+        if getattr(args, name) is not None
+    }
+    if not sizes:
+        create_sample_data()
+        return
+
+    from core.dataset import generate_dataset
+
+    created = generate_dataset(
+        **sizes,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        index=not args.no_index,
+        log=print,
+    )
+    print("Synthetic data creation completed!")
+    for name, count in created.items():
+        print(f"Created {count} {name}")
+
+
 if __name__ == "__main__":
-    create_sample_data()
+    main()
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total covers the whole stack
+    "core.server_timing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -57,10 +59,19 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.query_budget.QueryBudgetMiddleware",
 ]
 
 ROOT_URLCONF = "myproject.urls"
 
+# What to do when a view exceeds the query budget declared in its URLconf:
+# "log", "raise" or "off"
+QUERY_BUDGET_MODE = config("QUERY_BUDGET_MODE", default="log")
+
+# Send per-request db/template/cache timings to clients in a Server-Timing
+# header (they are always logged on the core.server_timing logger)
+SERVER_TIMING_HEADER = config("SERVER_TIMING_HEADER", default=DEBUG, cast=bool)
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -79,6 +90,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "myproject.wsgi.application"
 
+# Serve the async versions of the read views; myproject/asgi.py turns this on,
+# since async views under WSGI (and sync ones under ASGI) hop threads
+ASYNC_VIEWS = config("ASYNC_VIEWS", default=False, cast=bool)
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -91,6 +106,43 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (Redis, Memcached) in production so page cache
+# invalidation reaches every worker process.
+
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": config("CACHE_LOCATION", default="django-blog"),
+    }
+}
+
+# Sessions are read from the cache and written through to the database, so
+# they survive a cache flush; django.contrib.sessions.backends.cache skips the
+# database entirely. Expired rows are removed by manage.py sweep_sessions.
+SESSION_ENGINE = config(
+    "SESSION_ENGINE", default="django.contrib.sessions.backends.cached_db"
+)
+SESSION_CACHE_ALIAS = "default"
+
+# Submitted comments wait in an outbox until a pool of COMMENT_WORKERS
+# threads publishes them, COMMENT_BATCH_SIZE at a time (core.comment_queue);
+# 0 publishes them before the response. Claims older than
+# COMMENT_CLAIM_TIMEOUT seconds are taken over by another worker.
+COMMENT_WORKERS = config("COMMENT_WORKERS", default=2, cast=int)
+COMMENT_BATCH_SIZE = config("COMMENT_BATCH_SIZE", default=100, cast=int)
+COMMENT_CLAIM_TIMEOUT = config("COMMENT_CLAIM_TIMEOUT", default=60, cast=int)
+
+# Anonymous full-page cache for the public read views (seconds)
+PAGE_CACHE_TIMEOUT = config("PAGE_CACHE_TIMEOUT", default=600, cast=int)
+
+# Part of every page ETag; bump it when a deploy changes what pages render
+ETAG_VERSION = config("ETAG_VERSION", default="1")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -110,6 +162,23 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashers, preferred first. Passwords stored by any of the others
+# still verify and are rehashed with the first one at the user's next login.
+PASSWORD_HASHERS = config(
+    "PASSWORD_HASHERS",
+    default=",".join(
+        [
+            "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+            "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+            "django.contrib.auth.hashers.Argon2PasswordHasher",
+            "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+            "django.contrib.auth.hashers.ScryptPasswordHasher",
+        ]
+    ),
+    cast=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+)
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -131,9 +200,90 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 
+# Fingerprint collected files and precompress them (needs collectstatic, so
+# it is off in development by default). SERVE_STATIC serves STATIC_ROOT from
+# the app with immutable caching; turn it on only when no front-end server
+# or CDN serves /static/
+STATIC_MANIFEST = config("STATIC_MANIFEST", default=not DEBUG, cast=bool)
+SERVE_STATIC = config("SERVE_STATIC", default=False, cast=bool)
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Uploads are named by content hash and deduplicated (see core.storage);
+# manage.py collect_media_garbage removes the files no row references
+STORAGES = {
+    "default": {"BACKEND": "core.storage.ContentAddressedStorage"},
+    "staticfiles": {
+        "BACKEND": (
+            "core.storage.CompressedManifestStaticFilesStorage"
+            if STATIC_MANIFEST
+            else "django.contrib.staticfiles.storage.StaticFilesStorage"
+        ),
+    },
+}
+
+# Featured image derivatives
+# Widths (pixels) of the WebP/JPEG copies generated for every featured image,
+# and the size of the thread pool generating them (0 generates inline)
+
+IMAGE_DERIVATIVE_WIDTHS = config(
+    "IMAGE_DERIVATIVE_WIDTHS",
+    default="320,640,960,1280",
+    cast=lambda value: [int(width) for width in value.split(",") if width.strip()],
+)
+IMAGE_DERIVATIVE_WORKERS = config("IMAGE_DERIVATIVE_WORKERS", default=2, cast=int)
+
+# Post view counting
+# Views are buffered ("local" per process or "cache" shared through CACHES)
+# and flushed to the database at most once per interval (seconds).
+# manage.py flush_view_counts needs "cache" and a cache shared between
+# processes; local buffers are flushed by the web processes themselves.
+
+VIEW_COUNT_BUFFER = config("VIEW_COUNT_BUFFER", default="local")
+VIEW_COUNT_FLUSH_INTERVAL = config("VIEW_COUNT_FLUSH_INTERVAL", default=10, cast=int)
+
+# Search
+# Dotted path to a core.search backend; empty picks the best one for the
+# database (SQLite FTS5, PostgreSQL tsvector, or an icontains scan).
+
+SEARCH_BACKEND = config("SEARCH_BACKEND", default="")
+
+# Number of related posts precomputed per post by update_related_posts
+RELATED_POSTS_COUNT = config("RELATED_POSTS_COUNT", default=3, cast=int)
+
+# Sparse corpus saved by update_related_posts for its next incremental run
+RELATED_POSTS_CORPUS_PATH = config(
+    "RELATED_POSTS_CORPUS_PATH", default=str(BASE_DIR / "related_corpus.npz")
+)
+
+# Snapshot used by core.search.InMemorySearchBackend, and how often (seconds)
+# workers check it for a newer version
+SEARCH_INDEX_PATH = config(
+    "SEARCH_INDEX_PATH", default=str(BASE_DIR / "search_index.bin")
+)
+SEARCH_INDEX_RELOAD_INTERVAL = config(
+    "SEARCH_INDEX_RELOAD_INTERVAL", default=30, cast=int
+)
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "core.server_timing": {
+            "handlers": ["console"],
+            "level": config("SERVER_TIMING_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
+    },
+}
+
 LOGIN_URL = "/login/"
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/"
@@ -15,14 +15,18 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
 from typing import List
 
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.urls.resolvers import URLResolver
 
+from core.assets import serve_static
+from core.storage import serve as serve_media
+
 urlpatterns: List[URLResolver] = [
     path("admin/", admin.site.urls),
     path("", include("core.urls")),
@@ -30,5 +34,17 @@ urlpatterns: List[URLResolver] = [
 
 if settings.DEBUG:
     # Type ignore for static patterns as they return URLPattern, not URLResolver
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)  # type: ignore
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)  # type: ignore
+    # Content-addressed uploads are served with immutable caching headers
+    urlpatterns += static(  # type: ignore
+        settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT
+    )
+
+if settings.SERVE_STATIC:
+    # Collected (fingerprinted, precompressed) files, cached for a year
+    urlpatterns += [  # type: ignore
+        re_path(
+            rf"^{re.escape(settings.STATIC_URL.lstrip('/'))}(?P<path>.*)$",
+            serve_static,
+            {"document_root": settings.STATIC_ROOT},
+        )
+    ]
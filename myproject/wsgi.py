@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
 application = get_wsgi_application()
+
+# Map the in-process search index snapshot (when configured) at startup, so
+# workers forked from a preloaded app share its pages instead of rebuilding it
+from core.search import warm_search_backend  # noqa: E402
+
+warm_search_backend()